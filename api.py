@@ -0,0 +1,96 @@
+# Pythonから直接呼び出すためのAPI。
+#
+#   from api import rename, organize
+#
+#   run = rename('/photos', recursive=True, dry_run=True)
+#   for result in run:              # FileResult を1件ずつ受け取る
+#       print(result.source, result.action, result.target, result.reason)
+#       if should_stop():
+#           run.cancel()            # 実行中のファイルを終えた時点で中断する
+#   print(run.summary.to_dict())    # 件数・理由別の件数・所要時間など
+#
+# rename / organize / rebalance の引数はそれぞれ iter_rename_results / iter_organize_results /
+# iter_rebalance_results と同じ。
+# ファイルごとのログは出力しないため、必要に応じて result.message を利用する。
+
+from results import (
+    FileResult,
+    RunSummary,
+    Run,
+    ACTION_RENAME,
+    ACTION_MOVE,
+    ACTION_EXTRACT,
+    ACTION_SKIP,
+    ACTION_ERROR,
+    REASON_UNSUPPORTED,
+    REASON_ALREADY_RENAMED,
+    REASON_ALREADY_NAMED,
+    REASON_NO_DATETIME,
+    REASON_DUPLICATE,
+    REASON_INVALID_DATETIME,
+    REASON_PERMISSION,
+    REASON_OS_ERROR,
+    REASON_UNEXPECTED,
+    REASON_TIMEOUT,
+    REASON_QUARANTINED,
+    REASON_VERIFY_FAILED,
+    DELTA_NEW,
+    DELTA_CHANGED,
+    DELTA_RETARGETED,
+    DELTA_UNCHANGED,
+)
+from rename_images import iter_rename_results, rename_run as rename, NameIndexCache, ORDER_NAME, ORDER_CAPTURE
+from organize_files import iter_organize_results, organize_run as organize
+from rebalance import iter_rebalance_results, rebalance_run as rebalance
+from layout import LayoutPolicy
+from plan import PlanStore
+from physical_order import READ_ORDER_NAME, READ_ORDER_INODE, READ_ORDER_EXTENT
+from dest_index import DestinationIndex
+from catalog import Catalog
+from quarantine import Quarantine
+from utils import MetadataTimeoutError
+
+__all__ = [
+    'rename',
+    'organize',
+    'rebalance',
+    'iter_rename_results',
+    'iter_organize_results',
+    'iter_rebalance_results',
+    'FileResult',
+    'RunSummary',
+    'Run',
+    'NameIndexCache',
+    'DestinationIndex',
+    'Catalog',
+    'LayoutPolicy',
+    'Quarantine',
+    'PlanStore',
+    'MetadataTimeoutError',
+    'ORDER_NAME',
+    'ORDER_CAPTURE',
+    'READ_ORDER_NAME',
+    'READ_ORDER_INODE',
+    'READ_ORDER_EXTENT',
+    'ACTION_RENAME',
+    'ACTION_MOVE',
+    'ACTION_EXTRACT',
+    'ACTION_SKIP',
+    'ACTION_ERROR',
+    'REASON_UNSUPPORTED',
+    'REASON_ALREADY_RENAMED',
+    'REASON_ALREADY_NAMED',
+    'REASON_NO_DATETIME',
+    'REASON_DUPLICATE',
+    'REASON_INVALID_DATETIME',
+    'REASON_PERMISSION',
+    'REASON_OS_ERROR',
+    'REASON_UNEXPECTED',
+    'REASON_TIMEOUT',
+    'REASON_QUARANTINED',
+    'REASON_VERIFY_FAILED',
+    'DELTA_NEW',
+    'DELTA_CHANGED',
+    'DELTA_RETARGETED',
+    'DELTA_UNCHANGED',
+]
@@ -0,0 +1,116 @@
+import tarfile
+import tempfile
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+
+import fs
+
+# 定数定義
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tgz', '.tar.gz', '.tbz2', '.tar.bz2', '.txz', '.tar.xz')
+ARCHIVE_HEAD_BYTES = 256 * 1024  # 形式の判定とEXIFの読み取りに使う、メンバーの先頭のバイト数
+IGNORED_MEMBER_DIRS = {'__MACOSX'}  # macOS の Finder が追加するリソースフォーク
+SPOOL_MEMORY_BYTES = 16 * 1024 * 1024  # spool_rest で読み切るメンバーをメモリ上に置く上限 (超えると一時ファイルに書く)
+
+# アーカイブのメンバー。stream は先頭から順に読むファイルオブジェクト (次のメンバーに進むと読めなくなる)。
+# メンバーを開けなかった場合は stream が None で、error に開けなかった理由の例外を設定する
+ArchiveMember = namedtuple('ArchiveMember', 'name size mtime stream error', defaults=(None,))
+
+
+def is_archive(path) -> bool:
+    """パスが対応しているアーカイブ (ZIP / TAR) のファイルかどうか"""
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES) and fs.is_file(path)
+
+
+def member_file_name(name: str):
+    """
+    メンバーのパスから宛先に置くファイル名を返す。対象外 (隠しファイル・リソースフォークなど) は None。
+    アーカイブ内のディレクトリ構成は使わないため、'../' などを含むパスでも宛先の外には書き込まない。
+    """
+    path = PurePosixPath(name.replace('\\', '/'))
+    if not path.name or path.name.startswith('.') or IGNORED_MEMBER_DIRS & set(path.parts):
+        return None
+    return path.name
+
+
+def read_head(stream, size: int = ARCHIVE_HEAD_BYTES) -> bytes:
+    """ストリームの先頭を size バイトまで読む (1回の read で足りない場合も続けて読む)"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def spool_rest(stream, tail_size: int):
+    """
+    ストリームの残りを一時ファイル (小さければメモリ上) に読み切り、(先頭に戻した一時ファイル, 残りの末尾 tail_size バイト) を返す。
+    メンバーを宛先に書き出す前に、末尾も含めた内容を確かめる場合に使う。一時ファイルは呼び出し側で閉じる。
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    tail = b''
+    try:
+        while True:
+            chunk = stream.read(fs.COPY_BUFFER_BYTES)
+            if not chunk:
+                break
+            spool.write(chunk)
+            tail = (tail + chunk)[-tail_size:]
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, tail
+
+
+def _zip_member_mtime(info: zipfile.ZipInfo, fallback: float) -> float:
+    """ZIPメンバーの更新日時。日付が0 (1980-00-00) などの不正な値の場合は fallback を返す"""
+    try:
+        return datetime(*info.date_time).timestamp()
+    except (ValueError, OverflowError):
+        return fallback
+
+
+def _iter_zip_members(archive_path: Path):
+    archive_mtime = fs.stat(archive_path).st_mtime
+    with zipfile.ZipFile(archive_path) as archive:
+        # 中央ディレクトリは末尾にあるため最初に読み、メンバーはファイル内の位置の順に読む
+        infos = sorted((info for info in archive.infolist() if not info.is_dir()), key=lambda info: info.header_offset)
+        for info in infos:
+            mtime = _zip_member_mtime(info, archive_mtime)
+            try:
+                stream = archive.open(info)
+            except (NotImplementedError, RuntimeError) as e:
+                # 未対応の圧縮方式 (Deflate64 など) や暗号化されたメンバーはそのメンバーだけを開けないため、次に進む
+                yield ArchiveMember(info.filename, info.file_size, mtime, None, e)
+                continue
+            with stream:
+                yield ArchiveMember(info.filename, info.file_size, mtime, stream)
+
+
+def _iter_tar_members(archive_path: Path):
+    # ストリームモード ('r|*') で開き、圧縮されていても先頭から1回だけ読む
+    with tarfile.open(archive_path, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            stream = archive.extractfile(info)
+            yield ArchiveMember(info.name, info.size, float(info.mtime), stream)
+
+
+def iter_archive_members(archive_path):
+    """
+    アーカイブのファイルのメンバーを、アーカイブを先頭から1回読み進める順に返す。
+    各メンバーの stream は次のメンバーを取り出す前に読み終える必要がある。
+    開けないメンバー (未対応の圧縮方式・暗号化) は stream を None、error を例外にして返す。
+    """
+    archive_path = Path(archive_path)
+    if zipfile.is_zipfile(archive_path):
+        yield from _iter_zip_members(archive_path)
+    else:
+        yield from _iter_tar_members(archive_path)
@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import fs
+from fs import MemoryBackend, FS_OPERATIONS
+from utils import setup_logging, set_exiftool_pool, EXIFTOOL_DATETIME_ORIGINAL_TAG, EXIFTOOL_MODEL_TAG
+from rename_images import rename_run
+from organize_files import organize_run
+from dest_index import DestinationIndex
+from physical_order import READ_ORDERS, READ_ORDER_NAME
+
+# 定数定義
+BENCHMARK_ROOT = '/benchmark'  # メモリ上のライブラリを置くパス
+SOURCE_DIR = f'{BENCHMARK_ROOT}/source'
+DEST_DIR = f'{BENCHMARK_ROOT}/destination'
+BASE_DATE = datetime(2020, 1, 1)
+DATE_SPAN_DAYS = 365 * 3  # 撮影日時を散らばらせる期間
+DEVICE_NAMES = ('iPhone_15', 'Pixel_8', 'EOS_R5')
+COMMANDS = ('rename', 'organize')
+
+
+class SyntheticMetadata:
+    """
+    ExifToolのセッションプールの代わりに、ファイル名から決まる撮影日時と機種を返す。
+    utils.set_exiftool_pool に設定して使う。latency (秒) で1件ごとの読み取り時間を再現する。
+    backend を指定すると、読んだファイルのディスク上の位置 (MemoryBackend.offset) を順にたどり、
+    直前に読んだファイルからの移動量の合計を seek_bytes に集計する。
+    """
+
+    def __init__(self, latency: float = 0, backend: MemoryBackend = None):
+        self.latency = latency
+        self.backend = backend
+        self.seek_bytes = 0
+        self._head = 0  # 直前に読んだ位置
+        self._lock = threading.Lock()
+
+    def get(self, file_path, timeout=None) -> dict:
+        if self.backend is not None:
+            offset = self.backend.offset(file_path)
+            with self._lock:
+                self.seek_bytes += abs(offset - self._head)
+                self._head = offset
+        if self.latency:
+            time.sleep(self.latency)
+        digest = int.from_bytes(hashlib.blake2b(str(file_path).encode('utf-8'), digest_size=8).digest(), 'big')
+        taken = BASE_DATE + timedelta(seconds=digest % (DATE_SPAN_DAYS * 86400))
+        return {
+            EXIFTOOL_DATETIME_ORIGINAL_TAG: taken.strftime('%Y:%m:%d %H:%M:%S'),
+            EXIFTOOL_MODEL_TAG: DEVICE_NAMES[digest % len(DEVICE_NAMES)],
+        }
+
+
+def build_library(backend: MemoryBackend, files: int, dirs: int, seed: int = None):
+    """
+    メモリ上のソースディレクトリに files 件の画像ファイルを dirs 個のディレクトリへ振り分けて作成する。
+    何度も取り込み・削除を繰り返したライブラリのように、ディスク上の位置がファイル名の順と一致しないよう
+    ファイルは順不同に作成する。
+    """
+    rng = random.Random(seed)
+    order = list(range(files))
+    rng.shuffle(order)
+    for i in order:
+        backend.add_file(f"{SOURCE_DIR}/dir_{i % dirs:05d}/IMG_{i:07d}.JPG", size=rng.randint(1, 8) * 1024 * 1024)
+    backend.mkdir(DEST_DIR)
+    backend.calls.clear()
+
+
+def parse_rates(values, name: str) -> dict:
+    """'操作=値' の指定を辞書にする。操作に all を指定するとすべての操作に適用する"""
+    rates = {}
+    for value in values or ():
+        operation, _, number = value.partition('=')
+        operations = FS_OPERATIONS if operation == 'all' else (operation,)
+        if not all(op in FS_OPERATIONS for op in operations):
+            raise ValueError(f"{name} の操作名が不明です: {operation}（{', '.join(FS_OPERATIONS)}, all のいずれか）")
+        for op in operations:
+            rates[op] = float(number)
+    return rates
+
+
+def run_benchmark(command: str, files: int, dirs: int, latency: dict = None, failure_rate: dict = None,
+                  metadata_latency: float = 0, seed: int = None, **options) -> dict:
+    """
+    メモリ上のファイルシステムで rename または organize を実行し、処理時間と件数、
+    ファイル操作の呼び出し回数、EXIF読み取りのシークの移動量を辞書で返す。options は rename_run / organize_run の引数。
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"不明なコマンドです: {command}（{', '.join(COMMANDS)} のいずれかを指定してください）")
+    backend = MemoryBackend(seed=seed)
+    build_library(backend, files, dirs, seed)
+    # 作成中は遅延・障害を注入せず、計測対象の処理にのみ適用する
+    backend.latency = dict(latency or {})
+    backend.failure_rate = dict(failure_rate or {})
+
+    fs.set_backend(backend)
+    metadata = SyntheticMetadata(metadata_latency, backend)
+    set_exiftool_pool(metadata)
+    dest_index = None
+    try:
+        if command == 'rename':
+            run = rename_run(SOURCE_DIR, recursive=True, **options)
+        else:
+            if options.get('use_dest_index') and options.get('dest_index') is None:
+                # インデックス本体 (SQLite) は実ファイルシステムに置けないため、メモリ上に作る
+                dest_index = DestinationIndex(DEST_DIR, index_file=':memory:')
+                options['dest_index'] = dest_index
+            run = organize_run(SOURCE_DIR, DEST_DIR, **options)
+        started = time.perf_counter()
+        summary = run.run_to_completion()
+        elapsed = time.perf_counter() - started
+    finally:
+        if dest_index is not None:
+            dest_index.close()
+        fs.set_backend(None)
+        set_exiftool_pool(None)
+
+    return {
+        'command': command,
+        'files': files,
+        'dirs': dirs,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(summary.processed / elapsed, 1) if elapsed > 0 else None,
+        'counts': summary.counts,
+        'reasons': dict(summary.reasons),
+        'calls': dict(backend.calls),
+        'seek_mb': round(metadata.seek_bytes / (1024 * 1024), 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='メモリ上のファイルシステムで、遅延や障害を注入して rename / organize の性能を計測します。')
+    parser.add_argument('command', choices=COMMANDS, help='計測するコマンド')
+    parser.add_argument('--files', type=int, default=100000, help='作成するファイル数。デフォルト: 100000')
+    parser.add_argument('--dirs', type=int, default=1000, help='ファイルを振り分けるディレクトリ数。デフォルト: 1000')
+    parser.add_argument('--latency-ms', action='append', metavar='OP=MS', help=f'操作ごとの遅延(ミリ秒)。複数回指定できます。操作: {", ".join(FS_OPERATIONS)}, all')
+    parser.add_argument('--failure-rate', action='append', metavar='OP=RATE', help='操作ごとの失敗率 (0〜1)。複数回指定できます。')
+    parser.add_argument('--metadata-latency-ms', type=float, default=0, help='1ファイルのEXIF読み取りにかかる時間(ミリ秒)。デフォルト: 0')
+    parser.add_argument('--max-concurrency', type=int, default=1, help='EXIF読み取り (organize は移動も) の最大同時実行数。デフォルト: 1')
+    parser.add_argument('--walk-workers', type=int, default=1, help='ディレクトリ走査の並列数。デフォルト: 1')
+    parser.add_argument('--read-order', choices=READ_ORDERS, default=READ_ORDER_NAME, help=f'EXIFを読む順序。name と比べるとシークの移動量 (seek_mb) の削減が分かります。デフォルト: {READ_ORDER_NAME}')
+    parser.add_argument('--dest-index', action='store_true', help='organize で宛先インデックスを使います (インデックスはメモリ上に作成)。')
+    parser.add_argument('--seed', type=int, help='乱数のシード（障害の発生箇所を再現する場合に指定）')
+    parser.add_argument('--log-file', help='ログをファイルに出力します。')
+    args = parser.parse_args()
+    if args.files < 1 or args.dirs < 1 or args.max_concurrency < 1 or args.walk_workers < 1:
+        parser.error('--files, --dirs, --max-concurrency, --walk-workers は1以上を指定してください。')
+    if args.dest_index and args.command != 'organize':
+        parser.error('--dest-index は organize の計測にのみ指定できます。')
+    try:
+        latency = {op: ms / 1000 for op, ms in parse_rates(args.latency_ms, '--latency-ms').items()}
+        failure_rate = parse_rates(args.failure_rate, '--failure-rate')
+    except ValueError as e:
+        parser.error(str(e))
+
+    setup_logging(args.log_file)
+    # ファイルごとの結果は出力せず、計測結果のみを表示する
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run_benchmark(
+        args.command, args.files, args.dirs, latency, failure_rate,
+        metadata_latency=args.metadata_latency_ms / 1000, seed=args.seed,
+        max_concurrency=args.max_concurrency, walk_workers=args.walk_workers, read_order=args.read_order,
+        **({'use_dest_index': True} if args.dest_index else {}),
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,273 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import fs
+from utils import (
+    setup_logging,
+    get_exif_data_with_exiftool,
+    MetadataTimeoutError,
+    DEFAULT_METADATA_TIMEOUT,
+    EXIFTOOL_DATETIME_ORIGINAL_TAG,
+    SUPPORTED_EXTENSIONS,
+)
+from concurrency import imap_bounded
+from walker import walk_directories
+from sniff import sniff_format, read_metadata, UnsupportedMediaError
+from rename_images import get_device_name
+
+# 定数定義
+CATALOG_FILENAME = '.image_renamer_catalog.sqlite'  # 対象ディレクトリ直下に作成するカタログファイル名
+DEFAULT_CATALOG_WORKERS = 4  # メタデータ読み取りの並列数
+COMMIT_BATCH = 1000  # この件数ごとに書き込む (中断しても読み取り済みの分は残る)
+GROUP_COLUMNS = {
+    'year': "substr(taken, 1, 4)",
+    'month': "substr(taken, 6, 2)",
+    'device': "device",
+    'extension': "extension",
+}
+DEFAULT_GROUP_BY = ('year', 'month')
+OUTPUT_FORMATS = ('json', 'csv')
+
+
+def _scan_media(root: Path, sniff: bool):
+    """root 配下のファイルを (相対パス, サイズ, 更新日時 ns) で返す。隠しファイルと対象外の拡張子は除く"""
+    for directory in walk_directories(root):
+        try:
+            entries = fs.scandir(directory)
+        except OSError as e:
+            logging.error(f"エラー: ディレクトリ '{directory}' を読み取れません: {e}")
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if not sniff and Path(entry.name).suffix.lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat()
+            except OSError as e:
+                logging.error(f"エラー: '{entry.path}' の情報を取得できません: {e}")
+                continue
+            yield Path(entry.path).relative_to(root).as_posix(), stat.st_size, stat.st_mtime_ns
+
+
+class Catalog:
+    """
+    ディレクトリ配下の画像・動画の撮影日時・デバイス名・拡張子・サイズを保持するカタログ。
+    SQLiteに永続化し、refresh ではサイズと更新日時が変わったファイルだけメタデータを読み直す。
+    summarize で年・月・デバイス・拡張子ごとの件数やサイズの合計をすぐに集計できる。
+    """
+
+    def __init__(self, root, catalog_file=None):
+        self.root = Path(root)
+        self.catalog_file = Path(catalog_file) if catalog_file else self.root / CATALOG_FILENAME
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.catalog_file), check_same_thread=False)
+        # taken は 'YYYY-MM-DD HH:MM:SS' (撮影日時が無ければ NULL)。error は読み取りに失敗した理由で、次回読み直す
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS media ('
+            ' path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' extension TEXT NOT NULL, taken TEXT, device TEXT, error TEXT)'
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+
+    def _read(self, relative_path: str, metadata_timeout: float, sniff: bool):
+        """1ファイルのメタデータを読み、(撮影日時, デバイス名, エラー) を返す。画像・動画でなければ None"""
+        file_path = self.root / relative_path
+        try:
+            if sniff:
+                exif_data = read_metadata(file_path, sniff_format(file_path), metadata_timeout)
+            else:
+                exif_data = get_exif_data_with_exiftool(file_path, metadata_timeout)
+        except UnsupportedMediaError:
+            return None
+        except MetadataTimeoutError as e:
+            return None, None, f"timeout: {e}"
+        except OSError as e:
+            return None, None, f"os_error: {e}"
+
+        taken = None
+        date_str = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
+        if date_str:
+            try:
+                taken = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                logging.warning(f"不正な日付フォーマットのため、撮影日時なしとして記録します: {file_path}")
+        return taken, get_device_name(exif_data), None
+
+    def refresh(self, workers: int = DEFAULT_CATALOG_WORKERS, metadata_timeout: float = DEFAULT_METADATA_TIMEOUT,
+                sniff: bool = False, quiet: bool = True) -> dict:
+        """
+        ディレクトリを走査してカタログを最新にする。新しいファイルとサイズ・更新日時が変わったファイル、
+        前回読み取りに失敗したファイルだけメタデータを workers 並列で読み、無くなったファイルは削除する。
+        sniff が True の場合は拡張子ではなく先頭バイトで形式を判定し、形式ごとに最も軽い方法でEXIFを読む。
+        件数を {'added', 'updated', 'removed', 'unchanged'} の辞書で返す。
+        """
+        started = time.perf_counter()
+        with self._lock:
+            known = {
+                path: (size, mtime_ns, error)
+                for path, size, mtime_ns, error in self._conn.execute('SELECT path, size, mtime_ns, error FROM media')
+            }
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        stale = []
+        for relative_path, size, mtime_ns in _scan_media(self.root, sniff):
+            previous = known.pop(relative_path, None)
+            if previous is not None and previous[:2] == (size, mtime_ns) and previous[2] is None:
+                counts['unchanged'] += 1
+            else:
+                stale.append((relative_path, size, mtime_ns, previous is None))
+
+        def read(item):
+            relative_path, size, mtime_ns, is_new = item
+            return item, self._read(relative_path, metadata_timeout, sniff)
+
+        # tqdm は読み込みに時間がかかるため、更新するときだけ読み込む
+        from tqdm import tqdm
+        rows = []
+        bar = tqdm(total=len(stale), desc="カタログ更新中", unit='file', disable=quiet)
+        try:
+            for (relative_path, size, mtime_ns, is_new), metadata in imap_bounded(read, stale, workers):
+                bar.update(1)
+                if metadata is None:
+                    continue
+                taken, device, error = metadata
+                if error is not None:
+                    logging.error(f"エラー: '{self.root / relative_path}' のメタデータを読み取れません: {error}")
+                counts['added' if is_new else 'updated'] += 1
+                rows.append((relative_path, size, mtime_ns, Path(relative_path).suffix.lower(), taken, device, error))
+                if len(rows) >= COMMIT_BATCH:
+                    self._upsert(rows)
+                    rows = []
+        finally:
+            bar.close()
+            self._upsert(rows)
+
+        # 走査で見つからなかったファイル (削除・移動済み) を取り除く
+        with self._lock:
+            self._conn.executemany('DELETE FROM media WHERE path = ?', ((path,) for path in known))
+            self._conn.commit()
+        counts['removed'] = len(known)
+        logging.info(
+            f"カタログを更新しました ({time.perf_counter() - started:.1f}秒): 追加 {counts['added']}件, "
+            f"更新 {counts['updated']}件, 削除 {counts['removed']}件, 変更なし {counts['unchanged']}件"
+        )
+        return counts
+
+    def _upsert(self, rows):
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO media (path, size, mtime_ns, extension, taken, device, error)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            self._conn.commit()
+
+    def summarize(self, group_by=DEFAULT_GROUP_BY) -> list:
+        """
+        group_by の項目 (GROUP_COLUMNS の 'year' / 'month' / 'device' / 'extension') ごとに、
+        件数 (count)・サイズの合計 (total_bytes)・撮影日時の無い件数 (missing_date) を辞書のリストで返す。
+        撮影日時の無いファイルの year / month は None になる。
+        """
+        unknown = [name for name in group_by if name not in GROUP_COLUMNS]
+        if unknown:
+            raise ValueError(f"集計できない項目です: {', '.join(unknown)}（{', '.join(GROUP_COLUMNS)} のいずれか）")
+        keys = [f"{GROUP_COLUMNS[name]} AS {name}" for name in group_by]
+        query = (
+            f"SELECT {', '.join(keys + ['COUNT(*)', 'SUM(size)', 'SUM(taken IS NULL)'])} FROM media"
+        )
+        if group_by:
+            order = ', '.join(f"{name} IS NULL, {name}" for name in group_by)
+            query += f" GROUP BY {', '.join(group_by)} ORDER BY {order}"
+        with self._lock:
+            rows = self._conn.execute(query).fetchall()
+        summary = []
+        for row in rows:
+            count, total_bytes, missing_date = row[len(group_by):]
+            if not count:
+                continue
+            entry = dict(zip(group_by, row[:len(group_by)]))
+            entry.update({'count': count, 'total_bytes': total_bytes, 'missing_date': missing_date})
+            summary.append(entry)
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def format_summary(summary: list, group_by, output_format: str) -> str:
+    """集計結果を JSON または CSV の文字列にする"""
+    if output_format == 'json':
+        return json.dumps(summary, ensure_ascii=False, indent=2)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[*group_by, 'count', 'total_bytes', 'missing_date'], lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(summary)
+    return buffer.getvalue()
+
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    default_catalog_file = os.getenv('CATALOG_FILE')
+    default_log_file = os.getenv('CATALOG_LOG_FILE')
+    default_workers = int(os.getenv('CATALOG_WORKERS', str(DEFAULT_CATALOG_WORKERS)))
+    default_group_by = os.getenv('CATALOG_GROUP_BY', ','.join(DEFAULT_GROUP_BY))
+    default_format = os.getenv('CATALOG_FORMAT', 'json')
+    default_sniff = os.getenv('CATALOG_SNIFF', 'false').lower() in ('true', '1', 't')
+
+    parser = argparse.ArgumentParser(prog=prog, description='ライブラリの撮影日時・デバイス・拡張子ごとの件数とサイズを、メタデータのカタログから集計します。')
+    parser.add_argument('directory', help='集計するディレクトリ（organize の宛先やソースディレクトリ）')
+    parser.add_argument('--catalog-file', default=default_catalog_file, help=f'カタログのパス。デフォルト: 対象ディレクトリの {CATALOG_FILENAME}')
+    parser.add_argument('--group-by', default=default_group_by, help=f'集計の単位をカンマ区切りで指定します（{", ".join(GROUP_COLUMNS)}）。空にすると全体の合計のみ。デフォルト: {default_group_by}')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=default_format, help=f'出力形式。デフォルト: {default_format}')
+    parser.add_argument('--output', help='集計結果を書き出すファイルのパス。指定しない場合は標準出力に出力します。')
+    parser.add_argument('--no-refresh', action='store_true', help='ディレクトリを走査せず、カタログの内容のみで集計します。')
+    parser.add_argument('--workers', type=int, default=default_workers, help=f'メタデータ読み取りの並列数。デフォルト: {default_workers}')
+    parser.add_argument('--metadata-timeout', type=float, default=DEFAULT_METADATA_TIMEOUT, help=f'1ファイルのEXIF読み取りの制限時間(秒)。デフォルト: {DEFAULT_METADATA_TIMEOUT}')
+    parser.add_argument('--sniff', action='store_true', default=default_sniff, help=f'拡張子ではなくファイルの先頭バイトで形式を判定し、形式ごとに最も軽い方法でEXIFを読みます。デフォルト: {default_sniff}')
+    parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力します。デフォルト: {default_log_file}')
+    parser.add_argument('-q', '--quiet', action='store_true', help='プログレスバーを表示しません。')
+    args = parser.parse_args(argv)
+    group_by = [name.strip() for name in args.group_by.split(',') if name.strip()]
+    if any(name not in GROUP_COLUMNS for name in group_by):
+        parser.error(f'--group-by には {", ".join(GROUP_COLUMNS)} を指定してください。')
+    if args.workers < 1 or args.metadata_timeout <= 0:
+        parser.error('--workers は1以上、--metadata-timeout は0より大きい値を指定してください。')
+    if not os.path.isdir(args.directory):
+        parser.error(f"指定されたパス '{args.directory}' はディレクトリではありません。")
+
+    setup_logging(args.log_file)
+    catalog = Catalog(args.directory, args.catalog_file)
+    try:
+        if not args.no_refresh:
+            catalog.refresh(args.workers, args.metadata_timeout, args.sniff, quiet=args.quiet)
+        text = format_summary(catalog.summarize(group_by), group_by, args.format)
+    finally:
+        catalog.close()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        logging.info(f"集計結果を出力しました: '{args.output}'")
+    else:
+        sys.stdout.write(text if text.endswith('\n') else text + '\n')
+
+
+if __name__ == '__main__':
+    main()
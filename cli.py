@@ -0,0 +1,42 @@
+import argparse
+import importlib
+import sys
+
+# 定数定義
+PROG = 'image-renamer'
+# サブコマンド -> (実装モジュール, 説明)。モジュールは実行するサブコマンドの分だけ読み込む
+COMMANDS = {
+    'rename': ('rename_images', 'EXIF情報に基づいて画像ファイルをリネームします。'),
+    'organize': ('organize_files', '日付情報に基づいてファイルを YYYY/MM 形式のディレクトリに整理します。'),
+    'rebalance': ('rebalance', '大きくなりすぎた月フォルダをサブフォルダに再配置します。'),
+    'catalog': ('catalog', 'ライブラリのメタデータのカタログを更新して集計します。'),
+    'serve': ('server', 'rename/organize のジョブを受け付ける常駐サーバーを起動します。'),
+    'queue': ('workqueue', '複数ノードで分担してリネームするための作業キューを操作します。'),
+}
+# 起動時間の予算 (秒)。-X importtime で計測した import の合計がこれを超えたら test_startup が失敗する
+HELP_IMPORT_BUDGET = 0.05  # `image-renamer --help`
+COMMAND_IMPORT_BUDGET = 0.25  # サブコマンドを読み込んで何もせずに終わる実行 (空ディレクトリの --dry-run など)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog=PROG,
+        description='画像・動画ファイルのリネームと整理を行います。各コマンドの引数は `image-renamer <command> --help` で確認できます。',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='コマンド:\n' + '\n'.join(f'  {name:<10} {help_text}' for name, (_, help_text) in COMMANDS.items()),
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help=f"実行するコマンド（{', '.join(COMMANDS)}）")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='コマンドに渡す引数')
+    return parser
+
+
+def main(argv=None):
+    """`image-renamer <command> [args...]` を実行する。サブコマンドのモジュールはここで初めて読み込む"""
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    module_name, _ = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    return module.main(args.args, prog=f'{PROG} {args.command}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import csv
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+# 定数定義
+DEFAULT_LATENCY_TOLERANCE = 2.0  # ベースラインの何倍の遅延で輻輳とみなすか
+DEFAULT_MAX_ERROR_RATE = 0.1  # 許容するエラー率
+DEFAULT_BACKOFF_FACTOR = 0.5  # 輻輳時の同時実行数の縮小率
+MIN_WINDOW_SIZE = 4  # 調整判定に必要な最小サンプル数
+BASELINE_DRIFT = 1.05  # ベースライン遅延を少しずつ緩めて環境変化に追従させる係数
+MAX_LANE_BACKLOG = 10000  # レーン振り分けのために先読みする最大件数
+
+
+class AIMDController:
+    """
+    AIMD (加算増加・乗算減少) 方式で同時実行数を調整するリミッター。
+    処理ごとの遅延とエラーを記録し、一定数のサンプルが集まるたびに上限を見直す。
+    """
+
+    def __init__(self, name: str, min_limit: int = 1, max_limit: int = 1,
+                 latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+                 max_error_rate: float = DEFAULT_MAX_ERROR_RATE,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR):
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError(f"同時実行数の範囲が不正です: min={min_limit}, max={max_limit}")
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.backoff_factor = backoff_factor
+
+        self.limit = min_limit
+        self.in_flight = 0
+        self._baseline = None
+        self._samples = []
+        self._cond = threading.Condition()
+        self._start = time.monotonic()
+        # 同時実行数の推移 (経過秒, 上限)
+        self.history = [(0.0, self.limit)]
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, error: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            self._samples.append((latency, error))
+            if len(self._samples) >= max(self.limit, MIN_WINDOW_SIZE):
+                self._adjust()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """同時実行枠を1つ確保し、処理時間とエラー有無を記録する"""
+        self.acquire()
+        start = time.monotonic()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.release(time.monotonic() - start, error)
+
+    def _adjust(self):
+        samples, self._samples = self._samples, []
+        errors = sum(1 for _, error in samples if error)
+        latencies = [latency for latency, error in samples if not error]
+        error_rate = errors / len(samples)
+
+        congested = error_rate > self.max_error_rate
+        if latencies:
+            average = sum(latencies) / len(latencies)
+            if self._baseline is None or average < self._baseline:
+                self._baseline = average
+            else:
+                self._baseline *= BASELINE_DRIFT
+            if average > self._baseline * self.latency_tolerance:
+                congested = True
+
+        if congested:
+            new_limit = max(self.min_limit, int(self.limit * self.backoff_factor))
+        else:
+            new_limit = min(self.max_limit, self.limit + 1)
+
+        if new_limit != self.limit:
+            self.limit = new_limit
+            self.history.append((time.monotonic() - self._start, new_limit))
+
+    @property
+    def peak(self) -> int:
+        return max(limit for _, limit in self.history)
+
+
+def write_concurrency_metrics(metrics_file, controllers):
+    """各コントローラーの同時実行数の推移をCSV形式で書き出す"""
+    with open(metrics_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['elapsed_seconds', 'controller', 'limit'])
+        for controller in controllers:
+            for elapsed, limit in controller.history:
+                writer.writerow([f"{elapsed:.3f}", controller.name, limit])
+
+
+def weighted_interleave(streams, weights=None):
+    """
+    複数のイテレーターから、重みに比例した割合で交互に要素を取り出す (ストライドスケジューリング)。
+    (ストリームの番号, 要素) を順次返す。尽きたストリームは外し、残りのストリームで按分を続ける。
+    各ストリームは必要になった時点で1件ずつ読み進めるため、大きなストリームが他を待たせない。
+    """
+    iterators = [iter(stream) for stream in streams]
+    weights = list(weights) if weights is not None else [1] * len(iterators)
+    # (仮想時刻, ストリームの番号)。1件取り出すごとに 1/重み だけ仮想時刻を進める
+    heap = [(0.0, index) for index in range(len(iterators))]
+    heapq.heapify(heap)
+    while heap:
+        virtual_time, index = heapq.heappop(heap)
+        try:
+            item = next(iterators[index])
+        except StopIteration:
+            continue
+        yield index, item
+        heapq.heappush(heap, (virtual_time + 1 / weights[index], index))
+
+
+def imap_bounded(func, items, max_workers: int, ordered: bool = False):
+    """
+    スレッドプールで func を items に適用し、結果を順次返す。
+    投入済みのタスク数を制限するため、巨大なファイルリストでもメモリを圧迫しない。
+    max_workers が1以下の場合はスレッドを使わずに逐次実行する。
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    window = max_workers * 2
+    iterator = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='worker') as executor:
+        pending = deque()
+        for item in iterator:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                break
+
+        while pending:
+            if ordered:
+                future = pending.popleft()
+                result = future.result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = next(iter(done))
+                pending.remove(future)
+                result = future.result()
+            for item in iterator:
+                pending.append(executor.submit(func, item))
+                break
+            yield result
+
+
+class Lane:
+    """
+    処理対象を振り分ける作業レーン。
+    レーンごとに独立したワーカー数と同時実行数コントローラーを持ち、
+    あるレーンの重い処理が他のレーンの処理を待たせないようにする。
+    """
+
+    def __init__(self, name: str, workers: int, min_concurrency: int = 1):
+        self.name = name
+        self.workers = workers
+        min_limit = min(min_concurrency, workers)
+        self.metadata_limiter = AIMDController(f'{name}/metadata', min_limit, workers)
+        self.move_limiter = AIMDController(f'{name}/move', min_limit, workers)
+
+    @property
+    def controllers(self):
+        return [self.metadata_limiter, self.move_limiter]
+
+
+def run_lanes(func, items, lanes, classify, stop=None):
+    """
+    items を classify(item) が返すレーン名で振り分け、レーンごとのスレッドプールで
+    func(item, lane) を実行して、完了した順に結果を返す。
+    1レーンかつワーカー数が1の場合はスレッドを使わずに逐次実行する。
+    stop を指定すると、stop() が真を返した時点で新しい項目を取り出さず、まだ始まっていないタスクを取り消して、
+    実行中・完了済みのタスクの結果だけを返してから終える (実行済みの処理の結果を取りこぼさない)。
+    """
+    if len(lanes) == 1 and lanes[0].workers <= 1:
+        for item in items:
+            if stop is not None and stop():
+                return
+            yield func(item, lanes[0])
+        return
+
+    lanes_by_name = {lane.name: lane for lane in lanes}
+    executors = {
+        lane.name: ThreadPoolExecutor(max_workers=lane.workers, thread_name_prefix=f'lane-{lane.name}') for lane in lanes
+    }
+    backlog = {lane.name: deque() for lane in lanes}
+    in_flight = {lane.name: 0 for lane in lanes}
+    pending = {}
+    iterator = iter(items)
+    exhausted = False
+    stopped = False
+
+    def has_room(name):
+        return in_flight[name] + len(backlog[name]) < lanes_by_name[name].workers * 2
+
+    try:
+        while True:
+            if not stopped and stop is not None and stop():
+                # 打ち切り後は補充せず、まだ始まっていないタスクは取り消す
+                stopped = True
+                for queue in backlog.values():
+                    queue.clear()
+                for future in [future for future in pending if future.cancel()]:
+                    in_flight[pending.pop(future)] -= 1
+
+            # 空きのあるレーンがある限り先読みする（詰まったレーンの後ろで他のレーンを待たせない）
+            while not stopped and not exhausted and any(has_room(name) for name in backlog) \
+                    and sum(len(queue) for queue in backlog.values()) < MAX_LANE_BACKLOG:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                backlog[classify(item)].append(item)
+
+            for name, queue in backlog.items():
+                while queue and in_flight[name] < lanes_by_name[name].workers * 2:
+                    future = executors[name].submit(func, queue.popleft(), lanes_by_name[name])
+                    pending[future] = name
+                    in_flight[name] += 1
+
+            if not pending:
+                if exhausted or stopped:
+                    break
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight[pending.pop(future)] -= 1
+                yield future.result()
+    finally:
+        # 途中で閉じられた場合も、始まっていないタスクは実行しない
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
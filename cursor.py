@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+# 定数定義
+CURSOR_FILENAME = '.image_renamer_cursor.json'  # カーソルファイルを指定しなかった場合のファイル名
+
+
+class RunCursor:
+    """
+    予算 (時間・件数) 付きの実行が途中で止まった位置を保存するカーソルファイル。
+    実行内容ごとのキーに、ソースディレクトリごとの「最後に処理したファイル」を記録する。
+    1つのファイルに複数のキーを保存できるため、異なるソースの実行で共有してもよい。
+    """
+
+    def __init__(self, path, key: str):
+        self.path = Path(path)
+        self.key = key
+
+    def _read_all(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"カーソルファイル '{self.path}' を読み取れないため、最初から処理します: {e}")
+            return {}
+
+    def _write_all(self, data: dict):
+        # 途中で止まっても壊れたファイルが残らないよう、一時ファイルに書いてから置き換える
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def load(self) -> dict:
+        """ソースディレクトリ -> 最後に処理したファイルのパス の辞書を返す。保存されていなければ空"""
+        entry = self._read_all().get(self.key)
+        return dict(entry['positions']) if entry else {}
+
+    def save(self, positions: dict):
+        data = self._read_all()
+        data[self.key] = {'positions': positions, 'updated_at': time.time()}
+        self._write_all(data)
+
+    def clear(self):
+        """最後まで処理し終えたため、次回は最初から処理する"""
+        data = self._read_all()
+        if data.pop(self.key, None) is None:
+            return
+        if data:
+            self._write_all(data)
+        else:
+            self.path.unlink()
+
+
+class LowWaterMark:
+    """
+    決められた順に並んだ項目のうち、先頭から途切れずに完了した最後の項目を追跡する。
+    並列処理で完了の順序が前後しても、position より前の項目はすべて完了している。
+    """
+
+    def __init__(self, ordered_items):
+        self._items = list(ordered_items)
+        self._index = 0
+        self._done = set()
+
+    def mark(self, item):
+        self._done.add(item)
+        while self._index < len(self._items) and self._items[self._index] in self._done:
+            self._done.discard(self._items[self._index])
+            self._index += 1
+
+    @property
+    def position(self):
+        return self._items[self._index - 1] if self._index else None
@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fs
+
+# 定数定義
+INDEX_FILENAME = '.image_renamer_index.sqlite'  # 宛先ディレクトリ直下に作成するインデックスファイル名
+PARTIAL_HASH_BYTES = 64 * 1024  # 部分ハッシュに使う先頭・末尾のバイト数
+BLOOM_ERROR_RATE = 0.01  # ブルームフィルタの偽陽性率
+MIN_BLOOM_CAPACITY = 1024
+DEFAULT_INDEX_WORKERS = 4  # インデックス再構築時の並列数
+YEAR_DIR_PATTERN = re.compile(r'^\d{4}$')
+MONTH_DIR_PATTERN = re.compile(r'^\d{2}$')
+
+
+def compute_fingerprint(file_path, size: int = None) -> str:
+    """ファイルサイズと先頭・末尾の部分ハッシュから内容の指紋を計算する"""
+    if size is None:
+        size = fs.stat(file_path).st_size
+    if size > PARTIAL_HASH_BYTES * 2:
+        head, tail = fs.read_ranges(file_path, [(0, PARTIAL_HASH_BYTES), (size - PARTIAL_HASH_BYTES, PARTIAL_HASH_BYTES)])
+    else:
+        head, = fs.read_ranges(file_path, [(0, size)])
+        tail = head
+    return compute_fingerprint_from_bytes(head, tail, size)
+
+
+def compute_fingerprint_from_bytes(head: bytes, tail: bytes, size: int) -> str:
+    """
+    compute_fingerprint と同じ指紋を、内容の先頭 head と末尾 tail から計算する (宛先に書き出す前のストリーム向け)。
+    head は先頭 PARTIAL_HASH_BYTES * 2 バイト、tail は末尾 PARTIAL_HASH_BYTES バイト (内容がそれより短ければ内容全体) を含むこと。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(head[:PARTIAL_HASH_BYTES])
+    if size > PARTIAL_HASH_BYTES * 2:
+        digest.update(tail[-PARTIAL_HASH_BYTES:])
+    elif size > PARTIAL_HASH_BYTES:
+        digest.update(head[PARTIAL_HASH_BYTES:size])
+    return f"{size}:{digest.hexdigest()}"
+
+
+class BloomFilter:
+    """指紋の存在判定を高速に行うための簡易ブルームフィルタ"""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        capacity = max(capacity, MIN_BLOOM_CAPACITY)
+        self.num_bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _sorted_entries(directory: Path):
+    return sorted(fs.scandir(directory), key=lambda entry: entry.name)
+
+
+def _iter_files(directory: Path):
+    """ディレクトリ配下のファイル (隠しファイルを除く) をパス順に列挙する"""
+    for entry in _sorted_entries(directory):
+        path = directory / entry.name
+        if entry.is_dir():
+            yield from _iter_files(path)
+        elif entry.is_file() and not entry.name.startswith('.'):
+            yield path
+
+
+def iter_library_files(dest_path: Path):
+    """宛先ライブラリの `YYYY/MM` 配下にあるファイルを列挙する"""
+    for year_entry in _sorted_entries(dest_path):
+        if not year_entry.is_dir() or not YEAR_DIR_PATTERN.match(year_entry.name):
+            continue
+        for month_entry in _sorted_entries(dest_path / year_entry.name):
+            if not month_entry.is_dir() or not MONTH_DIR_PATTERN.match(month_entry.name):
+                continue
+            yield from _iter_files(dest_path / year_entry.name / month_entry.name)
+
+
+class DestinationIndex:
+    """
+    宛先ライブラリに取り込み済みのファイルの指紋を保持するインデックス。
+    SQLiteに永続化し、読み込み時にサイズの集合とブルームフィルタをメモリ上に構築する。
+    サイズが一致しないファイルはハッシュ計算すら行わずに「未取り込み」と判定できる。
+    """
+
+    def __init__(self, dest_path, index_file=None, read_only: bool = False):
+        self.dest_path = Path(dest_path)
+        self.index_file = Path(index_file) if index_file else self.dest_path / INDEX_FILENAME
+        self._lock = threading.Lock()
+
+        exists = self.index_file.exists()
+        if read_only:
+            # dry-run時は宛先に書き込まないよう、既存のインデックスをメモリ上に複製して使う
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+            if exists:
+                source = sqlite3.connect(str(self.index_file))
+                source.backup(self._conn)
+                source.close()
+        else:
+            self._conn = sqlite3.connect(str(self.index_file), check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY, size INTEGER NOT NULL, fingerprint TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS files_fingerprint ON files (fingerprint)')
+        # 検証付きコピーで計算した内容全体のハッシュ (以前のインデックスには列が無いため追加する)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(files)')}
+        if 'checksum' not in columns:
+            self._conn.execute('ALTER TABLE files ADD COLUMN checksum TEXT')
+        self._conn.commit()
+        self._load()
+        self.needs_rebuild = not exists
+
+    def _load(self):
+        rows = self._conn.execute('SELECT size, fingerprint FROM files').fetchall()
+        self._sizes = {size for size, _ in rows}
+        self._bloom = BloomFilter(len(rows) * 2)
+        for _, fingerprint in rows:
+            self._bloom.add(fingerprint)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def _relative(self, file_path) -> str:
+        return Path(file_path).relative_to(self.dest_path).as_posix()
+
+    def lookup(self, file_path, size: int):
+        """
+        取り込み予定のファイルが宛先に既に存在するか調べる。
+        存在すれば宛先のパスを返す。指紋を計算した場合はそれも合わせて返す。
+        """
+        if not self.has_size(size):
+            return None, None
+        fingerprint = compute_fingerprint(file_path, size)
+        return self.find(fingerprint), fingerprint
+
+    def has_size(self, size: int) -> bool:
+        """同じサイズのファイルが宛先に取り込み済みの可能性があるか (False なら指紋の計算は不要)"""
+        with self._lock:
+            return size in self._sizes
+
+    def find(self, fingerprint: str):
+        """指紋が一致する宛先のファイルのパスを返す。無ければ None"""
+        with self._lock:
+            if fingerprint not in self._bloom:
+                return None
+            rows = self._conn.execute(
+                'SELECT path FROM files WHERE fingerprint = ?', (fingerprint,)
+            ).fetchall()
+            for (relative_path,) in rows:
+                existing = self.dest_path / relative_path
+                if fs.exists(existing):
+                    return existing
+                # 手動で削除されたファイルはインデックスからも取り除く
+                self._conn.execute('DELETE FROM files WHERE path = ?', (relative_path,))
+            self._conn.commit()
+        return None
+
+    def add(self, file_path, size: int, fingerprint: str = None, checksum: str = None):
+        """配置済みのファイルをインデックスに追加する。checksum は検証付きコピーで計算したハッシュ"""
+        if fingerprint is None:
+            fingerprint = compute_fingerprint(file_path, size)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, size, fingerprint, checksum) VALUES (?, ?, ?, ?)',
+                (self._relative(file_path), size, fingerprint, checksum)
+            )
+            self._conn.commit()
+            self._sizes.add(size)
+            self._bloom.add(fingerprint)
+
+    def checksum(self, file_path):
+        """記録されている内容のハッシュを返す。検証せずに取り込んだファイルは None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT checksum FROM files WHERE path = ?', (self._relative(file_path),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def relocate(self, old_path, new_path):
+        """宛先内で移動したファイルのパスを更新する"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE files SET path = ? WHERE path = ?', (self._relative(new_path), self._relative(old_path))
+            )
+            self._conn.commit()
+
+    def rebuild(self, workers: int = DEFAULT_INDEX_WORKERS):
+        """宛先の `YYYY/MM` 配下を並列にスキャンしてインデックスを作り直す"""
+        files = list(iter_library_files(self.dest_path))
+        logging.info(f"宛先インデックスを再構築します: {len(files)}件 (並列数 {workers})")
+
+        def fingerprint_of(file_path):
+            try:
+                size = fs.stat(file_path).st_size
+                return self._relative(file_path), size, compute_fingerprint(file_path, size)
+            except OSError as e:
+                logging.error(f"エラー: '{file_path}' の指紋を計算できません: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='index') as executor:
+            rows = [row for row in executor.map(fingerprint_of, files) if row is not None]
+
+        with self._lock:
+            # 内容が変わっていないファイルは、検証時に記録したハッシュを引き継ぐ
+            checksums = {
+                (path, fingerprint): checksum
+                for path, fingerprint, checksum in self._conn.execute(
+                    'SELECT path, fingerprint, checksum FROM files WHERE checksum IS NOT NULL'
+                )
+            }
+            rows = [(path, size, fingerprint, checksums.get((path, fingerprint))) for path, size, fingerprint in rows]
+            self._conn.execute('DELETE FROM files')
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO files (path, size, fingerprint, checksum) VALUES (?, ?, ?, ?)', rows
+            )
+            self._conn.commit()
+            self._load()
+        self.needs_rebuild = False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
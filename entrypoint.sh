@@ -7,24 +7,20 @@ COMMAND=$1
 # 引数が無い場合は使用方法を表示
 if [ -z "$COMMAND" ]; then
     echo "Usage: <command> [args...]" >&2
-    echo "Available commands: rename, organize" >&2
+    echo "Available commands: rename, organize, rebalance, catalog, serve, queue" >&2
     exit 1
 fi
 
 shift
 
 case "$COMMAND" in
-    rename)
-        echo "Executing rename script..."
-        exec python rename_images.py "$@"
-        ;;
-    organize)
-        echo "Executing organize script..."
-        exec python organize_files.py "$@"
+    rename|organize|rebalance|catalog|serve|queue)
+        # サブコマンドの振り分けは cli.py (image-renamer) が行い、必要なモジュールだけを読み込む
+        exec python cli.py "$COMMAND" "$@"
         ;;
     *)
         echo "Error: Unknown command: $COMMAND" >&2
-        echo "Available commands: rename, organize" >&2
+        echo "Available commands: rename, organize, rebalance, catalog, serve, queue" >&2
         exit 1
         ;;
 esac
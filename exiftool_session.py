@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from utils import MetadataTimeoutError
+
+# 定数定義
+EXIFTOOL_READY_MARKER = '{ready}'  # -stay_open モードで1コマンドの出力が終わったことを示す行
+DEFAULT_CACHE_SIZE = 100000  # メタデータキャッシュの最大件数
+EXIFTOOL_ARGS = ['-json', '-s', '-d', '%Y:%m:%d %H:%M:%S']
+WATCHDOG_INTERVAL_SECONDS = 0.5  # 制限時間を超えたセッションを確認する間隔
+
+
+class ExifToolSession:
+    """
+    `exiftool -stay_open True` で起動したままのExifToolプロセス。
+    ファイルごとにプロセスを起動するコストを省く。1セッションは同時に1件しか処理できない。
+    """
+
+    def __init__(self):
+        self._process = subprocess.Popen(
+            ['exiftool', '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding='utf-8',
+        )
+        self.deadline = None  # 処理中のファイルの期限 (time.monotonic)。処理中でなければ None
+        self.timed_out = False
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def query(self, file_path, timeout: float = None) -> dict:
+        """
+        1ファイルのメタデータを取得する。timeout を指定すると期限を設定し、
+        期限を過ぎてウォッチドッグに強制終了された場合は MetadataTimeoutError を送出する。
+        """
+        path = str(file_path)
+        if '\n' in path:
+            raise ValueError(f"改行を含むパスは処理できません: {path!r}")
+        self.deadline = time.monotonic() + timeout if timeout else None
+        try:
+            self._process.stdin.write('\n'.join(EXIFTOOL_ARGS + [path, '-execute']) + '\n')
+            self._process.stdin.flush()
+
+            lines = []
+            while True:
+                line = self._process.stdout.readline()
+                if not line:
+                    if self.timed_out:
+                        raise MetadataTimeoutError(f"ExifToolが {timeout}秒以内に応答しませんでした ({file_path})")
+                    raise RuntimeError("ExifToolのセッションが予期せず終了しました。")
+                if line.strip() == EXIFTOOL_READY_MARKER:
+                    break
+                lines.append(line)
+        except OSError:
+            if self.timed_out:
+                raise MetadataTimeoutError(f"ExifToolが {timeout}秒以内に応答しませんでした ({file_path})")
+            raise
+        finally:
+            self.deadline = None
+
+        output = ''.join(lines).strip()
+        if not output:
+            logging.error(f"ExifToolの実行に失敗しました ({file_path}): 出力がありません")
+            return {}
+        data = json.loads(output)
+        return data[0] if data else {}
+
+    def kill(self):
+        """応答しないセッションを強制終了する。処理中の query は MetadataTimeoutError になる"""
+        self.timed_out = True
+        self._process.kill()
+
+    def close(self):
+        if not self.alive:
+            return
+        try:
+            self._process.stdin.write('-stay_open\nFalse\n')
+            self._process.stdin.flush()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+            self._process.wait()
+
+
+class ExifToolPool:
+    """
+    起動済みのExifToolセッションを複数保持し、スレッド間で貸し出すプール。
+    (パス, サイズ, 更新日時) をキーにしたメタデータキャッシュも持ち、
+    同じファイルを繰り返し処理するジョブでExifToolの呼び出しを省く。
+    ウォッチドッグのスレッドが期限を過ぎたセッションを強制終了し、次の貸し出しまでに起動し直す。
+    """
+
+    def __init__(self, size: int = 1, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.size = size
+        self._idle = queue.Queue()
+        self._sessions = []
+        for _ in range(size):
+            session = ExifToolSession()
+            self._sessions.append(session)
+            self._idle.put(session)
+        self._sessions_lock = threading.Lock()
+        self.timeouts = 0
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name='exiftool-watchdog', daemon=True)
+        self._watchdog.start()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, file_path):
+        st = os.stat(file_path)
+        return (os.fspath(file_path), st.st_size, st.st_mtime_ns)
+
+    def _watch(self):
+        while not self._stop.wait(WATCHDOG_INTERVAL_SECONDS):
+            now = time.monotonic()
+            with self._sessions_lock:
+                sessions = list(self._sessions)
+            for session in sessions:
+                deadline = session.deadline
+                if deadline is not None and now > deadline and not session.timed_out:
+                    logging.warning("ExifToolのセッションが制限時間を超えたため強制終了します。")
+                    session.kill()
+
+    def _replace(self, session):
+        session.close()
+        replacement = ExifToolSession()
+        with self._sessions_lock:
+            self._sessions.remove(session)
+            self._sessions.append(replacement)
+        return replacement
+
+    def get(self, file_path, timeout: float = None) -> dict:
+        key = self._cache_key(file_path)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return dict(self._cache[key])
+            self.misses += 1
+
+        session = self._idle.get()
+        try:
+            if not session.alive:
+                logging.warning("ExifToolのセッションが終了していたため再起動します。")
+                session = self._replace(session)
+            data = session.query(file_path, timeout)
+        except MetadataTimeoutError:
+            # 複数のスレッド・ジョブから同時に数えるため、hits / misses と同じロックで加算する
+            with self._cache_lock:
+                self.timeouts += 1
+            session = self._replace(session)
+            raise
+        except RuntimeError:
+            session = self._replace(session)
+            raise
+        finally:
+            self._idle.put(session)
+
+        with self._cache_lock:
+            self._cache[key] = data
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return dict(data)
+
+    def close(self):
+        self._stop.set()
+        self._watchdog.join()
+        for _ in range(self.size):
+            self._idle.get().close()
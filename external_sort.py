@@ -0,0 +1,81 @@
+import heapq
+import json
+import os
+import tempfile
+
+# 定数定義
+DEFAULT_SORT_BUFFER = 100000  # メモリ上で並べ替える最大件数。超えた分は並べ替えて一時ファイルに書き出す
+
+
+class ExternalSorter:
+    """
+    件数の上限を超えるとディスクに書き出す外部マージソート。
+    追加した要素を buffer_size 件ずつ key で並べ替えて一時ファイル (JSON Lines) に書き出し、
+    読み出すときは各ファイルを先頭から1行ずつ heapq.merge で併合する。メモリに載るのは
+    buffer_size 件と、書き出したファイルごとの1件だけになる。
+    要素は JSON で表現できる値 (タプルはリストとして読み戻される) とし、key はリストでも同じ順序を返すこと。
+    """
+
+    def __init__(self, key=None, buffer_size: int = DEFAULT_SORT_BUFFER, temp_dir: str = None):
+        if buffer_size < 1:
+            raise ValueError(f"buffer_size は1以上を指定してください: {buffer_size}")
+        self.key = key
+        self.buffer_size = buffer_size
+        self.temp_dir = temp_dir
+        self._buffer = []
+        self._runs = []  # 書き出した一時ファイルのパス
+
+    def __len__(self) -> int:
+        return len(self._buffer) + sum(count for _, count in self._runs)
+
+    @property
+    def spilled(self) -> int:
+        """一時ファイルに書き出した回数"""
+        return len(self._runs)
+
+    def add(self, item):
+        self._buffer.append(item)
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort(key=self.key)
+        fd, path = tempfile.mkstemp(prefix='image_renamer_sort_', suffix='.jsonl', dir=self.temp_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            for item in self._buffer:
+                f.write(json.dumps(item, ensure_ascii=False))
+                f.write('\n')
+        self._runs.append((path, len(self._buffer)))
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(path: str):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __iter__(self):
+        """追加した全要素を key の順に返す。書き出していなければメモリ上で並べ替えるだけになる"""
+        self._buffer.sort(key=self.key)
+        if not self._runs:
+            return iter(self._buffer)
+        # メモリ上に残った分も書き出した分と同じ形 (JSON で読み戻した値) で併合する
+        if self._buffer:
+            self._spill()
+        return heapq.merge(*(self._read_run(path) for path, _ in self._runs), key=self.key)
+
+    def close(self):
+        """一時ファイルを削除する"""
+        for path, _ in self._runs:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._runs = []
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
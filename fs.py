@@ -0,0 +1,707 @@
+import errno
+import hashlib
+import os
+import random
+import shutil
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from stat import S_IFREG, S_IFDIR
+
+from sequence import rename_noreplace as _posix_rename_noreplace
+
+# 定数定義
+FS_OPERATIONS = ('scandir', 'stat', 'exists', 'listdir', 'rename', 'mkdir', 'move', 'read', 'write', 'advise')
+COPY_BUFFER_BYTES = 1024 * 1024  # 検証付きコピーで使うバッファのサイズ
+CHECKSUM_ALGORITHM = 'blake2b'
+MEMORY_CONTENT_BLOCK = 64  # MemoryBackend が内容を持たないファイルの内容を生成する単位 (blake2b の最大ダイジェスト長)
+PARTIAL_SUFFIX = '.partial'  # 検証・書き込みが終わるまでのコピー先の一時ファイル名の接尾辞
+DEFAULT_MAX_DIR_FDS = 64  # ApplySession が開いたまま保持するディレクトリのファイルディスクリプタの上限
+# FIEMAP (Linux) で先頭エクステントの物理位置を問い合わせる ioctl。
+# struct fiemap (32バイト) の後に struct fiemap_extent (56バイト) を1件分確保して渡す
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQIIII')  # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')  # fe_logical, fe_physical, fe_length, fe_reserved64[2], fe_flags, fe_reserved[3]
+FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+
+class VerificationError(OSError):
+    """コピー先の内容がコピー元と一致しない"""
+
+
+def _hash_into(f, buffer: bytearray, digest, out=None):
+    """f を buffer 単位で読み、digest を更新する。out を指定すると同じバッファの内容を書き込む"""
+    view = memoryview(buffer)
+    while True:
+        size = f.readinto(buffer)
+        if not size:
+            return
+        digest.update(view[:size])
+        if out is not None:
+            out.write(view[:size])
+
+
+def _partial_path(dst: str) -> str:
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{PARTIAL_SUFFIX}")
+
+
+def _verify_written(partial: str, buffer: bytearray, expected, dst: str):
+    """書き込んだ内容をページキャッシュを捨ててから読み戻し、expected のハッシュと一致しなければ VerificationError"""
+    copied_digest = hashlib.new(CHECKSUM_ALGORITHM)
+    with open(partial, 'rb') as f:
+        # 書き込んだばかりの内容をキャッシュではなくディスクから読む
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        _hash_into(f, buffer, copied_digest)
+    if expected.digest() != copied_digest.digest():
+        raise VerificationError(
+            errno.EIO, f"コピー先の内容がコピー元と一致しません ({expected.hexdigest()} != {copied_digest.hexdigest()})",
+            dst,
+        )
+
+
+def _first_extent_offset(path):
+    """
+    ファイルの先頭エクステントのディスク上の物理オフセット (バイト) を FIEMAP で取得する。
+    FIEMAP に対応しないファイルシステムや、エクステントを持たないファイル (空・インライン) では None を返す。
+    """
+    import fcntl
+
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except OSError as e:
+        if e.errno in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+            return None
+        raise
+    finally:
+        os.close(fd)
+    mapped_extents = FIEMAP_HEADER.unpack_from(request, 0)[3]
+    if not mapped_extents:
+        return None
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
+
+
+# メモリ上のファイルシステムが返す stat の結果 (os.stat_result の一部の属性のみ)
+MemoryStat = namedtuple('MemoryStat', 'st_mode st_size st_mtime st_mtime_ns st_dev st_ino', defaults=(0, 0))
+
+
+class PosixBackend:
+    """実際のファイルシステムを操作するバックエンド"""
+
+    def scandir(self, directory):
+        """ディレクトリのエントリ (os.DirEntry 互換) のリストを返す"""
+        with os.scandir(directory) as it:
+            return list(it)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def exists(self, path) -> bool:
+        return os.path.exists(path)
+
+    def is_file(self, path) -> bool:
+        return os.path.isfile(path)
+
+    def is_dir(self, path) -> bool:
+        return os.path.isdir(path)
+
+    def listdir(self, directory) -> list:
+        return os.listdir(directory)
+
+    def rename_noreplace(self, src, dst) -> bool:
+        return _posix_rename_noreplace(src, dst)
+
+    def mkdir(self, path):
+        """親ディレクトリも含めて作成する。既に存在してもエラーにしない"""
+        os.makedirs(path, exist_ok=True)
+
+    def read_ranges(self, path, ranges) -> list:
+        """ファイルを1回開き、(位置, バイト数) の範囲ごとに pread で読んだ内容のリストを返す"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return [os.pread(fd, length, offset) for offset, length in ranges]
+        finally:
+            os.close(fd)
+
+    def read_bytes(self, path) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def write_bytes(self, path, data: bytes):
+        """小さなファイル (記録用のファイルなど) を作成する。既に存在すれば置き換える"""
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def move(self, src, dst):
+        shutil.move(str(src), str(dst))
+
+    def apply_session(self):
+        return PosixApplySession(self)
+
+    @staticmethod
+    def same_device(path, directory) -> bool:
+        return os.stat(path).st_dev == os.stat(directory).st_dev
+
+    def physical_position(self, path, by_extent: bool = False) -> tuple:
+        """
+        ディスク上の読み取り順に並べるためのキー (デバイス, 位置) を返す。位置は by_extent が True なら
+        先頭エクステントの物理オフセット、取得できない場合や False の場合は inode 番号。
+        """
+        st = os.stat(path)
+        offset = _first_extent_offset(path) if by_extent else None
+        return st.st_dev, offset if offset is not None else st.st_ino
+
+    def advise_willneed(self, path, length: int):
+        """先頭 length バイトを近いうちに読むことをカーネルに伝え、先読みを始めさせる (posix_fadvise)"""
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    def move_verified(self, src, dst):
+        """
+        src を dst に移動する。別のデバイスへの移動は、ハッシュを計算しながら1回の読み取りでコピーし、
+        書き込んだ内容をページキャッシュを捨ててから読み戻して一致を確認してから移動元を削除する。
+        検証した場合は '<アルゴリズム>:<16進数>' を、同じデバイス内のリネームで済んだ場合は None を返す。
+        一致しなければコピー先を削除して VerificationError を送出する (移動元は残る)。
+        """
+        src, dst = os.fspath(src), os.fspath(dst)
+        if self.same_device(src, os.path.dirname(dst)):
+            os.replace(src, dst)
+            return None
+
+        partial = _partial_path(dst)
+        buffer = bytearray(COPY_BUFFER_BYTES)
+        source_digest = hashlib.new(CHECKSUM_ALGORITHM)
+        try:
+            with open(src, 'rb') as fin, open(partial, 'wb') as fout:
+                _hash_into(fin, buffer, source_digest, out=fout)
+                fout.flush()
+                os.fsync(fout.fileno())
+            _verify_written(partial, buffer, source_digest, dst)
+            shutil.copystat(src, partial)
+            os.replace(partial, dst)
+        except BaseException:
+            try:
+                os.unlink(partial)
+            except FileNotFoundError:
+                pass
+            raise
+        os.unlink(src)
+        return f"{CHECKSUM_ALGORITHM}:{source_digest.hexdigest()}"
+
+    def write_stream(self, stream, dst, head: bytes = b'', mtime: float = None, verify: bool = False):
+        """
+        head に続けて stream の残りを dst に書き込む (アーカイブのメンバーの展開など)。
+        一時ファイルに書き終えてから dst が存在しない場合のみ置き換え、既に存在すれば FileExistsError。
+        verify が True の場合はハッシュを計算しながら書き込み、読み戻して一致を確認して
+        '<アルゴリズム>:<16進数>' を返す。それ以外は None を返す。
+        """
+        dst = os.fspath(dst)
+        partial = _partial_path(dst)
+        buffer = bytearray(COPY_BUFFER_BYTES)
+        digest = hashlib.new(CHECKSUM_ALGORITHM) if verify else None
+        try:
+            with open(partial, 'wb') as out:
+                out.write(head)
+                if digest is not None:
+                    digest.update(head)
+                    _hash_into(stream, buffer, digest, out=out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                else:
+                    shutil.copyfileobj(stream, out, COPY_BUFFER_BYTES)
+            if digest is not None:
+                _verify_written(partial, buffer, digest, dst)
+            if mtime is not None:
+                os.utime(partial, (mtime, mtime))
+            if not self.rename_noreplace(partial, dst):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        except BaseException:
+            try:
+                os.unlink(partial)
+            except FileNotFoundError:
+                pass
+            raise
+        return f"{CHECKSUM_ALGORITHM}:{digest.hexdigest()}" if digest is not None else None
+
+
+class _MemoryDirEntry:
+    """MemoryBackend.scandir が返す os.DirEntry 互換のエントリ"""
+
+    def __init__(self, backend, directory: str, name: str):
+        self._backend = backend
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self, follow_symlinks: bool = True) -> bool:
+        return self.path in self._backend._dirs
+
+    def is_file(self, follow_symlinks: bool = True) -> bool:
+        return self.path in self._backend._files
+
+    def stat(self, follow_symlinks: bool = True):
+        return self._backend._stat(self.path)
+
+
+class MemoryBackend:
+    """
+    メモリ上のファイルシステム。NASを用意せずに大規模な構成や遅延・障害を再現するためのもの。
+    latency に操作名 (FS_OPERATIONS) ごとの遅延 (秒) を、failure_rate に操作ごとの失敗率を指定すると、
+    呼び出しのたびに遅延させ、その確率で OSError (EIO) を送出する。操作ごとの呼び出し回数は calls に入る。
+    ファイルの内容は write_bytes・add_file (data) で作成したものだけを保持し、それ以外のファイルはサイズと
+    更新日時のみを保持する。内容を持たないファイルは inode 番号から決まる内容として読む (同じファイルは移動しても
+    同じ内容、別のファイルは別の内容になる)。
+    作成したファイルには作成順に inode 番号とディスク上の位置 (それまでに作成したファイルのサイズの合計) を割り当て、
+    physical_position の by_extent ではその位置を返す。
+    """
+
+    def __init__(self, latency: dict = None, failure_rate: dict = None, seed: int = None):
+        self.latency = dict(latency or {})
+        self.failure_rate = dict(failure_rate or {})
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files = {}  # パス -> (サイズ, 更新日時 ns, inode 番号, ディスク上の位置)
+        self._contents = {}  # パス -> 内容 (内容を持つファイルのみ)
+        self._inodes = 0  # 最後に割り当てた inode 番号
+        self._allocated = 0  # 次に作成するファイルのディスク上の位置
+        self._dirs = {os.sep: set()}  # パス -> 子の名前の集合
+        self._dir_mtimes = {os.sep: time.time_ns()}
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.abspath(os.fspath(path))
+
+    def _call(self, operation: str, path):
+        with self._lock:
+            self.calls[operation] += 1
+            failed = self._random.random() < self.failure_rate.get(operation, 0)
+        delay = self.latency.get(operation, 0)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise OSError(errno.EIO, f"{operation} で障害が発生しました (注入)", str(path))
+
+    def _touch_dir(self, directory: str):
+        self._dir_mtimes[directory] = max(time.time_ns(), self._dir_mtimes.get(directory, 0) + 1)
+
+    def _make_dirs(self, directory: str):
+        missing = []
+        while directory not in self._dirs:
+            if directory in self._files:
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), directory)
+            missing.append(directory)
+            directory = os.path.dirname(directory)
+        for path in reversed(missing):
+            parent = os.path.dirname(path)
+            self._dirs[parent].add(os.path.basename(path))
+            self._touch_dir(parent)
+            self._dirs[path] = set()
+            self._touch_dir(path)
+
+    def _stat(self, path: str):
+        with self._lock:
+            if path in self._files:
+                size, mtime_ns, inode, _ = self._files[path]
+                return MemoryStat(S_IFREG | 0o644, size, mtime_ns / 1e9, mtime_ns, 0, inode)
+            if path in self._dirs:
+                mtime_ns = self._dir_mtimes[path]
+                return MemoryStat(S_IFDIR | 0o755, 0, mtime_ns / 1e9, mtime_ns)
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def _allocate(self, size: int) -> tuple:
+        """新しいファイルの (inode 番号, ディスク上の位置) を返す。呼び出し側で _lock を取得しておく"""
+        self._inodes += 1
+        offset = self._allocated
+        self._allocated += max(size, 1)
+        return self._inodes, offset
+
+    def add_file(self, path, size: int = 0, mtime: float = None, data: bytes = None):
+        """ファイルを作成する (親ディレクトリも作成する)。data を指定するとその内容とサイズにする。遅延や障害は注入しない"""
+        key = self._key(path)
+        mtime_ns = int((mtime if mtime is not None else time.time()) * 1e9)
+        if data is not None:
+            size = len(data)
+        with self._lock:
+            self._make_dirs(os.path.dirname(key))
+            self._files[key] = (size, mtime_ns, *self._allocate(size))
+            self._dirs[os.path.dirname(key)].add(os.path.basename(key))
+            self._set_content(key, data)
+
+    def _set_content(self, key: str, data: bytes):
+        if data is not None:
+            self._contents[key] = bytes(data)
+        else:
+            self._contents.pop(key, None)
+
+    def _read(self, key: str, offset: int, length: int) -> bytes:
+        with self._lock:
+            if key not in self._files:
+                if key in self._dirs:
+                    raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), key)
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            size, _, inode, _ = self._files[key]
+            data = self._contents.get(key)
+        end = size if length < 0 else min(size, offset + length)
+        if data is not None:
+            return data[offset:end]
+        if offset >= end:
+            return b''
+        first, last = offset // MEMORY_CONTENT_BLOCK, (end - 1) // MEMORY_CONTENT_BLOCK
+        blocks = b''.join(
+            hashlib.blake2b(inode.to_bytes(8, 'little') + block.to_bytes(8, 'little'),
+                            digest_size=MEMORY_CONTENT_BLOCK).digest()
+            for block in range(first, last + 1)
+        )
+        start = offset - first * MEMORY_CONTENT_BLOCK
+        return blocks[start:start + end - offset]
+
+    def files(self) -> list:
+        """すべてのファイルのパスを返す"""
+        with self._lock:
+            return sorted(Path(path) for path in self._files)
+
+    def offset(self, path) -> int:
+        """ファイルのディスク上の位置を返す。遅延や障害は注入しない"""
+        key = self._key(path)
+        with self._lock:
+            if key not in self._files:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            return self._files[key][3]
+
+    def scandir(self, directory):
+        key = self._key(directory)
+        self._call('scandir', key)
+        with self._lock:
+            if key not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            names = list(self._dirs[key])
+        return [_MemoryDirEntry(self, key, name) for name in names]
+
+    def stat(self, path):
+        key = self._key(path)
+        self._call('stat', key)
+        return self._stat(key)
+
+    def exists(self, path) -> bool:
+        key = self._key(path)
+        self._call('exists', key)
+        with self._lock:
+            return key in self._files or key in self._dirs
+
+    def is_file(self, path) -> bool:
+        key = self._key(path)
+        self._call('stat', key)
+        with self._lock:
+            return key in self._files
+
+    def is_dir(self, path) -> bool:
+        key = self._key(path)
+        self._call('stat', key)
+        with self._lock:
+            return key in self._dirs
+
+    def listdir(self, directory) -> list:
+        key = self._key(directory)
+        self._call('listdir', key)
+        with self._lock:
+            if key not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            return list(self._dirs[key])
+
+    def _replace(self, src: str, dst: str, overwrite: bool) -> bool:
+        with self._lock:
+            if src not in self._files:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+            if dst in self._dirs:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), dst)
+            if dst in self._files and not overwrite:
+                return False
+            if os.path.dirname(dst) not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dst)
+            self._files[dst] = self._files.pop(src)
+            self._set_content(dst, self._contents.pop(src, None))
+            self._dirs[os.path.dirname(src)].discard(os.path.basename(src))
+            self._dirs[os.path.dirname(dst)].add(os.path.basename(dst))
+            self._touch_dir(os.path.dirname(src))
+            self._touch_dir(os.path.dirname(dst))
+            return True
+
+    def rename_noreplace(self, src, dst) -> bool:
+        src_key, dst_key = self._key(src), self._key(dst)
+        self._call('rename', src_key)
+        return self._replace(src_key, dst_key, overwrite=False)
+
+    def mkdir(self, path):
+        key = self._key(path)
+        self._call('mkdir', key)
+        with self._lock:
+            self._make_dirs(key)
+
+    def move(self, src, dst):
+        src_key, dst_key = self._key(src), self._key(dst)
+        self._call('move', src_key)
+        self._replace(src_key, dst_key, overwrite=True)
+
+    def read_ranges(self, path, ranges) -> list:
+        key = self._key(path)
+        self._call('read', key)
+        return [self._read(key, offset, length) for offset, length in ranges]
+
+    def read_bytes(self, path) -> bytes:
+        key = self._key(path)
+        self._call('read', key)
+        return self._read(key, 0, -1)
+
+    def write_bytes(self, path, data: bytes):
+        key = self._key(path)
+        self._call('write', key)
+        with self._lock:
+            if key in self._dirs:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), key)
+            if os.path.dirname(key) not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            self._files[key] = (len(data), time.time_ns(), *self._allocate(len(data)))
+            self._set_content(key, data)
+            self._dirs[os.path.dirname(key)].add(os.path.basename(key))
+            self._touch_dir(os.path.dirname(key))
+
+    def move_verified(self, src, dst):
+        """内容を持たないため検証せずに移動し、None を返す"""
+        self.move(src, dst)
+        return None
+
+    def apply_session(self):
+        return ApplySession(self)
+
+    def physical_position(self, path, by_extent: bool = False) -> tuple:
+        key = self._key(path)
+        self._call('stat', key)
+        with self._lock:
+            if key not in self._files:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            _, _, inode, offset = self._files[key]
+        return 0, offset if by_extent else inode
+
+    def advise_willneed(self, path, length: int):
+        """内容を持たないため、呼び出し回数を数えるだけ"""
+        self._call('advise', self._key(path))
+
+    def write_stream(self, stream, dst, head: bytes = b'', mtime: float = None, verify: bool = False):
+        """stream を読み切り、そのサイズのファイルを作成する。内容を持たないため検証せずに None を返す"""
+        key = self._key(dst)
+        self._call('write', key)
+        size = len(head)
+        while True:
+            chunk = stream.read(COPY_BUFFER_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+        mtime_ns = int((mtime if mtime is not None else time.time()) * 1e9)
+        with self._lock:
+            if key in self._files or key in self._dirs:
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), key)
+            if os.path.dirname(key) not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), key)
+            self._files[key] = (size, mtime_ns, *self._allocate(size))
+            self._dirs[os.path.dirname(key)].add(os.path.basename(key))
+            self._touch_dir(os.path.dirname(key))
+        return None
+
+
+class ApplySession:
+    """
+    rename / organize の1回の実行でファイルの移動・リネームを適用する。作成したディレクトリを覚えておき、
+    同じ移動先ディレクトリへの2件目以降のファイルでは作成・存在確認を省く。
+    このクラスはバックエンドの操作をそのまま呼ぶ (MemoryBackend など)。PosixBackend は PosixApplySession を使う。
+    実行中に他のプロセスがディレクトリを削除・移動することは想定しない。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def mkdir(self, directory):
+        """親ディレクトリも含めて作成する。このセッションで作成済みのディレクトリは何もしない"""
+        key = os.fspath(directory)
+        with self._lock:
+            if key in self._created:
+                return
+        self.backend.mkdir(key)
+        with self._lock:
+            self._created.add(key)
+
+    def move(self, src, dst):
+        self.backend.move(src, dst)
+
+    def move_verified(self, src, dst):
+        return self.backend.move_verified(src, dst)
+
+    def rename_noreplace(self, src, dst) -> bool:
+        return self.backend.rename_noreplace(src, dst)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PosixApplySession(ApplySession):
+    """
+    移動元・移動先のディレクトリをファイルディスクリプタで開いたまま保持し、ファイルの移動・リネームを
+    ディレクトリからの相対名 (renameat / renameat2) で行う。深いパスを操作のたびに先頭から辿り直さないため、
+    NASのように名前解決が遅いファイルシステムで効果がある。開いたままにするのは最近使った max_open 個まで。
+    """
+
+    def __init__(self, backend, max_open: int = DEFAULT_MAX_DIR_FDS):
+        super().__init__(backend)
+        self.max_open = max_open
+        self._fds = OrderedDict()  # ディレクトリ -> [ファイルディスクリプタ, 使用中の数]
+        self._flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+    @contextmanager
+    def _opened(self, directory: str):
+        """directory のファイルディスクリプタを返す。使用中のものは上限を超えても閉じない"""
+        with self._lock:
+            entry = self._fds.get(directory)
+            if entry is not None:
+                self._fds.move_to_end(directory)
+                entry[1] += 1
+        if entry is None:
+            fd = os.open(directory, self._flags)
+            with self._lock:
+                entry = self._fds.get(directory)
+                if entry is None:
+                    entry = self._fds[directory] = [fd, 0]
+                else:
+                    # 他のスレッドが先に開いた
+                    os.close(fd)
+                entry[1] += 1
+                self._evict()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                self._evict()
+
+    def _evict(self):
+        for directory in list(self._fds):
+            if len(self._fds) <= self.max_open:
+                return
+            fd, users = self._fds[directory]
+            if not users:
+                del self._fds[directory]
+                os.close(fd)
+
+    def move(self, src, dst):
+        src, dst = os.fspath(src), os.fspath(dst)
+        with self._opened(os.path.dirname(src)) as src_fd, self._opened(os.path.dirname(dst)) as dst_fd:
+            try:
+                os.rename(os.path.basename(src), os.path.basename(dst), src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        # 別のデバイスへはコピーになる
+        self.backend.move(src, dst)
+
+    def move_verified(self, src, dst):
+        src, dst = os.fspath(src), os.fspath(dst)
+        with self._opened(os.path.dirname(src)) as src_fd, self._opened(os.path.dirname(dst)) as dst_fd:
+            # os.stat はファイルディスクリプタも受け付けるため、パスを辿らずに判定できる
+            if self.backend.same_device(src_fd, dst_fd):
+                os.rename(os.path.basename(src), os.path.basename(dst), src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+                return None
+        return self.backend.move_verified(src, dst)
+
+    def rename_noreplace(self, src, dst) -> bool:
+        src, dst = os.fspath(src), os.fspath(dst)
+        with self._opened(os.path.dirname(src)) as src_fd, self._opened(os.path.dirname(dst)) as dst_fd:
+            return _posix_rename_noreplace(os.path.basename(src), os.path.basename(dst), src_fd, dst_fd)
+
+    def close(self):
+        with self._lock:
+            for fd, _ in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+# 現在のバックエンド。set_backend で差し替える（ベンチマークやテスト向け）
+_backend = PosixBackend()
+
+def get_backend():
+    return _backend
+
+def set_backend(backend):
+    """ファイル操作に使うバックエンドを設定する。None で実際のファイルシステムに戻す"""
+    global _backend
+    _backend = backend if backend is not None else PosixBackend()
+
+# rename / organize はファイル操作を以下の関数経由で行う
+def scandir(directory):
+    return _backend.scandir(directory)
+
+def stat(path):
+    return _backend.stat(path)
+
+def exists(path) -> bool:
+    return _backend.exists(path)
+
+def is_file(path) -> bool:
+    return _backend.is_file(path)
+
+def is_dir(path) -> bool:
+    return _backend.is_dir(path)
+
+def listdir(directory) -> list:
+    return _backend.listdir(directory)
+
+def rename_noreplace(src, dst) -> bool:
+    return _backend.rename_noreplace(src, dst)
+
+def mkdir(path):
+    _backend.mkdir(path)
+
+def move(src, dst):
+    _backend.move(src, dst)
+
+def move_verified(src, dst):
+    return _backend.move_verified(src, dst)
+
+def read_ranges(path, ranges) -> list:
+    return _backend.read_ranges(path, ranges)
+
+def read_bytes(path) -> bytes:
+    return _backend.read_bytes(path)
+
+def write_bytes(path, data: bytes):
+    _backend.write_bytes(path, data)
+
+def write_stream(stream, dst, head: bytes = b'', mtime: float = None, verify: bool = False):
+    return _backend.write_stream(stream, dst, head, mtime, verify)
+
+def physical_position(path, by_extent: bool = False) -> tuple:
+    return _backend.physical_position(path, by_extent)
+
+def advise_willneed(path, length: int):
+    _backend.advise_willneed(path, length)
+
+def apply_session():
+    """ファイルの移動・リネームを適用するセッション (ApplySession) を開始する。使い終わったら close する"""
+    return _backend.apply_session()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import fs
+
+# 定数定義
+LAYOUT_MARKER = '.image_renamer_layout'  # 分割済みの月フォルダに置く、分割方法を記録するファイル名
+SPLIT_MODE_DAY = 'day'  # YYYY/MM/DD に分割する
+SPLIT_MODE_HASH = 'hash'  # ファイル名のハッシュでサブフォルダに分割する
+SPLIT_MODES = (SPLIT_MODE_DAY, SPLIT_MODE_HASH)
+DEFAULT_HASH_BUCKETS = 16  # ハッシュ分割時のサブフォルダ数
+
+
+def count_entries(directory: Path) -> int:
+    """ディレクトリ直下のエントリ数 (隠しファイルを除く) を数える。存在しなければ0"""
+    try:
+        return sum(1 for entry in fs.scandir(directory) if not entry.name.startswith('.'))
+    except FileNotFoundError:
+        return 0
+
+
+def bucket_name(file_name: str, buckets: int) -> str:
+    """ファイル名から決まるハッシュ分割のサブフォルダ名 (16進数) を返す"""
+    digest = hashlib.blake2b(file_name.lower().encode('utf-8'), digest_size=8).digest()
+    width = len(f"{buckets - 1:x}")
+    return f"{int.from_bytes(digest, 'big') % buckets:0{width}x}"
+
+
+def read_layout_marker(month_dir: Path):
+    """月フォルダの分割方法を (mode, buckets) で返す。分割されていなければ None"""
+    try:
+        data = json.loads(fs.read_bytes(month_dir / LAYOUT_MARKER).decode('utf-8'))
+        if data.get('mode') in SPLIT_MODES:
+            return data['mode'], int(data.get('buckets') or DEFAULT_HASH_BUCKETS)
+        logging.warning(f"'{month_dir / LAYOUT_MARKER}' の分割方法が不明なため無視します: {data.get('mode')!r}")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logging.warning(f"'{month_dir / LAYOUT_MARKER}' を読み取れないため無視します: {e}")
+    return None
+
+
+def write_layout_marker(month_dir: Path, mode: str, buckets: int):
+    fs.mkdir(month_dir)
+    data = {'mode': mode}
+    if mode == SPLIT_MODE_HASH:
+        data['buckets'] = buckets
+    fs.write_bytes(month_dir / LAYOUT_MARKER, json.dumps(data).encode('utf-8'))
+
+
+class LayoutPolicy:
+    """
+    宛先ライブラリのどのフォルダにファイルを置くかを決める。
+    通常は `YYYY/MM`。月フォルダのエントリ数が split_threshold を超える場合は、
+    `YYYY/MM/DD` (split_mode='day') またはファイル名のハッシュによるサブフォルダ
+    (split_mode='hash') に分割し、月フォルダに分割方法を記録する。
+    エントリ数は月フォルダごとに初回のみ数え、以降はメモリ上で加算する。
+    分割済みの月フォルダは split_threshold を指定しなくても記録された方法で配置する。
+    dry_run が True の場合は分割の記録を書き込まない。
+    """
+
+    def __init__(self, dest_path, split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY,
+                 buckets: int = DEFAULT_HASH_BUCKETS, dry_run: bool = False):
+        if split_mode not in SPLIT_MODES:
+            raise ValueError(f"不明な分割方法です: {split_mode}（{', '.join(SPLIT_MODES)} のいずれかを指定してください）")
+        if split_threshold is not None and split_threshold < 1:
+            raise ValueError(f"分割の閾値は1以上を指定してください: {split_threshold}")
+        if buckets < 2:
+            raise ValueError(f"ハッシュ分割のサブフォルダ数は2以上を指定してください: {buckets}")
+        self.dest_path = Path(dest_path)
+        self.split_threshold = split_threshold
+        self.split_mode = split_mode
+        self.buckets = buckets
+        self.dry_run = dry_run
+        self._counts = {}
+        self._splits = {}
+        self._lock = threading.Lock()
+
+    def _load(self, month_dir: Path):
+        if month_dir not in self._counts:
+            self._splits[month_dir] = read_layout_marker(month_dir)
+            self._counts[month_dir] = count_entries(month_dir)
+
+    def split_of(self, month_dir: Path):
+        """月フォルダの分割方法を (mode, buckets) で返す。分割されていなければ None"""
+        with self._lock:
+            self._load(month_dir)
+            return self._splits[month_dir]
+
+    def split(self, month_dir: Path):
+        """月フォルダを分割済みにする。既に分割済みなら記録された方法を返す"""
+        with self._lock:
+            self._load(month_dir)
+            return self._split(month_dir)
+
+    def _split(self, month_dir: Path):
+        if self._splits[month_dir] is None:
+            self._splits[month_dir] = (self.split_mode, self.buckets)
+            if not self.dry_run:
+                write_layout_marker(month_dir, self.split_mode, self.buckets)
+        return self._splits[month_dir]
+
+    def target_dir(self, target_date: datetime, file_name: str) -> Path:
+        """日付とファイル名から配置先のフォルダを決め、その月フォルダのエントリ数に1件を加える"""
+        month_dir = self.dest_path / target_date.strftime("%Y") / target_date.strftime("%m")
+        with self._lock:
+            self._load(month_dir)
+            split = self._splits[month_dir]
+            if split is None and self.split_threshold is not None and self._counts[month_dir] >= self.split_threshold:
+                logging.info(
+                    f"'{month_dir}' のエントリ数が {self._counts[month_dir]}件に達したため、"
+                    f"以降のファイルはサブフォルダに分けて配置します（分割方法: {self.split_mode}）。"
+                )
+                split = self._split(month_dir)
+            if split is None:
+                self._counts[month_dir] += 1
+                return month_dir
+        return subfolder(month_dir, split, target_date, file_name)
+
+
+def subfolder(month_dir: Path, split, target_date: datetime, file_name: str) -> Path:
+    """分割済みの月フォルダで、日付またはファイル名から配置先のサブフォルダを返す"""
+    mode, buckets = split
+    if mode == SPLIT_MODE_DAY:
+        return month_dir / target_date.strftime("%d")
+    return month_dir / bucket_name(file_name, buckets)
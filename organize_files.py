@@ -1,24 +1,66 @@
+import contextlib
 import os
 import argparse
 import logging
 import shutil
+import tarfile
+import threading
+import time
+import zipfile
 from pathlib import Path
 from datetime import datetime
-from tqdm import tqdm
 
 from utils import (
     setup_logging,
     get_exif_data_with_exiftool,
+    MetadataTimeoutError,
+    ExifToolError,
+    DEFAULT_METADATA_TIMEOUT,
     EXIFTOOL_DATETIME_ORIGINAL_TAG,
     SUPPORTED_EXTENSIONS,
 )
+import fs
+from fs import VerificationError
+from concurrency import Lane, run_lanes, weighted_interleave, write_concurrency_metrics
+from dest_index import DestinationIndex, compute_fingerprint_from_bytes, DEFAULT_INDEX_WORKERS, PARTIAL_HASH_BYTES
+from walker import parallel_walk
+from quarantine import Quarantine
+from cursor import RunCursor, LowWaterMark, CURSOR_FILENAME
+from sniff import sniff_format, read_metadata, read_metadata_from_bytes, identify_format
+from archive import is_archive, iter_archive_members, member_file_name, read_head, spool_rest
+from layout import LayoutPolicy, SPLIT_MODES, SPLIT_MODE_DAY, DEFAULT_HASH_BUCKETS
+from physical_order import physical_order, READ_ORDER_NAME, READ_ORDERS
+from plan import PlanStore, PLAN_FILENAME
+from results import (
+    FileResult,
+    Run,
+    drain_run,
+    ACTION_MOVE,
+    ACTION_EXTRACT,
+    ACTION_SKIP,
+    ACTION_ERROR,
+    REASON_UNSUPPORTED,
+    REASON_DUPLICATE,
+    REASON_PERMISSION,
+    REASON_OS_ERROR,
+    REASON_UNEXPECTED,
+    REASON_TIMEOUT,
+    REASON_QUARANTINED,
+    REASON_VERIFY_FAILED,
+)
 
 # 定数定義
 SEQUENCE_NUMBER_DIGITS = 4  # 連番の桁数
+BYTES_PER_MB = 1024 * 1024
+DEFAULT_LARGE_LANE_WORKERS = 1  # 大きいファイル用レーンのデフォルトワーカー数
 
-def get_unique_filepath(target_path: Path) -> Path:
-    """衝突しないファイルパスを生成する。既存ファイルがあれば連番を付与する。"""
-    if not target_path.exists():
+def get_unique_filepath(target_path: Path, reserved=None) -> Path:
+    """
+    衝突しないファイルパスを生成する。既存ファイルがあれば連番を付与する。
+    reserved が指定された場合は、並列処理中に予約済みのパスも使用済みとみなす。
+    """
+    reserved = reserved if reserved is not None else ()
+    if target_path not in reserved and not fs.exists(target_path):
         return target_path
 
     stem = target_path.stem
@@ -29,14 +71,30 @@ def get_unique_filepath(target_path: Path) -> Path:
     while True:
         new_name = f"{stem}_{counter:0{SEQUENCE_NUMBER_DIGITS}d}{suffix}"
         new_path = parent / new_name
-        if not new_path.exists():
+        if new_path not in reserved and not fs.exists(new_path):
             return new_path
         counter += 1
 
 
-def get_target_date(file_path):
-    """ファイルの整理基準となる日付を取得する。EXIFを優先し、なければファイルの更新日時を使う。"""
-    exif_data = get_exif_data_with_exiftool(file_path)
+def read_exif(file_path, timeout: float = DEFAULT_METADATA_TIMEOUT, media_format: str = None,
+              raise_errors: bool = False) -> dict:
+    """
+    ファイルのEXIFを読む。media_format (sniff_format の結果) を指定すると、その形式に応じた最も軽い方法で読む。
+    raise_errors が True の場合、ExifToolの失敗は空の辞書ではなく ExifToolError にする。
+    """
+    if media_format is not None:
+        return read_metadata(file_path, media_format, timeout, raise_errors)
+    return get_exif_data_with_exiftool(file_path, timeout, raise_errors)
+
+def get_target_date(file_path, timeout: float = DEFAULT_METADATA_TIMEOUT, media_format: str = None,
+                    exif_data: dict = None):
+    """
+    ファイルの整理基準となる日付を取得する。EXIFを優先し、なければファイルの更新日時を使う。
+    media_format (sniff_format の結果) を指定すると、その形式に応じた最も軽い方法でEXIFを読む。
+    読み取り済みのEXIFを exif_data に渡すと、ファイルからは読まない。
+    """
+    if exif_data is None:
+        exif_data = read_exif(file_path, timeout, media_format)
     date_str_exif = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
 
     if date_str_exif:
@@ -45,85 +103,662 @@ def get_target_date(file_path):
         except ValueError:
             logging.warning(f"不正な日付フォーマットのため、更新日時を使用: {file_path}")
 
-    mtime = file_path.stat().st_mtime
+    mtime = fs.stat(file_path).st_mtime
     return datetime.fromtimestamp(mtime)
 
-def organize_files(source_dir: str, dest_dir: str, dry_run: bool, quiet: bool = False):
-    """指定されたディレクトリのファイルを、日付に基づいて整理する。"""
-    source_path = Path(source_dir)
-    dest_path = Path(dest_dir)
+def load_manifest(manifest_file) -> list:
+    """
+    ソースディレクトリの一覧 (マニフェスト) を読み込み、(ソースディレクトリ, 重み) のリストを返す。
+    1行に1ソースを書き、タブ区切りで重みを指定できる (省略時は1)。空行と # で始まる行は無視する。
+    """
+    sources = []
+    with open(manifest_file, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip('\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            path, _, weight = line.partition('\t')
+            try:
+                sources.append((path.strip(), float(weight) if weight.strip() else 1.0))
+            except ValueError:
+                raise ValueError(f"マニフェスト '{manifest_file}' の{line_number}行目の重みが不正です: {weight!r}")
+    return sources
 
-    if not source_path.is_dir() or not dest_path.is_dir():
-        logging.error("ソースディレクトリまたは宛先ディレクトリが存在しないか、ディレクトリではありません。")
-        return
+def normalize_sources(source_dir) -> list:
+    """
+    ソースの指定を (ソースディレクトリの Path, 重み) のリストにする。
+    1つのパス、またはパスか (パス, 重み) の組のリストを受け付ける。ソースにはアーカイブも指定できる。
+    """
+    if isinstance(source_dir, (str, os.PathLike)):
+        return [(Path(source_dir), 1.0)]
+    sources = []
+    for entry in source_dir:
+        if isinstance(entry, (str, os.PathLike)):
+            path, weight = entry, 1.0
+        else:
+            path, weight = entry
+        if float(weight) <= 0:
+            raise ValueError(f"ソース '{path}' の重みは0より大きい値を指定してください: {weight}")
+        sources.append((Path(path), float(weight)))
+    if not sources:
+        raise ValueError("ソースディレクトリが指定されていません。")
+    return sources
+
+def build_lanes(max_concurrency: int, min_concurrency: int = 1, large_file_threshold: int = None,
+                small_lane_workers: int = None, large_lane_workers: int = None):
+    """
+    作業レーンを構成する。large_file_threshold が指定された場合は、
+    小さいファイル用 ('small') と大きいファイル用 ('large') の2レーンに分ける。
+    """
+    if large_file_threshold is None:
+        return [Lane('default', max_concurrency, min_concurrency)]
+    return [
+        Lane('small', small_lane_workers or max_concurrency, min_concurrency),
+        Lane('large', large_lane_workers or DEFAULT_LARGE_LANE_WORKERS, min_concurrency),
+    ]
+
+def _organize_one(file_path: Path, size: int, dest_path: Path, dry_run: bool, lane: Lane, placement_lock, reserved,
+                  dest_index: DestinationIndex = None, metadata_timeout: float = DEFAULT_METADATA_TIMEOUT,
+                  quarantine: Quarantine = None, layout: LayoutPolicy = None, sniff: bool = False,
+                  verify: bool = False, session: fs.ApplySession = None, plan: PlanStore = None):
+    """
+    1ファイルを整理し、結果を FileResult で返す。対象外 (隠しファイルなど) の場合は None を返す。
+    sniff が True の場合は拡張子ではなく先頭バイトで形式を判定する。
+    verify が True の場合、別のデバイスへはハッシュを計算しながらコピーし、一致を確認してから移動元を削除する。
+    session を指定すると、移動先ディレクトリの作成と移動をそのセッションで行う (省略時は fs の関数)。
+    plan を指定すると、前回の計画から変わっていないファイルは前回のEXIFを使い、読み直さない。
+    """
+    if file_path.name.startswith('.') or not fs.is_file(file_path):
+        return None
+
+    media_format = None
+    if sniff:
+        try:
+            media_format = sniff_format(file_path)
+        except OSError as e:
+            return FileResult(
+                file_path, ACTION_ERROR, reason=REASON_OS_ERROR, level=logging.ERROR, dry_run=dry_run,
+                message=f"エラー: '{file_path}' の形式を判定できません: {e}",
+            )
+        if media_format is None:
+            return FileResult(
+                file_path, ACTION_SKIP, reason=REASON_UNSUPPORTED, level=logging.DEBUG, dry_run=dry_run,
+                message=f"スキップ: '{file_path.name}' の内容はサポート対象の画像・動画ではありません。",
+            )
+    # サポートされているファイル形式かチェック
+    elif file_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+        return FileResult(
+            file_path, ACTION_SKIP, reason=REASON_UNSUPPORTED, level=logging.DEBUG, dry_run=dry_run,
+            message=f"スキップ: '{file_path.name}' はサポート対象外のファイル形式です。",
+        )
+
+    # 過去に読み取りが制限時間を超えたファイルはExifToolに渡さない
+    if quarantine is not None and file_path in quarantine:
+        return FileResult(
+            file_path, ACTION_SKIP, reason=REASON_QUARANTINED, level=logging.WARNING, dry_run=dry_run,
+            message=f"スキップ: '{file_path}' は隔離リストに登録されています。",
+        )
+
+    def error(reason, message):
+        return FileResult(file_path, ACTION_ERROR, reason=reason, message=message, level=logging.ERROR,
+                          dry_run=dry_run, timings=timings)
+
+    timings = {}
+    checksum = None
+    try:
+        # 取り込み済みのファイルはEXIF読み取りや移動の前にスキップする
+        fingerprint = None
+        if dest_index is not None:
+            started = time.perf_counter()
+            existing, fingerprint = dest_index.lookup(file_path, size)
+            timings['index'] = time.perf_counter() - started
+            if existing is not None:
+                return FileResult(
+                    file_path, ACTION_SKIP, target=Path(existing), reason=REASON_DUPLICATE, dry_run=dry_run,
+                    message=f"スキップ: '{file_path}' は宛先に取り込み済みです ('{existing}')。", timings=timings,
+                )
+
+        exif_data = plan.lookup(file_path) if plan is not None else None
+        if exif_data is None:
+            started = time.perf_counter()
+            try:
+                # ExifToolの失敗はスロットの中で送出し、同時実行数のコントローラーにエラーとして記録させる
+                with lane.metadata_limiter.slot():
+                    exif_data = read_exif(file_path, metadata_timeout, media_format, raise_errors=True)
+                if plan is not None:
+                    plan.remember(file_path, exif_data)
+            except ExifToolError:
+                # ログは出力済み。EXIFが無いものとして更新日時で振り分ける (計画には残さず、次回読み直す)
+                exif_data = {}
+            finally:
+                timings['metadata'] = time.perf_counter() - started
+        target_date = get_target_date(file_path, exif_data=exif_data)
+        if layout is None:
+            layout = LayoutPolicy(dest_path, dry_run=dry_run)
+        # 並列実行時に同じ移動先を選ばないよう、決定と予約をまとめて行う
+        with placement_lock:
+            target_dir = layout.target_dir(target_date, file_path.name)
+            target_file_path = get_unique_filepath(target_dir / file_path.name, reserved)
+            reserved.add(target_file_path)
 
-    logging.info(f"処理を開始します。ソース: '{source_path}', 宛先: '{dest_path}'")
+        if dry_run:
+            message = f"[DRY RUN] 移動: '{file_path}' -> '{target_file_path}'"
+        else:
+            message = f"移動: '{file_path}' -> '{target_file_path}'"
+            started = time.perf_counter()
+            ops = session if session is not None else fs
+            with lane.move_limiter.slot():
+                ops.mkdir(target_dir)
+                if verify:
+                    checksum = ops.move_verified(file_path, target_file_path)
+                else:
+                    ops.move(file_path, target_file_path)
+            timings['move'] = time.perf_counter() - started
+            if checksum is not None:
+                message += f" (検証済み {checksum})"
+            if dest_index is not None:
+                dest_index.add(target_file_path, size, fingerprint, checksum)
+        return FileResult(file_path, ACTION_MOVE, target=target_file_path, message=message,
+                          dry_run=dry_run, timings=timings, checksum=checksum)
 
-    # ファイルリストを作成（プログレスバーのため）
-    files_list = list(source_path.rglob('*'))
+    except VerificationError as e:
+        return error(REASON_VERIFY_FAILED, f"エラー: '{file_path}' のコピーを検証できなかったため、移動元を残しました: {e}")
 
-    # 処理結果のカウンター
-    success_count = 0
-    skip_count = 0
-    error_count = 0
+    except MetadataTimeoutError as e:
+        if quarantine is not None:
+            quarantine.add(file_path, REASON_TIMEOUT, timings.get('metadata'))
+        return error(REASON_TIMEOUT, f"エラー: '{file_path}' のEXIF読み取りが制限時間を超えました: {e}")
+    except PermissionError:
+        return error(REASON_PERMISSION, f"エラー: '{file_path}' の移動に必要な権限がありません。")
+    except OSError as e:
+        return error(REASON_OS_ERROR, f"エラー: '{file_path}' の移動中にファイルシステムエラーが発生しました: {e}")
+    except shutil.Error as e:
+        return error(REASON_OS_ERROR, f"エラー: '{file_path}' の移動中にエラーが発生しました: {e}")
+    except Exception as e:
+        return error(REASON_UNEXPECTED, f"エラー: '{file_path}' の処理中に予期せぬエラーが発生しました: {e}")
 
-    # プログレスバーの設定
-    iterator = tqdm(files_list, desc="ファイル整理中", unit="file", disable=quiet) if not quiet else files_list
+def parse_member_date(exif_data: dict, mtime: float, label) -> datetime:
+    """メンバーのEXIFの撮影日時を返す。無い・不正な場合はメンバーの更新日時を使う"""
+    date_str_exif = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
+    if date_str_exif:
+        try:
+            return datetime.strptime(date_str_exif, '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            logging.warning(f"不正な日付フォーマットのため、更新日時を使用: {label}")
+    return datetime.fromtimestamp(mtime)
 
-    for file_path in iterator:
-        if not file_path.is_file() or file_path.name.startswith('.'):
-            continue
+def _extract_one(archive_path: Path, member, dest_path: Path, dry_run: bool, placement_lock, reserved,
+                 dest_index: DestinationIndex = None, metadata_timeout: float = DEFAULT_METADATA_TIMEOUT,
+                 layout: LayoutPolicy = None, sniff: bool = False, verify: bool = False,
+                 session: fs.ApplySession = None):
+    """
+    アーカイブの1メンバーを宛先に書き出し、結果を FileResult で返す。対象外の場合は None を返す。
+    撮影日時はメンバーの先頭 (ARCHIVE_HEAD_BYTES) だけから読み、無ければメンバーの更新日時を使う。
+    先頭に続けて残りをそのまま書き込むため、メンバーの内容は1回しか読まない。
+    宛先の同じ名前のファイルが同じサイズであれば展開済みとみなしてスキップする (再実行しても重複しない)。
+    dest_index を指定した場合、同じサイズのファイルが取り込み済みであれば残りを一時ファイルに読み切り、
+    先頭・末尾の指紋を宛先に書き出す前に照合する (一致すれば書き出さずにスキップする)。
+    """
+    file_name = member_file_name(member.name)
+    if file_name is None:
+        return None
+    source = archive_path / member.name
 
-        # サポートされているファイル形式かチェック
-        if file_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
-            logging.debug(f"スキップ: '{file_path.name}' はサポート対象外のファイル形式です。")
-            skip_count += 1
-            continue
+    def result(action, reason=None, level=logging.INFO, **kwargs):
+        return FileResult(source, action, reason=reason, level=level, dry_run=dry_run, timings=timings,
+                          source_root=archive_path, **kwargs)
 
+    timings = {}
+    if member.error is not None:
+        return result(ACTION_ERROR, REASON_UNSUPPORTED, logging.ERROR,
+                      message=f"エラー: '{source}' を開けません (未対応の圧縮方式または暗号化): {member.error}")
+    stream = member.stream
+    try:
+        started = time.perf_counter()
+        head = read_head(member.stream)
+        media_format = identify_format(head)
+        if sniff and media_format is None:
+            return result(ACTION_SKIP, REASON_UNSUPPORTED, logging.DEBUG,
+                          message=f"スキップ: '{source}' の内容はサポート対象の画像・動画ではありません。")
+        if not sniff and Path(file_name).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            return result(ACTION_SKIP, REASON_UNSUPPORTED, logging.DEBUG,
+                          message=f"スキップ: '{source}' はサポート対象外のファイル形式です。")
+        fingerprint = None
+        if dest_index is not None and dest_index.has_size(member.size):
+            # 同じサイズのファイルが取り込み済みの場合だけ残りを読み切り、末尾も含めた指紋を書き出す前に照合する
+            stream, tail = spool_rest(member.stream, PARTIAL_HASH_BYTES)
+            fingerprint = compute_fingerprint_from_bytes(head, (head + tail)[-PARTIAL_HASH_BYTES:], member.size)
+            existing = dest_index.find(fingerprint)
+            if existing is not None:
+                return result(ACTION_SKIP, REASON_DUPLICATE, target=Path(existing),
+                              message=f"スキップ: '{source}' は宛先に取り込み済みです ('{existing}')。")
         try:
-            target_date = get_target_date(file_path)
-            year = target_date.strftime("%Y")
-            month = target_date.strftime("%m")
+            exif_data = read_metadata_from_bytes(head, media_format, source, metadata_timeout)
+        finally:
+            timings['metadata'] = time.perf_counter() - started
+        target_date = parse_member_date(exif_data, member.mtime, source)
+
+        if layout is None:
+            layout = LayoutPolicy(dest_path, dry_run=dry_run)
+        with placement_lock:
+            target_dir = layout.target_dir(target_date, file_name)
+            candidate = target_dir / file_name
+            if candidate not in reserved and fs.exists(candidate) and fs.stat(candidate).st_size == member.size:
+                return result(ACTION_SKIP, REASON_DUPLICATE, target=candidate,
+                              message=f"スキップ: '{source}' は展開済みです ('{candidate}')。")
+            target_file_path = get_unique_filepath(candidate, reserved)
+            reserved.add(target_file_path)
+
+        if dry_run:
+            return result(ACTION_EXTRACT, target=target_file_path,
+                          message=f"[DRY RUN] 展開: '{source}' -> '{target_file_path}'")
+
+        started = time.perf_counter()
+        (session if session is not None else fs).mkdir(target_dir)
+        checksum = fs.write_stream(stream, target_file_path, head, member.mtime, verify)
+        timings['move'] = time.perf_counter() - started
+        message = f"展開: '{source}' -> '{target_file_path}'"
+        if checksum is not None:
+            message += f" (検証済み {checksum})"
+        if dest_index is not None:
+            dest_index.add(target_file_path, member.size, fingerprint, checksum)
+        return result(ACTION_EXTRACT, target=target_file_path, message=message, checksum=checksum)
+
+    except VerificationError as e:
+        return result(ACTION_ERROR, REASON_VERIFY_FAILED, logging.ERROR,
+                      message=f"エラー: '{source}' の書き込みを検証できませんでした: {e}")
+    except MetadataTimeoutError as e:
+        return result(ACTION_ERROR, REASON_TIMEOUT, logging.ERROR,
+                      message=f"エラー: '{source}' のEXIF読み取りが制限時間を超えました: {e}")
+    except PermissionError:
+        return result(ACTION_ERROR, REASON_PERMISSION, logging.ERROR,
+                      message=f"エラー: '{source}' の書き込みに必要な権限がありません。")
+    except OSError as e:
+        return result(ACTION_ERROR, REASON_OS_ERROR, logging.ERROR,
+                      message=f"エラー: '{source}' の展開中にファイルシステムエラーが発生しました: {e}")
+    except zipfile.BadZipFile as e:
+        # ZIPはメンバーごとに読めるため、壊れたメンバーだけをエラーにして続ける
+        return result(ACTION_ERROR, REASON_OS_ERROR, logging.ERROR,
+                      message=f"エラー: '{source}' の内容が壊れています: {e}")
+    finally:
+        if stream is not member.stream:
+            stream.close()
+
+def iter_archive_results(archive_path: Path, dest_path: Path, dry_run: bool, placement_lock, reserved, **kwargs):
+    """
+    アーカイブのメンバーを先頭から1回だけ読み進めながら宛先に展開し、結果を順次返す。
+    アーカイブ自体が壊れていて読み進められない場合は、アーカイブのエラーを1件返して終える。
+    kwargs は _extract_one の引数。
+    """
+    try:
+        for member in iter_archive_members(archive_path):
+            result = _extract_one(archive_path, member, dest_path, dry_run, placement_lock, reserved, **kwargs)
+            if result is not None:
+                yield result
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        yield FileResult(
+            archive_path, ACTION_ERROR, reason=REASON_OS_ERROR, level=logging.ERROR, dry_run=dry_run,
+            source_root=archive_path, message=f"エラー: アーカイブ '{archive_path}' を読み取れません: {e}",
+        )
+
+def check_organize_arguments(source_dir, dest_dir: str, dry_run: bool = False, read_order: str = READ_ORDER_NAME,
+                             split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY,
+                             split_buckets: int = DEFAULT_HASH_BUCKETS):
+    """
+    iter_organize_results の引数を検証し、(ソースのリスト, 配置ポリシー) を返す。
+    不正な引数は ValueError を送出する (ファイルシステムには触れない)。
+    """
+    if read_order not in READ_ORDERS:
+        raise ValueError(f"不明な読み取り順です: {read_order}（{', '.join(READ_ORDERS)} のいずれかを指定してください）")
+    sources = normalize_sources(source_dir)
+    layout = LayoutPolicy(Path(dest_dir), split_threshold, split_mode, split_buckets, dry_run=dry_run)
+    return sources, layout
 
-            target_dir = dest_path / year / month
-            target_file_path = get_unique_filepath(target_dir / file_path.name)
+def iter_organize_results(source_dir, dest_dir: str, dry_run: bool = False,
+                          min_concurrency: int = 1, max_concurrency: int = 1, metrics_file: str = None,
+                          large_file_threshold: int = None, small_lane_workers: int = None, large_lane_workers: int = None,
+                          use_dest_index: bool = False, rebuild_index: bool = False, index_workers: int = DEFAULT_INDEX_WORKERS,
+                          walk_workers: int = 1, sort: bool = False, dest_index: DestinationIndex = None,
+                          metadata_timeout: float = DEFAULT_METADATA_TIMEOUT, quarantine_file: str = None,
+                          cursor_file: str = None, split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY,
+                          split_buckets: int = DEFAULT_HASH_BUCKETS, sniff: bool = False, verify: bool = False,
+                          read_order: str = READ_ORDER_NAME, plan_file: str = None, run: Run = None):
+    """
+    指定されたディレクトリのファイルを日付に基づいて整理し、ファイルごとの結果を
+    FileResult として順次返すジェネレーター。ファイルごとのログは出力しない。
+    途中で close() すると、実行中のファイルを終えた時点で処理を打ち切る。
+    source_dir には複数のソース (パス、または (パス, 重み) の組のリスト) も指定できる。
+    複数ソースは重みに比例した割合で交互に処理し、大きなソースが他のソースを待たせないようにする。
+    EXIF読み取り・レーン・宛先インデックスは全ソースで共有し、結果の source_root にソースを設定する。
+    max_concurrency が1より大きい場合、EXIF読み取りと移動の同時実行数を
+    min_concurrency〜max_concurrency の範囲で遅延とエラー率に応じて自動調整する。
+    large_file_threshold (バイト) を指定すると、それ以上のファイルは別レーンで処理し、
+    大きな動画の移動中も小さな写真の処理が待たされないようにする。
+    use_dest_index が True の場合、宛先の取り込み済みファイルの指紋インデックスを参照し、
+    同じ内容のファイルはEXIF読み取りや移動の前にスキップする。
+    walk_workers が1より大きい場合はソースを並列に走査し、見つかったファイルから順に処理する。
+    sort が True の場合は走査を終えてからパス順に処理する (run.total に対象件数を設定する)。
+    dest_index に開いたままのインデックスを渡すと、それを使い回す（常駐モード向け）。
+    EXIF読み取りが metadata_timeout 秒を超えたファイルはExifToolを強制終了してエラーとし、
+    quarantine_file を指定した場合はそのファイルを隔離リストに追加して、以降の実行ではスキップする。
+    cursor_file を指定すると、途中で打ち切られた位置をソースごとに保存し、次回はその続きから処理する
+    (sort を有効にする。最後まで処理すると位置を消去する。dry_run では位置を読むだけで保存しない)。
+    split_threshold を指定すると、エントリ数がそれを超える月フォルダを split_mode ('day' は `YYYY/MM/DD`、
+    'hash' はファイル名のハッシュで split_buckets 個) のサブフォルダに分けて配置する。
+    sniff が True の場合は拡張子ではなくファイルの先頭バイトで形式を判定し、形式ごとに最も軽い方法で
+    EXIFを読む。画像・動画でないファイルはExifToolを起動せずにスキップする。
+    verify が True の場合、別のデバイスへの移動はハッシュを計算しながらコピーし、書き込んだ内容と
+    一致した場合のみ移動元を削除する。ハッシュは結果の checksum と宛先インデックスに記録する。
+    ソースに ZIP / TAR のアーカイブ (ARCHIVE_SUFFIXES) を指定すると、展開せずにメンバーを先頭から
+    1回だけ読み進めながら宛先に書き出す (アーカイブはそのまま残す)。撮影日時はメンバーの先頭だけから読み、
+    同じ名前・同じサイズのファイルが宛先にあれば展開済みとしてスキップする。アーカイブは続きの位置を保存しない。
+    移動先ディレクトリは実行中に1回だけ作成し、移動は移動元・移動先のディレクトリをファイルディスクリプタで
+    開いたまま、ディレクトリからの相対名で行う (fs.apply_session)。
+    read_order に 'inode' / 'extent' を指定すると、ディレクトリのソースのファイルを一定件数ずつ inode 番号順・
+    先頭エクステントの物理オフセット順に並べ替えて処理し、次の区切りのファイルの先頭は先読みを依頼しておく
+    (回転ディスク向け。カーソルは先頭から途切れずに処理し終えた位置までしか進めない)。
+    plan_file を指定すると、ディレクトリのソースのファイルごとの計画 (結果と計画に使ったEXIF) を保存し、前回の計画と
+    比べた差分の種類を結果の delta に設定する。(inode 番号, サイズ, 更新日時) が前回と同じファイルはEXIFを読み直さない。
+    dry_run でも保存する。アーカイブのメンバーは計画に含めない。
+    ソース・宛先がディレクトリ (またはアーカイブ) でない場合は NotADirectoryError を送出する。
+    """
+    sources, layout = check_organize_arguments(source_dir, dest_dir, dry_run, read_order,
+                                               split_threshold, split_mode, split_buckets)
+    dest_path = layout.dest_path
 
-            if dry_run:
-                logging.info(f"[DRY RUN] 移動: '{file_path}' -> '{target_file_path}'")
+    archives = [is_archive(path) for path, _ in sources]
+    if not all(archive or fs.is_dir(path) for (path, _), archive in zip(sources, archives)) or not fs.is_dir(dest_path):
+        raise NotADirectoryError("ソースディレクトリまたは宛先ディレクトリが存在しないか、ディレクトリではありません。")
+    # ディレクトリのソースの番号
+    directories = [index for index, archive in enumerate(archives) if not archive]
+
+    if len(sources) == 1:
+        logging.info(f"処理を開始します。ソース: '{sources[0][0]}', 宛先: '{dest_path}'")
+    else:
+        logging.info(f"処理を開始します。ソース: {len(sources)}件, 宛先: '{dest_path}'")
+
+    owns_index = dest_index is None and (use_dest_index or rebuild_index)
+    if owns_index:
+        dest_index = DestinationIndex(dest_path, read_only=dry_run)
+    try:
+        if dest_index is not None:
+            if rebuild_index or dest_index.needs_rebuild:
+                dest_index.rebuild(index_workers)
+            logging.info(f"宛先インデックス: {len(dest_index)}件のファイルを登録済み")
+
+        # 続きから処理するにはパス順が決まっている必要があるため、カーソル指定時は常に並べ替える
+        cursor = RunCursor(cursor_file, f"organize:{dest_path.resolve()}") if cursor_file else None
+        positions = cursor.load() if cursor else {}
+        sort = sort or cursor is not None
+
+        # 走査結果は逐次処理に流す。順序指定時のみ全件を集めて並べ替える（総数も判明する）
+        walks = [parallel_walk(sources[index][0], walk_workers, sort) for index in directories]
+        if sort:
+            walks = [list(files) for files in walks]
+            for k, index in enumerate(directories):
+                path = sources[index][0]
+                resume_from = positions.get(str(path))
+                if resume_from:
+                    logging.info(f"ソース '{path}' は前回の続き（'{resume_from}' の次のファイル）から処理します。")
+                    walks[k] = [entry for entry in walks[k] if entry[0] > Path(resume_from)]
+            # アーカイブのメンバー数は読み進めるまで分からないため、総数はディレクトリのみの場合に設定する
+            if run is not None and len(directories) == len(sources):
+                run.total = sum(len(files) for files in walks)
+        # ソースごとに、先頭から途切れずに処理し終えた位置を追跡する
+        marks = [LowWaterMark(file_path for file_path, _ in files) for files in walks] if cursor else None
+        files = (
+            (file_path, size, k)
+            for k, (file_path, size) in weighted_interleave(walks, [sources[index][1] for index in directories])
+        )
+        files = physical_order(files, read_order, key=lambda item: item[0])
+
+        lanes = build_lanes(max_concurrency, min_concurrency, large_file_threshold, small_lane_workers, large_lane_workers)
+        placement_lock = threading.Lock()
+        reserved = set()
+        quarantine = Quarantine(quarantine_file) if quarantine_file else None
+        plan = PlanStore(plan_file, f"organize:{dest_path.resolve()}") if plan_file else None
+        if plan is not None:
+            logging.info(f"前回の計画 ({len(plan)}件) と比べて差分を報告します: '{plan.path}'")
+        # 移動先ディレクトリの作成とファイルディスクリプタは全ソース・全レーンで共有する
+        session = fs.apply_session() if not dry_run else None
+
+        def classify(item):
+            _, size, _ = item
+            if large_file_threshold is not None and size >= large_file_threshold:
+                return 'large'
+            return lanes[0].name
+
+        def process(item, lane):
+            file_path, size, k = item
+            result = _organize_one(file_path, size, dest_path, dry_run, lane, placement_lock, reserved, dest_index,
+                                   metadata_timeout, quarantine, layout, sniff, verify, session, plan)
+            if result is not None:
+                result.source_root = sources[directories[k]][0]
+            return file_path, k, result
+
+        stop = run.should_stop if run is not None else None
+
+        def directory_results():
+            for file_path, k, result in run_lanes(process, files, lanes, classify, stop):
+                if marks is not None:
+                    marks[k].mark(file_path)
+                if result is not None:
+                    if plan is not None:
+                        result.delta = plan.record(result)
+                    yield result
+
+        # ディレクトリはレーンでまとめて処理し、アーカイブはそれぞれ1本のストリームとして重みに応じて交互に進める
+        streams, stream_weights = [], []
+        if directories:
+            streams.append(directory_results())
+            stream_weights.append(sum(sources[index][1] for index in directories))
+        for (path, weight), archive in zip(sources, archives):
+            if archive:
+                streams.append(iter_archive_results(
+                    path, dest_path, dry_run, placement_lock, reserved, dest_index=dest_index,
+                    metadata_timeout=metadata_timeout, layout=layout, sniff=sniff, verify=verify, session=session,
+                ))
+                stream_weights.append(weight)
+
+        finished = False
+        try:
+            for _, result in weighted_interleave(streams, stream_weights):
+                yield result
+                if stop is not None and stop():
+                    break
             else:
-                logging.info(f"移動: '{file_path}' -> '{target_file_path}'")
-                target_dir.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(file_path), str(target_file_path))
-            success_count += 1
-
-        except PermissionError:
-            logging.error(f"エラー: '{file_path}' の移動に必要な権限がありません。")
-            error_count += 1
-        except OSError as e:
-            logging.error(f"エラー: '{file_path}' の移動中にファイルシステムエラーが発生しました: {e}")
-            error_count += 1
-        except shutil.Error as e:
-            logging.error(f"エラー: '{file_path}' の移動中にエラーが発生しました: {e}")
-            error_count += 1
-        except Exception as e:
-            logging.error(f"エラー: '{file_path}' の処理中に予期せぬエラーが発生しました: {e}")
-            error_count += 1
-
-    # 処理結果のサマリーを表示
-    logging.info("処理が完了しました。")
-    logging.info(f"結果サマリー: 成功 {success_count}件, スキップ {skip_count}件, エラー {error_count}件")
+                finished = True
+            if not finished and directories:
+                # 打ち切った場合も、レーンで実行中だったファイルの結果は返す (移動済みのファイルをカーソルに反映する)
+                yield from streams[0]
+        finally:
+            for stream in streams:
+                stream.close()
+            if session is not None:
+                session.close()
+            if plan is not None:
+                plan.save(finished)
+                plan.close()
+            if cursor is not None and not dry_run:
+                if finished:
+                    cursor.clear()
+                else:
+                    for index, mark in zip(directories, marks):
+                        if mark.position is not None:
+                            positions[str(sources[index][0])] = str(mark.position)
+                    cursor.save(positions)
+                    logging.info(f"カーソルを保存しました: '{cursor.path}'")
+            if len(lanes) > 1 or max_concurrency > 1:
+                for lane in lanes:
+                    logging.info(
+                        f"同時実行数 [{lane.name}]: EXIF読み取り 最終 {lane.metadata_limiter.limit} (最大 {lane.metadata_limiter.peak}), "
+                        f"移動 最終 {lane.move_limiter.limit} (最大 {lane.move_limiter.peak})"
+                    )
+            if metrics_file:
+                write_concurrency_metrics(metrics_file, [c for lane in lanes for c in lane.controllers])
+    finally:
+        if owns_index:
+            dest_index.close()
+
+def organize_run(source_dir, dest_dir: str, max_seconds: float = None, max_files: int = None, **kwargs) -> Run:
+    """
+    iter_organize_results を Run として返す。引数は iter_organize_results と同じ。
+    max_seconds / max_files を指定すると予算に達した時点で打ち切る。
+    cursor_file を指定しなかった場合は、宛先ディレクトリの CURSOR_FILENAME に続きの位置を保存する。
+    """
+    if (max_seconds or max_files) and not kwargs.get('cursor_file'):
+        kwargs['cursor_file'] = str(Path(dest_dir) / CURSOR_FILENAME)
+    return Run('organize', iter_organize_results, max_seconds=max_seconds, max_files=max_files, winds_down=True,
+               source_dir=source_dir, dest_dir=dest_dir, **kwargs)
+
+def organize_files(source_dir, dest_dir: str, dry_run: bool, quiet: bool = False,
+                   min_concurrency: int = 1, max_concurrency: int = 1, metrics_file: str = None,
+                   large_file_threshold: int = None, small_lane_workers: int = None, large_lane_workers: int = None,
+                   use_dest_index: bool = False, rebuild_index: bool = False, index_workers: int = DEFAULT_INDEX_WORKERS,
+                   walk_workers: int = 1, sort: bool = False, progress=None, dest_index: DestinationIndex = None,
+                   metadata_timeout: float = DEFAULT_METADATA_TIMEOUT, quarantine_file: str = None,
+                   max_seconds: float = None, max_files: int = None, cursor_file: str = None,
+                   split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY, split_buckets: int = DEFAULT_HASH_BUCKETS,
+                   sniff: bool = False, verify: bool = False, read_order: str = READ_ORDER_NAME,
+                   plan_file: str = None):
+    """
+    指定されたディレクトリのファイルを、日付に基づいて整理する (CLI向け)。各引数は iter_organize_results を参照。
+    ファイルごとの結果をログに出力し、プログレスバーを表示する。
+    progress を指定すると、処理済み件数と総件数（不明な場合は None）を引数に呼び出す。
+    処理結果の件数を {'success', 'skip', 'error'} の辞書で返す。
+    """
+    # 引数の誤りだけをここで報告する。処理中の ValueError はファイルごとのエラーか不具合として扱う
+    try:
+        check_organize_arguments(source_dir, dest_dir, dry_run, read_order, split_threshold, split_mode, split_buckets)
+    except ValueError as e:
+        logging.error(str(e))
+        return
+    run = organize_run(
+        source_dir, dest_dir, dry_run=dry_run,
+        min_concurrency=min_concurrency, max_concurrency=max_concurrency, metrics_file=metrics_file,
+        large_file_threshold=large_file_threshold, small_lane_workers=small_lane_workers,
+        large_lane_workers=large_lane_workers, use_dest_index=use_dest_index, rebuild_index=rebuild_index,
+        index_workers=index_workers, walk_workers=walk_workers, sort=sort, dest_index=dest_index,
+        metadata_timeout=metadata_timeout, quarantine_file=quarantine_file,
+        max_seconds=max_seconds, max_files=max_files, cursor_file=cursor_file,
+        split_threshold=split_threshold, split_mode=split_mode, split_buckets=split_buckets, sniff=sniff,
+        verify=verify, read_order=read_order, plan_file=plan_file,
+    )
+    try:
+        summary = drain_run(run, "ファイル整理中", quiet=quiet, progress=progress)
+    except NotADirectoryError as e:
+        logging.error(str(e))
+        return
+    return summary.counts
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    from profiling import Profiler, PROFILERS, PROFILER_SAMPLING
 
-if __name__ == '__main__':
     default_dry_run = os.getenv('ORGANIZE_DRY_RUN', 'false').lower() in ('true', '1', 't')
     default_log_file = os.getenv('ORGANIZE_LOG_FILE')
+    default_min_concurrency = int(os.getenv('ORGANIZE_MIN_CONCURRENCY', '1'))
+    default_max_concurrency = int(os.getenv('ORGANIZE_MAX_CONCURRENCY', '1'))
+    default_large_file_threshold = os.getenv('ORGANIZE_LARGE_FILE_MB')
+    default_dest_index = os.getenv('ORGANIZE_DEST_INDEX', 'false').lower() in ('true', '1', 't')
+    default_walk_workers = int(os.getenv('ORGANIZE_WALK_WORKERS', '1'))
+    default_metadata_timeout = float(os.getenv('ORGANIZE_METADATA_TIMEOUT', str(DEFAULT_METADATA_TIMEOUT)))
+    default_quarantine_file = os.getenv('ORGANIZE_QUARANTINE_FILE')
+    default_manifest = os.getenv('ORGANIZE_MANIFEST')
+    default_max_seconds = float(os.getenv('ORGANIZE_MAX_SECONDS')) if os.getenv('ORGANIZE_MAX_SECONDS') else None
+    default_max_files = int(os.getenv('ORGANIZE_MAX_FILES')) if os.getenv('ORGANIZE_MAX_FILES') else None
+    default_cursor_file = os.getenv('ORGANIZE_CURSOR_FILE')
+    default_split_threshold = int(os.getenv('ORGANIZE_SPLIT_THRESHOLD')) if os.getenv('ORGANIZE_SPLIT_THRESHOLD') else None
+    default_split_mode = os.getenv('ORGANIZE_SPLIT_MODE', SPLIT_MODE_DAY)
+    default_split_buckets = int(os.getenv('ORGANIZE_SPLIT_BUCKETS', str(DEFAULT_HASH_BUCKETS)))
+    default_sniff = os.getenv('ORGANIZE_SNIFF', 'false').lower() in ('true', '1', 't')
+    default_profile = os.getenv('ORGANIZE_PROFILE')
+    default_profiler = os.getenv('ORGANIZE_PROFILER', PROFILER_SAMPLING)
+    default_verify = os.getenv('ORGANIZE_VERIFY', 'false').lower() in ('true', '1', 't')
+    default_read_order = os.getenv('ORGANIZE_READ_ORDER', READ_ORDER_NAME)
+    default_plan_file = os.getenv('ORGANIZE_PLAN_FILE')
 
-    parser = argparse.ArgumentParser(description='日付情報に基づいてファイルを `YYYY/MM` 形式のディレクトリに整理します。')
-    parser.add_argument('--source', required=True, help='処理対象のファイルが含まれるソースディレクトリ')
+    parser = argparse.ArgumentParser(prog=prog, description='日付情報に基づいてファイルを `YYYY/MM` 形式のディレクトリに整理します。')
+    parser.add_argument('--source', action='append', help='処理対象のファイルが含まれるソースディレクトリ、または ZIP / TAR のアーカイブ。複数回指定できます。')
+    parser.add_argument('--manifest', default=default_manifest, help=f'ソースディレクトリの一覧ファイル（1行に1ソース、タブ区切りで重みを指定可能）。デフォルト: {default_manifest}')
     parser.add_argument('--destination', required=True, help='ファイルの移動先となるルートディレクトリ')
     parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力する場合のパス。デフォルト: {default_log_file}')
     parser.add_argument('--dry-run', action='store_true', default=default_dry_run, help=f'実際にはファイルの移動を行わず、実行結果をプレビューします。デフォルト: {default_dry_run}')
     parser.add_argument('-q', '--quiet', action='store_true', help='プログレスバーを表示しません。')
+    parser.add_argument('--min-concurrency', type=int, default=default_min_concurrency, help=f'EXIF読み取り・移動の最小同時実行数。デフォルト: {default_min_concurrency}')
+    parser.add_argument('--max-concurrency', type=int, default=default_max_concurrency, help=f'EXIF読み取り・移動の最大同時実行数。1より大きい場合は遅延に応じて自動調整します。デフォルト: {default_max_concurrency}')
+    parser.add_argument('--concurrency-metrics', help='同時実行数の推移をCSV形式で出力するファイルのパス')
+    parser.add_argument('--large-file-mb', type=float, default=default_large_file_threshold, help=f'このサイズ(MB)以上のファイルを大きいファイル用レーンで処理します。未指定の場合はレーンを分けません。デフォルト: {default_large_file_threshold}')
+    parser.add_argument('--small-lane-workers', type=int, help='小さいファイル用レーンのワーカー数。デフォルト: --max-concurrency と同じ')
+    parser.add_argument('--large-lane-workers', type=int, help=f'大きいファイル用レーンのワーカー数。デフォルト: {DEFAULT_LARGE_LANE_WORKERS}')
+    parser.add_argument('--dest-index', action='store_true', default=default_dest_index, help=f'宛先の取り込み済みファイルのインデックスを使い、同じ内容のファイルをスキップします。デフォルト: {default_dest_index}')
+    parser.add_argument('--rebuild-index', action='store_true', help='宛先の `YYYY/MM` 配下をスキャンしてインデックスを作り直します。')
+    parser.add_argument('--index-workers', type=int, default=DEFAULT_INDEX_WORKERS, help=f'インデックス再構築時の並列数。デフォルト: {DEFAULT_INDEX_WORKERS}')
+    parser.add_argument('--walk-workers', type=int, default=default_walk_workers, help=f'ソースを並列に走査するスレッド数。デフォルト: {default_walk_workers}')
+    parser.add_argument('--sorted', action='store_true', help='走査を終えてからパス順に処理します（処理順が決定的になります）。')
+    parser.add_argument('--metadata-timeout', type=float, default=default_metadata_timeout, help=f'1ファイルのEXIF読み取りの制限時間(秒)。超えた場合はExifToolを強制終了してエラーにします。デフォルト: {default_metadata_timeout}')
+    parser.add_argument('--quarantine-file', default=default_quarantine_file, help=f'制限時間を超えたファイルを記録し、次回以降スキップする隔離リストのパス。デフォルト: {default_quarantine_file}')
+    parser.add_argument('--max-seconds', type=float, default=default_max_seconds, help=f'この秒数を超えたら処理中のファイルを終えた時点で打ち切り、続きの位置を保存します。デフォルト: {default_max_seconds}')
+    parser.add_argument('--max-files', type=int, default=default_max_files, help=f'この件数を処理したら打ち切り、続きの位置を保存します。デフォルト: {default_max_files}')
+    parser.add_argument('--cursor-file', default=default_cursor_file, help=f'続きの位置を保存するファイルのパス（指定時は --sorted を有効にします）。指定しない場合、--max-seconds / --max-files 指定時は宛先の {CURSOR_FILENAME} を使います。デフォルト: {default_cursor_file}')
+    parser.add_argument('--split-threshold', type=int, default=default_split_threshold, help=f'月フォルダのエントリ数がこの件数を超える場合、サブフォルダに分けて配置します。デフォルト: {default_split_threshold}')
+    parser.add_argument('--split-mode', choices=SPLIT_MODES, default=default_split_mode, help=f'月フォルダの分割方法（day: YYYY/MM/DD, hash: ファイル名のハッシュ）。デフォルト: {default_split_mode}')
+    parser.add_argument('--split-buckets', type=int, default=default_split_buckets, help=f'hash 分割時のサブフォルダ数。デフォルト: {default_split_buckets}')
+    parser.add_argument('--sniff', action='store_true', default=default_sniff, help=f'拡張子ではなくファイルの先頭バイトで形式を判定し、形式ごとに最も軽い方法でEXIFを読みます。デフォルト: {default_sniff}')
+    parser.add_argument('--profile', metavar='PREFIX', default=default_profile, help=f'処理全体をプロファイルし、PREFIX.pstats と flamegraph 用の PREFIX.collapsed を出力します。デフォルト: {default_profile}')
+    parser.add_argument('--profiler', choices=PROFILERS, default=default_profiler, help=f'プロファイラー（sampling: 低オーバーヘッドのサンプリング, cprofile: 全呼び出しを計測）。デフォルト: {default_profiler}')
+    parser.add_argument('--verify', action='store_true', default=default_verify, help=f'別のディスクへの移動時に、ハッシュを計算しながらコピーし、内容の一致を確認してから移動元を削除します。デフォルト: {default_verify}')
+    parser.add_argument('--read-order', choices=READ_ORDERS, default=default_read_order, help=f'ソースのファイルを読む順序（name: 走査順, inode: inode 番号順, extent: ディスク上の物理位置順）。回転ディスクではシークを減らせます。デフォルト: {default_read_order}')
+    parser.add_argument('--plan-file', default=default_plan_file, help=f'今回の計画を保存し、前回の計画との差分（新規・変更・移動先の変更）だけを出力する計画ファイルのパス（例: 宛先の {PLAN_FILENAME}）。変わっていないファイルはEXIFを読み直しません。デフォルト: {default_plan_file}')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.min_concurrency < 1 or args.max_concurrency < args.min_concurrency:
+        parser.error('--min-concurrency は1以上、--max-concurrency は --min-concurrency 以上を指定してください。')
+    if any(workers is not None and workers < 1 for workers in (args.small_lane_workers, args.large_lane_workers)):
+        parser.error('レーンのワーカー数は1以上を指定してください。')
+    if args.metadata_timeout <= 0:
+        parser.error('--metadata-timeout は0より大きい値を指定してください。')
+    if (args.max_seconds is not None and args.max_seconds <= 0) or (args.max_files is not None and args.max_files <= 0):
+        parser.error('--max-seconds / --max-files は0より大きい値を指定してください。')
+    if (args.split_threshold is not None and args.split_threshold < 1) or args.split_buckets < 2:
+        parser.error('--split-threshold は1以上、--split-buckets は2以上を指定してください。')
+    if not args.source and not args.manifest:
+        parser.error('--source または --manifest を指定してください。')
+    sources = list(args.source or [])
+    if args.manifest:
+        try:
+            sources += load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            parser.error(f'マニフェストを読み込めません: {e}')
     setup_logging(args.log_file)
-    organize_files(args.source, args.destination, args.dry_run, args.quiet)
+    with Profiler(args.profile, args.profiler) if args.profile else contextlib.nullcontext():
+        organize_files(
+            sources, args.destination, args.dry_run, args.quiet,
+            min_concurrency=args.min_concurrency,
+            max_concurrency=args.max_concurrency,
+            metrics_file=args.concurrency_metrics,
+            large_file_threshold=int(float(args.large_file_mb) * BYTES_PER_MB) if args.large_file_mb is not None else None,
+            small_lane_workers=args.small_lane_workers,
+            large_lane_workers=args.large_lane_workers,
+            use_dest_index=args.dest_index,
+            rebuild_index=args.rebuild_index,
+            index_workers=args.index_workers,
+            walk_workers=args.walk_workers,
+            sort=args.sorted,
+            metadata_timeout=args.metadata_timeout,
+            quarantine_file=args.quarantine_file,
+            max_seconds=args.max_seconds,
+            max_files=args.max_files,
+            cursor_file=args.cursor_file,
+            split_threshold=args.split_threshold,
+            split_mode=args.split_mode,
+            split_buckets=args.split_buckets,
+            sniff=args.sniff,
+            verify=args.verify,
+            read_order=args.read_order,
+            plan_file=args.plan_file,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+import fs
+from utils import EXIFTOOL_DATETIME_ORIGINAL_TAG, EXIFTOOL_MODEL_TAG, EXIFTOOL_SOFTWARE_TAG
+from results import (
+    FileResult,
+    ACTION_RENAME,
+    ACTION_MOVE,
+    DELTA_NEW,
+    DELTA_CHANGED,
+    DELTA_RETARGETED,
+    DELTA_UNCHANGED,
+)
+
+# 定数定義
+PLAN_FILENAME = '.image_renamer_plan.sqlite'  # 計画ファイルを置く場合の既定のファイル名
+# 計画に保存して次回の計画で使い回すEXIFの項目 (リネーム・整理の計画に使うものだけ)
+PLAN_METADATA_TAGS = (EXIFTOOL_DATETIME_ORIGINAL_TAG, EXIFTOOL_MODEL_TAG, EXIFTOOL_SOFTWARE_TAG)
+
+
+def _plan_metadata(exif_data: dict) -> dict:
+    """EXIFのうち、計画に使う項目 (PLAN_METADATA_TAGS) だけを取り出す"""
+    return {tag: exif_data[tag] for tag in PLAN_METADATA_TAGS if exif_data.get(tag) is not None}
+
+
+def _identity(path) -> tuple:
+    """ファイルが前回と同じかを判定するための (inode 番号, サイズ, 更新日時 ns)"""
+    stat = fs.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class PlanStore:
+    """
+    前回の実行で計算した計画 (ファイルごとの処理内容と、計画に使ったEXIF) を保持する計画ファイル。
+    SQLiteに永続化し、実行内容ごとのキー (scope) で区別するため、1つのファイルを複数の実行で共有してもよい。
+    (inode 番号, サイズ, 更新日時) が前回と同じファイルは lookup で前回のEXIFを返し、読み直さずに計画できるようにする。
+    record で今回の結果を前回の計画と比べ、差分の種類 (DELTA_*) を返す。
+    実際に移動・リネームしたファイルは移動先のパスで記録し、次回そのパスで見つかっても新規として扱わない。
+    """
+
+    def __init__(self, path, scope: str):
+        # sqlite3 は計画ファイルを使うときだけ読み込む (起動時間を抑えるため)
+        import sqlite3
+
+        self.path = Path(path)
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        # action が NULL の行は、前回実際に移動・リネームした後のファイル
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS plan ('
+            ' scope TEXT NOT NULL, path TEXT NOT NULL, inode INTEGER, size INTEGER, mtime_ns INTEGER,'
+            ' metadata TEXT, action TEXT, target TEXT, reason TEXT, PRIMARY KEY (scope, path))'
+        )
+        self._conn.commit()
+        self._previous = {
+            path: ((inode, size, mtime_ns), json.loads(metadata) if metadata is not None else None, (action, target, reason))
+            for path, inode, size, mtime_ns, metadata, action, target, reason in self._conn.execute(
+                'SELECT path, inode, size, mtime_ns, metadata, action, target, reason FROM plan WHERE scope = ?',
+                (scope,),
+            )
+        }
+        self._current = {}  # パス -> [(inode, サイズ, 更新日時), EXIF]。lookup から record までの間だけ保持する
+        self._rows = []  # 今回の計画として書き込む行
+        self.removed = 0  # save で計画から削除した (今回見つからなかった) ファイル数
+
+    def __len__(self):
+        return len(self._previous)
+
+    def lookup(self, path):
+        """
+        ファイルが前回の計画から変わっていなければ、前回の計画に使ったEXIFを返す。
+        新しいファイル・変わったファイル・前回EXIFを読めなかったファイルは None を返す (呼び出し側で読み、remember する)。
+        """
+        key = str(path)
+        try:
+            identity = _identity(path)
+        except OSError:
+            return None
+        with self._lock:
+            previous = self._previous.get(key)
+            reuse = previous is not None and previous[0] == identity and previous[1] is not None
+            self._current[key] = [identity, previous[1] if reuse else None]
+        return dict(previous[1]) if reuse else None
+
+    def remember(self, path, exif_data: dict):
+        """読み直したEXIFのうち、計画に使う項目 (PLAN_METADATA_TAGS) を今回の計画に保存する"""
+        metadata = _plan_metadata(exif_data)
+        with self._lock:
+            entry = self._current.get(str(path))
+            if entry is not None:
+                entry[1] = metadata
+
+    def record(self, result: FileResult) -> str:
+        """今回の結果を計画に加え、前回の計画と比べた差分の種類 (DELTA_*) を返す"""
+        key = str(result.source)
+        applied = not result.dry_run and result.action in (ACTION_RENAME, ACTION_MOVE)
+        with self._lock:
+            identity, metadata = self._current.pop(key, (None, None))
+            previous = self._previous.get(key)
+        if identity is None:
+            try:
+                identity = _identity(result.target if applied else result.source)
+            except OSError:
+                identity = (None, None, None)
+
+        planned = (result.action, str(result.target) if result.target is not None else None, result.reason)
+        if previous is None:
+            delta = DELTA_NEW
+        elif previous[0] != identity:
+            delta = DELTA_CHANGED
+        elif previous[2][0] is None or previous[2] == planned:
+            delta = DELTA_UNCHANGED
+        else:
+            delta = DELTA_RETARGETED
+
+        stored = json.dumps(metadata, ensure_ascii=False) if metadata is not None else None
+        if applied:
+            row = (self.scope, str(result.target), *identity, stored, None, None, None)
+        else:
+            row = (self.scope, key, *identity, stored, *planned)
+        with self._lock:
+            self._rows.append(row)
+        return delta
+
+    def save(self, finished: bool):
+        """
+        今回の計画を書き込む。finished が True (最後まで処理した) の場合は、今回見つからなかったファイルを
+        計画から削除する。途中で打ち切った場合は、今回処理しなかったファイルの前回の計画を残す。
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if finished:
+                seen = {row[1] for row in rows}
+                gone = [(self.scope, path) for path in self._previous if path not in seen]
+                self._conn.executemany('DELETE FROM plan WHERE scope = ? AND path = ?', gone)
+                self.removed = len(gone)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO plan (scope, path, inode, size, mtime_ns, metadata, action, target, reason)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            self._conn.commit()
+        logging.info(f"計画を保存しました: '{self.path}' ({len(rows)}件, 削除 {self.removed}件)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PlanMetadata:
+    """
+    別プロセスのワーカーに渡す、計画のEXIFの写し。PlanStore と同じ lookup / remember を持つ。
+    cached は親プロセスで PlanStore.lookup した結果 (パス -> EXIF。変わったファイルは含めない)。
+    ワーカーで読み直したEXIFは remembered に集め、親プロセスで PlanStore.remember に渡す。
+    """
+
+    def __init__(self, cached: dict):
+        self.cached = cached
+        self.remembered = {}
+
+    def lookup(self, path):
+        metadata = self.cached.get(str(path))
+        return dict(metadata) if metadata is not None else None
+
+    def remember(self, path, exif_data: dict):
+        self.remembered[str(path)] = _plan_metadata(exif_data)
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# cProfile / pstats / multiprocessing はCLIの起動を遅くするため、プロファイルするときだけ読み込む
+
+# 定数定義
+PROFILER_SAMPLING = 'sampling'  # 一定間隔で全スレッドのスタックを記録する (低オーバーヘッド)
+PROFILER_CPROFILE = 'cprofile'  # 関数の呼び出しをすべて計測する (呼び出し回数が正確だが遅くなる)
+PROFILERS = (PROFILER_SAMPLING, PROFILER_CPROFILE)
+DEFAULT_SAMPLE_INTERVAL = 0.005  # サンプリングの間隔 (秒)
+PSTATS_SUFFIX = '.pstats'
+COLLAPSED_SUFFIX = '.collapsed'  # flamegraph.pl / speedscope などが読める、1行1スタックの形式
+# ワーカープロセスにプロファイルの設定を引き継ぐ環境変数 (fork / spawn のどちらでも引き継がれる)
+PROFILE_ENV = 'IMAGE_RENAMER_PROFILE'
+
+
+def frame_label(code) -> str:
+    """スタックの1フレームの表示名 ('ファイル名:関数名')。collapsed 形式の区切り文字は含めない"""
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(';', ':').replace(' ', '_')
+
+
+def _code_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class StackSampler:
+    """
+    別スレッドから interval 秒ごとに全スレッドのスタックを記録する。
+    スタックの根元にはプロセス名とスレッド名を置き、ワーカーのスレッド・プロセスごとに区別できるようにする。
+    待機中 (ExifToolの終了待ちやロック待ちなど) のスレッドも記録するため、壁時計時間の内訳になる。
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()  # (プロセス名, スレッド名, フレーム...) -> サンプル数
+        self._codes = {}  # フレームの表示名 -> pstats 用のキー
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        import multiprocessing
+        process_name = multiprocessing.current_process().name
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    label = frame_label(frame.f_code)
+                    self._codes.setdefault(label, _code_key(frame.f_code))
+                    labels.append(label)
+                    frame = frame.f_back
+                labels.reverse()
+                self.stacks[(process_name, names.get(thread_id, f'thread-{thread_id}'), *labels)] += 1
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def create_stats(self):
+        """
+        サンプルから pstats 形式の集計 (self.stats) を作る (pstats.Stats に渡せる)。
+        呼び出し回数の代わりにサンプル数、時間はサンプル数 × 間隔を入れる。
+        """
+        self.stats = {}
+        own, total, callers = Counter(), Counter(), {}
+        for stack, count in self.stacks.items():
+            frames = [self._codes[label] for label in stack[2:]]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for key in set(frames):
+                total[key] += count
+            for caller, callee in set(zip(frames, frames[1:])):
+                callers.setdefault(callee, Counter())[caller] += count
+        for key, count in total.items():
+            edges = {caller: (n, n, 0.0, n * self.interval) for caller, n in callers.get(key, {}).items()}
+            self.stats[key] = (count, count, own[key] * self.interval, count * self.interval, edges)
+
+
+class Profiler:
+    """
+    処理全体をプロファイルし、終了時に `<path_prefix>.pstats` と `<path_prefix>.collapsed` を書き出す。
+    mode='sampling' はサンプリングの集計を pstats 形式にし、mode='cprofile' は cProfile で計測する
+    (ワーカースレッドもスレッドごとに計測して合算する)。どちらも collapsed 形式のスタックはサンプリングで記録する。
+    実行中に起動したワーカープロセスは start_worker_profiler で `<path_prefix>.<pid>.*` に書き出す。
+    """
+
+    def __init__(self, path_prefix: str, mode: str = PROFILER_SAMPLING, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILERS:
+            raise ValueError(f"不明なプロファイラーです: {mode}（{', '.join(PROFILERS)} のいずれかを指定してください）")
+        self.path_prefix = str(path_prefix)
+        self.mode = mode
+        self.interval = interval
+        self.sampler = StackSampler(interval)
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    @property
+    def pstats_path(self) -> str:
+        return self.path_prefix + PSTATS_SUFFIX
+
+    @property
+    def collapsed_path(self) -> str:
+        return self.path_prefix + COLLAPSED_SUFFIX
+
+    def _profile_thread(self, frame, event, arg):
+        # 新しいスレッドの最初のイベントで、そのスレッド専用の cProfile に切り替える
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 1つのプロファイラーで全スレッドを計測する版の Python では、既に計測されている
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    def start(self):
+        import cProfile
+        self._started_at = time.perf_counter()
+        os.environ[PROFILE_ENV] = json.dumps({'path_prefix': self.path_prefix, 'mode': self.mode, 'interval': self.interval})
+        self.sampler.start()
+        if self.mode == PROFILER_CPROFILE:
+            threading.setprofile(self._profile_thread)
+            profile = cProfile.Profile()
+            profile.enable()
+            self._profiles.append(profile)
+
+    def stop(self):
+        import pstats
+        if self.mode == PROFILER_CPROFILE:
+            threading.setprofile(None)
+            self._profiles[0].disable()
+        self.sampler.stop()
+        os.environ.pop(PROFILE_ENV, None)
+
+        written = []
+        if self.mode == PROFILER_CPROFILE:
+            stats = pstats.Stats(self._profiles[0])
+            for profile in self._profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(self.pstats_path)
+            written.append(self.pstats_path)
+        elif self.sampler.stacks:
+            pstats.Stats(self.sampler).dump_stats(self.pstats_path)
+            written.append(self.pstats_path)
+        else:
+            logging.warning(f"処理が短くサンプルが無いため '{self.pstats_path}' は出力しません。")
+        self.sampler.write_collapsed(self.collapsed_path)
+        written.append(self.collapsed_path)
+        elapsed = time.perf_counter() - self._started_at
+        logging.info(f"プロファイル ({self.mode}, {elapsed:.1f}秒) を出力しました: {', '.join(repr(p) for p in written)}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def start_worker_profiler():
+    """
+    ワーカープロセスの初期化で呼び出す。親プロセスがプロファイル中であれば、このプロセスも
+    `<path_prefix>.<pid>` に計測し、プロセスの終了時に書き出す。プロファイル中でなければ何もしない。
+    """
+    config = os.environ.get(PROFILE_ENV)
+    if not config:
+        return None
+    import multiprocessing.util
+    config = json.loads(config)
+    # fork で引き継いだ親プロセスの計測は書き出されないため外す
+    sys.setprofile(None)
+    threading.setprofile(None)
+    profiler = Profiler(f"{config['path_prefix']}.{os.getpid()}", config['mode'], config['interval'])
+    profiler.start()
+    multiprocessing.util.Finalize(None, profiler.stop, exitpriority=10)
+    return profiler
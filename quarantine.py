@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class Quarantine:
+    """
+    メタデータの読み取りが制限時間を超えるなど、処理を止める原因になったファイルの一覧。
+    JSON Lines 形式で追記し、次回以降の実行ではこれらのファイルをスキップする。
+    複数プロセスから同じファイルに追記しても1行ずつ書き込まれる。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(file_path) -> str:
+        return os.path.abspath(file_path)
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry['path']] = entry
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    logging.warning(f"隔離リスト '{self.path}' の{line_number}行目を読み取れないため無視します。")
+
+    def __contains__(self, file_path) -> bool:
+        return self._key(file_path) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, file_path):
+        """隔離されたときの記録 (reason, elapsed, time) を返す。隔離されていなければ None"""
+        return self._entries.get(self._key(file_path))
+
+    def add(self, file_path, reason: str, elapsed: float = None):
+        """ファイルを隔離リストに追加する"""
+        entry = {
+            'path': self._key(file_path),
+            'reason': reason,
+            'elapsed': round(elapsed, 3) if elapsed is not None else None,
+            'time': time.time(),
+        }
+        with self._lock:
+            if entry['path'] in self._entries:
+                return
+            self._entries[entry['path']] = entry
+            try:
+                # 1回の write で1行を書き込むため、他のプロセスの追記と混ざらない
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logging.error(f"隔離リスト '{self.path}' に書き込めませんでした: {e}")
@@ -0,0 +1,199 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import fs
+from utils import setup_logging, MetadataTimeoutError, DEFAULT_METADATA_TIMEOUT
+from concurrency import imap_bounded
+from dest_index import DestinationIndex, INDEX_FILENAME, YEAR_DIR_PATTERN, MONTH_DIR_PATTERN
+from layout import (
+    LayoutPolicy,
+    count_entries,
+    subfolder,
+    SPLIT_MODES,
+    SPLIT_MODE_DAY,
+    DEFAULT_HASH_BUCKETS,
+)
+from organize_files import get_target_date, get_unique_filepath
+from results import (
+    FileResult,
+    Run,
+    drain_run,
+    ACTION_MOVE,
+    ACTION_ERROR,
+    REASON_PERMISSION,
+    REASON_OS_ERROR,
+    REASON_UNEXPECTED,
+    REASON_TIMEOUT,
+)
+
+# 定数定義
+DEFAULT_REBALANCE_WORKERS = 4  # 再配置の並列数 (day 分割時はEXIF読み取りの並列数)
+
+
+def _sorted_entries(directory: Path):
+    return sorted(fs.scandir(directory), key=lambda entry: entry.name)
+
+
+def iter_month_dirs(dest_path: Path):
+    """宛先ライブラリの `YYYY/MM` フォルダを列挙する"""
+    for year_entry in _sorted_entries(dest_path):
+        if not year_entry.is_dir() or not YEAR_DIR_PATTERN.match(year_entry.name):
+            continue
+        for month_entry in _sorted_entries(dest_path / year_entry.name):
+            if month_entry.is_dir() and MONTH_DIR_PATTERN.match(month_entry.name):
+                yield dest_path / year_entry.name / month_entry.name
+
+
+def iter_rebalance_results(dest_dir: str, split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY,
+                           split_buckets: int = DEFAULT_HASH_BUCKETS, dry_run: bool = False,
+                           workers: int = DEFAULT_REBALANCE_WORKERS,
+                           metadata_timeout: float = DEFAULT_METADATA_TIMEOUT, run: Run = None):
+    """
+    宛先ライブラリの月フォルダをまとめて再配置し、ファイルごとの結果を FileResult として順次返すジェネレーター。
+    エントリ数が split_threshold を超える月フォルダを分割済みにし、分割済みの月フォルダの直下に
+    残っているファイルを、記録された分割方法のサブフォルダに移す (organize と同じ配置になる)。
+    移動は同じファイルシステム内のリネームで行い、宛先インデックスがあればパスも更新する。
+    宛先がディレクトリでない場合は NotADirectoryError を送出する。
+    """
+    dest_path = Path(dest_dir)
+    if not fs.is_dir(dest_path):
+        raise NotADirectoryError(f"指定されたパス '{dest_path}' はディレクトリではありません。")
+    layout = LayoutPolicy(dest_path, split_threshold, split_mode, split_buckets, dry_run=dry_run)
+
+    items = []
+    for month_dir in iter_month_dirs(dest_path):
+        split = layout.split_of(month_dir)
+        if split is None:
+            entries = count_entries(month_dir)
+            if split_threshold is None or entries <= split_threshold:
+                continue
+            logging.info(f"'{month_dir}' のエントリ数が {entries}件のため分割します（分割方法: {split_mode}）。")
+            split = layout.split(month_dir)
+        files = [month_dir / entry.name for entry in _sorted_entries(month_dir)
+                 if entry.is_file() and not entry.name.startswith('.')]
+        items.extend((month_dir, split, file_path) for file_path in files)
+    if run is not None:
+        run.total = len(items)
+
+    dest_index = None
+    if not dry_run and (dest_path / INDEX_FILENAME).exists():
+        dest_index = DestinationIndex(dest_path)
+    placement_lock = threading.Lock()
+    reserved = set()
+
+    def place(item):
+        month_dir, split, file_path = item
+        timings = {}
+        try:
+            target_date = None
+            if split[0] == SPLIT_MODE_DAY:
+                started = time.perf_counter()
+                try:
+                    target_date = get_target_date(file_path, metadata_timeout)
+                finally:
+                    timings['metadata'] = time.perf_counter() - started
+            target_dir = subfolder(month_dir, split, target_date, file_path.name)
+            with placement_lock:
+                target_file_path = get_unique_filepath(target_dir / file_path.name, reserved)
+                reserved.add(target_file_path)
+
+            if dry_run:
+                message = f"[DRY RUN] 再配置: '{file_path}' -> '{target_file_path}'"
+            else:
+                started = time.perf_counter()
+                fs.mkdir(target_dir)
+                # 同時に実行中の organize が同じ名前を使った場合は次の名前で再試行し、上書きしない
+                while not fs.rename_noreplace(file_path, target_file_path):
+                    with placement_lock:
+                        target_file_path = get_unique_filepath(target_dir / file_path.name, reserved)
+                        reserved.add(target_file_path)
+                timings['move'] = time.perf_counter() - started
+                if dest_index is not None:
+                    dest_index.relocate(file_path, target_file_path)
+                message = f"再配置: '{file_path}' -> '{target_file_path}'"
+            return FileResult(file_path, ACTION_MOVE, target=target_file_path, message=message,
+                              dry_run=dry_run, timings=timings)
+        except MetadataTimeoutError as e:
+            reason, message = REASON_TIMEOUT, f"エラー: '{file_path}' のEXIF読み取りが制限時間を超えました: {e}"
+        except PermissionError:
+            reason, message = REASON_PERMISSION, f"エラー: '{file_path}' の再配置に必要な権限がありません。"
+        except OSError as e:
+            reason, message = REASON_OS_ERROR, f"エラー: '{file_path}' の再配置中にファイルシステムエラーが発生しました: {e}"
+        except Exception as e:
+            reason, message = REASON_UNEXPECTED, f"エラー: '{file_path}' の処理中に予期せぬエラーが発生しました: {e}"
+        return FileResult(file_path, ACTION_ERROR, reason=reason, message=message, level=logging.ERROR,
+                          dry_run=dry_run, timings=timings)
+
+    try:
+        yield from imap_bounded(place, items, workers)
+    finally:
+        if dest_index is not None:
+            dest_index.close()
+
+def rebalance_run(dest_dir: str, **kwargs) -> Run:
+    """iter_rebalance_results を Run として返す。引数は iter_rebalance_results と同じ"""
+    return Run('rebalance', iter_rebalance_results, dest_dir=dest_dir, **kwargs)
+
+def rebalance_layout(dest_dir: str, split_threshold: int = None, split_mode: str = SPLIT_MODE_DAY,
+                     split_buckets: int = DEFAULT_HASH_BUCKETS, dry_run: bool = False, quiet: bool = False,
+                     workers: int = DEFAULT_REBALANCE_WORKERS, metadata_timeout: float = DEFAULT_METADATA_TIMEOUT):
+    """
+    宛先ライブラリの月フォルダを再配置する (CLI向け)。各引数は iter_rebalance_results を参照。
+    処理結果の件数を {'success', 'skip', 'error'} の辞書で返す。
+    """
+    run = rebalance_run(
+        dest_dir, split_threshold=split_threshold, split_mode=split_mode, split_buckets=split_buckets,
+        dry_run=dry_run, workers=workers, metadata_timeout=metadata_timeout,
+    )
+    try:
+        summary = drain_run(run, "再配置中", quiet=quiet)
+    except (NotADirectoryError, ValueError) as e:
+        logging.error(str(e))
+        return
+    return summary.counts
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    default_dry_run = os.getenv('REBALANCE_DRY_RUN', 'false').lower() in ('true', '1', 't')
+    default_log_file = os.getenv('REBALANCE_LOG_FILE')
+    default_workers = int(os.getenv('REBALANCE_WORKERS', str(DEFAULT_REBALANCE_WORKERS)))
+    # organize と同じ配置になるよう、分割の設定は organize の環境変数を共有する
+    default_split_threshold = int(os.getenv('ORGANIZE_SPLIT_THRESHOLD')) if os.getenv('ORGANIZE_SPLIT_THRESHOLD') else None
+    default_split_mode = os.getenv('ORGANIZE_SPLIT_MODE', SPLIT_MODE_DAY)
+    default_split_buckets = int(os.getenv('ORGANIZE_SPLIT_BUCKETS', str(DEFAULT_HASH_BUCKETS)))
+
+    parser = argparse.ArgumentParser(prog=prog, description='宛先ライブラリの大きくなりすぎた月フォルダをサブフォルダに再配置します。')
+    parser.add_argument('--destination', required=True, help='organize の宛先ルートディレクトリ')
+    parser.add_argument('--split-threshold', type=int, default=default_split_threshold, help=f'エントリ数がこの件数を超える月フォルダを分割します。未指定の場合は分割済みの月フォルダのみ再配置します。デフォルト: {default_split_threshold}')
+    parser.add_argument('--split-mode', choices=SPLIT_MODES, default=default_split_mode, help=f'月フォルダの分割方法（day: YYYY/MM/DD, hash: ファイル名のハッシュ）。デフォルト: {default_split_mode}')
+    parser.add_argument('--split-buckets', type=int, default=default_split_buckets, help=f'hash 分割時のサブフォルダ数。デフォルト: {default_split_buckets}')
+    parser.add_argument('--workers', type=int, default=default_workers, help=f'再配置の並列数。デフォルト: {default_workers}')
+    parser.add_argument('--metadata-timeout', type=float, default=DEFAULT_METADATA_TIMEOUT, help=f'1ファイルのEXIF読み取りの制限時間(秒)。デフォルト: {DEFAULT_METADATA_TIMEOUT}')
+    parser.add_argument('--dry-run', action='store_true', default=default_dry_run, help=f'実際には移動せず、再配置の結果をプレビューします。デフォルト: {default_dry_run}')
+    parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力します。デフォルト: {default_log_file}')
+    parser.add_argument('-q', '--quiet', action='store_true', help='プログレスバーを表示しません。')
+    args = parser.parse_args(argv)
+    if (args.split_threshold is not None and args.split_threshold < 1) or args.split_buckets < 2:
+        parser.error('--split-threshold は1以上、--split-buckets は2以上を指定してください。')
+    if args.workers < 1 or args.metadata_timeout <= 0:
+        parser.error('--workers は1以上、--metadata-timeout は0より大きい値を指定してください。')
+
+    setup_logging(args.log_file)
+    rebalance_layout(
+        args.destination,
+        split_threshold=args.split_threshold,
+        split_mode=args.split_mode,
+        split_buckets=args.split_buckets,
+        dry_run=args.dry_run,
+        quiet=args.quiet,
+        workers=args.workers,
+        metadata_timeout=args.metadata_timeout,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,99 @@
+import contextlib
+import itertools
 import os
 import re
+import heapq
+import threading
+import time
+import uuid
 import argparse
 import logging
+from collections import deque
 from pathlib import Path
 from datetime import datetime
-from tqdm import tqdm
 
 from utils import (
     setup_logging,
+    capture_logs,
     get_exif_data_with_exiftool,
+    set_exiftool_pool,
+    MetadataTimeoutError,
+    ExifToolError,
+    DEFAULT_METADATA_TIMEOUT,
     EXIFTOOL_DATETIME_ORIGINAL_TAG,
     EXIFTOOL_MODEL_TAG,
     EXIFTOOL_SOFTWARE_TAG,
     SUPPORTED_EXTENSIONS,
 )
+from concurrency import AIMDController, write_concurrency_metrics
+from walker import parallel_walk
+from sequence import SequenceReservations, DEFAULT_RESERVE_BATCH
+from external_sort import ExternalSorter, DEFAULT_SORT_BUFFER
+from physical_order import imap_physical, READ_ORDER_NAME, READ_ORDERS
+import fs
+from quarantine import Quarantine
+from cursor import RunCursor, CURSOR_FILENAME
+from plan import PlanStore, PlanMetadata, PLAN_FILENAME
+from sniff import sniff_format, read_metadata, UnsupportedMediaError
+from results import (
+    FileResult,
+    Run,
+    drain_run,
+    ACTION_RENAME,
+    ACTION_SKIP,
+    ACTION_ERROR,
+    REASON_UNSUPPORTED,
+    REASON_ALREADY_RENAMED,
+    REASON_ALREADY_NAMED,
+    REASON_NO_DATETIME,
+    REASON_INVALID_DATETIME,
+    REASON_PERMISSION,
+    REASON_OS_ERROR,
+    REASON_UNEXPECTED,
+    REASON_TIMEOUT,
+    REASON_QUARANTINED,
+)
 
 # 定数定義
 RENAMED_FILE_PATTERN = re.compile(r"^\d{8}_\d{4}_.*")  # リネーム済みファイル名の形式
 SEQUENCE_NUMBER_DIGITS = 4  # 連番の桁数
 DEFAULT_DEVICE_NAME = 'UnknownDevice'  # デバイス名が取得できない場合のデフォルト値
 IOS_VERSION_PATTERN = re.compile(r'^\d{1,2}(\.\d{1,2}){1,2}$')  # iOSバージョン番号パターン
+ORDER_NAME = 'name'  # 連番をファイル名順に振る
+ORDER_CAPTURE = 'capture'  # 連番を (ディレクトリ, 日付, デバイス) ごとに撮影日時順に振る
+ORDERS = (ORDER_NAME, ORDER_CAPTURE)
+# 撮影日時順に並べ替えるときに一時ファイルへ持ち越すEXIFの項目 (リネームに使うものだけ)
+CAPTURE_ORDER_TAGS = (EXIFTOOL_DATETIME_ORIGINAL_TAG, EXIFTOOL_MODEL_TAG, EXIFTOOL_SOFTWARE_TAG)
+RENUMBER_TEMP_SUFFIX = '.renumber'  # 連番の振り直しで入れ替えの循環を解消するときの一時的な名前の接尾辞
+
+def get_next_filename(base_path: Path, date_str: str, device_name: str, suffix: str,
+                      reservations: SequenceReservations = None, existing_names: set = None) -> Path:
+    """
+    指定された日付とデバイス名で、連番のファイル名を生成する。
+    reservations が指定された場合は、他プロセスと衝突しないよう予約済みの範囲から連番を取り出す。
+    existing_names が指定された場合は、ファイルの存在確認の代わりにその名前の集合を参照する。
+    """
+    def is_free(path: Path) -> bool:
+        if existing_names is not None:
+            return path.name not in existing_names
+        return not fs.exists(path)
 
-def get_next_filename(base_path: Path, date_str: str, device_name: str, suffix: str) -> Path:
-    """指定された日付とデバイス名で、連番のファイル名を生成する"""
-    counter = 1
+    if reservations is None:
+        counter = 1
+        while True:
+            new_name = f"{date_str}_{counter:0{SEQUENCE_NUMBER_DIGITS}d}_{device_name}{suffix}"
+            new_path = base_path / new_name
+            if is_free(new_path):
+                return new_path
+            counter += 1
+
+    key = f"{date_str}_{device_name}{suffix}"
     while True:
+        counter = reservations.next_counter(base_path, key)
         new_name = f"{date_str}_{counter:0{SEQUENCE_NUMBER_DIGITS}d}_{device_name}{suffix}"
         new_path = base_path / new_name
-        if not new_path.exists():
+        if is_free(new_path):
             return new_path
-        counter += 1
 
 def get_device_name(exif_data):
     """EXIFデータからデバイス名を取得する。Modelを優先し、なければSoftwareを整形して使用する。"""
@@ -49,121 +113,751 @@ def get_device_name(exif_data):
 
     return DEFAULT_DEVICE_NAME
 
-def rename_image_files(directory: str, dry_run: bool = False, recursive: bool = False, force: bool = False, quiet: bool = False):
+class NameIndexCache:
     """
-    指定されたディレクトリ内の画像ファイルのファイル名を、
-    EXIF情報に基づいてリネームする。
+    ディレクトリのファイル名一覧のキャッシュ。ディレクトリの更新日時が変わっていなければ
+    前回の一覧を再利用し、常駐モードで同じディレクトリを繰り返し処理するときの走査を省く。
+    entries を指定すると、別のキャッシュの entries() の内容から始める (ワーカープロセスに渡すため)。
     """
-    target_dir = Path(directory)
-    if not target_dir.is_dir():
-        logging.error(f"指定されたパス '{directory}' はディレクトリではありません。")
-        return
 
-    logging.info(f"ディレクトリ '{target_dir.resolve()}' の処理を開始します...")
-    if force:
-        logging.warning("強制実行モード: リネーム済みのファイルも再処理します。")
+    def __init__(self, entries: dict = None):
+        self._entries = dict(entries) if entries else {}
+        self._lock = threading.Lock()
 
-    if recursive:
-        logging.info("再帰モード: サブディレクトリを検索します...")
-        files_to_process = target_dir.rglob('*')
-    else:
-        files_to_process = target_dir.iterdir()
+    def entries(self, directories=None) -> dict:
+        """キャッシュの内容 (ディレクトリ -> (更新日時, 名前の集合))。directories を指定するとそのディレクトリだけ"""
+        with self._lock:
+            if directories is None:
+                return dict(self._entries)
+            return {directory: self._entries[directory] for directory in directories if directory in self._entries}
+
+    def update(self, entries: dict):
+        """別のキャッシュの entries() の内容を取り込む"""
+        with self._lock:
+            self._entries.update(entries)
+
+    def get(self, directory: Path) -> set:
+        mtime = fs.stat(directory).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(directory)
+        if entry is not None and entry[0] == mtime:
+            return set(entry[1])
+        return set(fs.listdir(directory))
 
-    # ファイルリストを作成（プログレスバーのため）
-    files_list = sorted(list(files_to_process))
+    def store(self, directory: Path, names: set):
+        try:
+            mtime = fs.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            self._entries[directory] = (mtime, frozenset(names))
+
+def _rename_order(path: Path):
+    """処理順のキー。ディレクトリごとにまとめ、ディレクトリ内はファイル名順に処理する"""
+    return (path.parent, path.name)
 
-    # 処理結果のカウンター
-    success_count = 0
-    skip_count = 0
-    error_count = 0
+def _capture_order_key(path: Path, exif_data):
+    """
+    撮影日時順に並べるキー [日付, デバイス名, 撮影日時, ファイル名]。同じ日付・デバイスの連番が撮影日時順になる。
+    読み取りに失敗した・撮影日時が無い・不正なファイルは None (並べ替えずにすぐ結果を返す)。
+    """
+    if isinstance(exif_data, Exception):
+        return None
+    date_str_exif = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
+    if not date_str_exif:
+        return None
+    try:
+        dt_original = datetime.strptime(date_str_exif, '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    return [dt_original.strftime('%Y%m%d'), get_device_name(exif_data), dt_original.isoformat(), path.name]
 
-    # プログレスバーの設定
-    iterator = tqdm(files_list, desc="ファイル処理中", unit="file", disable=quiet) if not quiet else files_list
+def _in_capture_order(prefetched, sort_buffer: int = DEFAULT_SORT_BUFFER):
+    """
+    (パス, EXIF, 読み取り時間) をディレクトリごとに撮影日時順に並べ替えて返す。prefetched はディレクトリごとに
+    まとまっていること。ディレクトリ内が sort_buffer 件を超える場合は一時ファイルを使う外部マージソートで並べ、
+    メモリに載せる件数を抑える。並べ替えられないファイル (_capture_order_key が None) は先に返す。
+    """
+    for parent_dir, items in itertools.groupby(prefetched, key=lambda item: item[0].parent):
+        with ExternalSorter(key=lambda record: record[0], buffer_size=sort_buffer) as sorter:
+            for path, exif_data, metadata_seconds in items:
+                key = _capture_order_key(path, exif_data)
+                if key is None:
+                    yield path, exif_data, metadata_seconds
+                    continue
+                tags = {tag: exif_data[tag] for tag in CAPTURE_ORDER_TAGS if tag in exif_data}
+                sorter.add([key, path.name, tags, metadata_seconds])
+            if sorter.spilled:
+                logging.info(f"'{parent_dir}' の {len(sorter)}件を一時ファイル {sorter.spilled}個で撮影日時順に並べ替えます。")
+            for _, name, tags, metadata_seconds in sorter:
+                yield parent_dir / name, tags, metadata_seconds
 
-    for original_path in iterator:
-        if not original_path.is_file() or original_path.name.startswith('.'):
+def _select_candidates(files_list, force: bool, quarantine: Quarantine = None, sniff: bool = False):
+    """
+    EXIF読み取りの対象を絞り込み、(対象ファイルのリスト, スキップ結果のリスト) を返す。
+    sniff が True の場合は拡張子で絞り込まず、EXIF読み取りの直前にファイルの内容で判定する。
+    """
+    candidates = []
+    skipped = []
+    for original_path in files_list:
+        if original_path.name.startswith('.') or not fs.is_file(original_path):
             continue
 
         # サポートされているファイル形式かチェック
-        if original_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
-            logging.debug(f"スキップ: '{original_path.name}' はサポート対象外のファイル形式です。")
-            skip_count += 1
+        if not sniff and original_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+            skipped.append(FileResult(
+                original_path, ACTION_SKIP, reason=REASON_UNSUPPORTED, level=logging.DEBUG,
+                message=f"スキップ: '{original_path.name}' はサポート対象外のファイル形式です。",
+            ))
             continue
 
         # --forceが指定されていない場合のみ、リネーム済みファイルをスキップ
         if not force and RENAMED_FILE_PATTERN.match(original_path.name):
-            logging.info(f"スキップ: '{original_path.name}' はリネーム済みです。")
-            skip_count += 1
+            skipped.append(FileResult(
+                original_path, ACTION_SKIP, reason=REASON_ALREADY_RENAMED,
+                message=f"スキップ: '{original_path.name}' はリネーム済みです。",
+            ))
             continue
 
-        try:
-            parent_dir = original_path.parent
-            exif_data = get_exif_data_with_exiftool(original_path)
-            date_str_exif = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
+        # 過去に読み取りが制限時間を超えたファイルはExifToolに渡さない
+        if quarantine is not None and original_path in quarantine:
+            skipped.append(FileResult(
+                original_path, ACTION_SKIP, reason=REASON_QUARANTINED, level=logging.WARNING,
+                message=f"スキップ: '{original_path.name}' は隔離リストに登録されています。",
+            ))
+            continue
 
-            if not date_str_exif:
-                logging.warning(f"スキップ: '{original_path.name}' に撮影日時のEXIF情報がありません。")
-                skip_count += 1
-                continue
+        candidates.append(original_path)
+    return candidates, skipped
 
-            dt_original = datetime.strptime(date_str_exif, '%Y:%m:%d %H:%M:%S')
-            date_prefix = dt_original.strftime('%Y%m%d')
+def _rename_one(original_path: Path, exif_data, dry_run: bool, reservations, existing_names: set,
+                session: fs.ApplySession = None) -> FileResult:
+    """1ファイルをリネームし、結果を FileResult で返す。session を指定するとそのセッションでリネームする"""
+    def error(reason, message):
+        return FileResult(original_path, ACTION_ERROR, reason=reason, message=message, level=logging.ERROR, dry_run=dry_run)
 
-            device_name = get_device_name(exif_data)
+    try:
+        if isinstance(exif_data, UnsupportedMediaError):
+            return FileResult(
+                original_path, ACTION_SKIP, reason=REASON_UNSUPPORTED, level=logging.DEBUG, dry_run=dry_run,
+                message=f"スキップ: '{original_path.name}' の内容はサポート対象の画像・動画ではありません。",
+            )
+        if isinstance(exif_data, Exception):
+            raise exif_data
+        parent_dir = original_path.parent
+        date_str_exif = exif_data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG)
 
-            suffix = original_path.suffix.lower()
-            new_path = get_next_filename(parent_dir, date_prefix, device_name, suffix)
+        if not date_str_exif:
+            return FileResult(
+                original_path, ACTION_SKIP, reason=REASON_NO_DATETIME, level=logging.WARNING, dry_run=dry_run,
+                message=f"スキップ: '{original_path.name}' に撮影日時のEXIF情報がありません。",
+            )
 
-            # 新しいファイル名が元のファイル名と同じ場合はスキップ
-            if new_path == original_path:
-                logging.info(f"スキップ: '{original_path.name}' は既に正しい名前です。")
-                skip_count += 1
-                continue
+        dt_original = datetime.strptime(date_str_exif, '%Y:%m:%d %H:%M:%S')
+        date_prefix = dt_original.strftime('%Y%m%d')
 
-            if dry_run:
-                logging.info(f"[DRY RUN] リネーム: '{original_path.name}' -> '{new_path.name}'")
-            else:
-                original_path.rename(new_path)
-                logging.info(f"リネーム: '{original_path.name}' -> '{new_path.name}'")
-            success_count += 1
+        device_name = get_device_name(exif_data)
+
+        suffix = original_path.suffix.lower()
+        new_path = get_next_filename(parent_dir, date_prefix, device_name, suffix, reservations, existing_names)
+
+        # 新しいファイル名が元のファイル名と同じ場合はスキップ
+        if new_path == original_path:
+            return FileResult(
+                original_path, ACTION_SKIP, target=new_path, reason=REASON_ALREADY_NAMED, dry_run=dry_run,
+                message=f"スキップ: '{original_path.name}' は既に正しい名前です。",
+            )
+
+        if dry_run:
+            message = f"[DRY RUN] リネーム: '{original_path.name}' -> '{new_path.name}'"
+        else:
+            # 他のプロセスが同じ名前を先に使った場合でも上書きせず、次の連番で再試行する
+            ops = session if session is not None else fs
+            while not ops.rename_noreplace(original_path, new_path):
+                existing_names.add(new_path.name)
+                new_path = get_next_filename(parent_dir, date_prefix, device_name, suffix, reservations, existing_names)
+            message = f"リネーム: '{original_path.name}' -> '{new_path.name}'"
+        existing_names.discard(original_path.name)
+        existing_names.add(new_path.name)
+        return FileResult(original_path, ACTION_RENAME, target=new_path, message=message, dry_run=dry_run)
 
-        except ValueError as e:
-            logging.error(f"エラー: '{original_path.name}' の日時フォーマットが不正です: {e}")
-            error_count += 1
+    except MetadataTimeoutError as e:
+        return error(REASON_TIMEOUT, f"エラー: '{original_path.name}' のEXIF読み取りが制限時間を超えました: {e}")
+    except ValueError as e:
+        return error(REASON_INVALID_DATETIME, f"エラー: '{original_path.name}' の日時フォーマットが不正です: {e}")
+    except PermissionError:
+        return error(REASON_PERMISSION, f"エラー: '{original_path.name}' のリネームに必要な権限がありません。")
+    except OSError as e:
+        return error(REASON_OS_ERROR, f"エラー: '{original_path.name}' のリネーム中にファイルシステムエラーが発生しました: {e}")
+    except Exception as e:
+        return error(REASON_UNEXPECTED, f"エラー: '{original_path.name}' の処理中に予期せぬエラーが発生しました: {e}")
+
+def _plan_renumber(items, existing_names: set) -> dict:
+    """
+    連番を振り直した後のファイル名を {現在の名前: 最終的な名前} で返す。items は (パス, EXIF) を連番を振る順に並べたもの。
+    (日付, デバイス, 拡張子) ごとに 0001 から振り、対象外のファイルが使っている名前は飛ばす。
+    """
+    occupied = set(existing_names) - {path.name for path, _ in items}
+    counters = {}
+    targets = {}
+    for path, exif_data in items:
+        date_prefix, device_name, _, _ = _capture_order_key(path, exif_data)
+        suffix = path.suffix.lower()
+        group = (date_prefix, device_name, suffix)
+        counter = counters.get(group, 0)
+        while True:
+            counter += 1
+            new_name = f"{date_prefix}_{counter:0{SEQUENCE_NUMBER_DIGITS}d}_{device_name}{suffix}"
+            if new_name not in occupied:
+                break
+        counters[group] = counter
+        targets[path.name] = new_name
+    return targets
+
+def _renumber_directory(parent_dir: Path, items, dry_run: bool, existing_names: set,
+                        session: fs.ApplySession = None):
+    """
+    1ディレクトリの対象ファイルの連番をまとめて振り直し (--renumber)、結果をファイル名順に返す。
+    items は (パス, EXIF, 読み取り時間) を連番を振る順に並べたもの。先に全ファイルの最終的な名前を決め、
+    既にその名前のファイルは動かさない。移動先を別の対象ファイルが使っている場合はそのファイルが動くのを待ち、
+    入れ替えの循環 (A->B, B->A など) は1件を一時的な名前に退避してから移動する。
+    """
+    results = {}
+    valid = []
+    metadata_seconds = {}
+    for path, exif_data, seconds in items:
+        metadata_seconds[path.name] = seconds
+        if _capture_order_key(path, exif_data) is None:
+            # 撮影日時が無い・読み取りに失敗したファイルは通常のリネームと同じ結果になる (移動はしない)
+            results[path.name] = _rename_one(path, exif_data, dry_run, None, existing_names, session)
+        else:
+            valid.append((path, exif_data))
+
+    targets = _plan_renumber(valid, existing_names)
+    moves = {}
+    for name, new_name in targets.items():
+        if name == new_name:
+            results[name] = FileResult(
+                parent_dir / name, ACTION_SKIP, target=parent_dir / name, reason=REASON_ALREADY_NAMED, dry_run=dry_run,
+                message=f"スキップ: '{name}' は既に正しい名前です。",
+            )
+        elif dry_run:
+            results[name] = FileResult(parent_dir / name, ACTION_RENAME, target=parent_dir / new_name, dry_run=True,
+                                       message=f"[DRY RUN] リネーム: '{name}' -> '{new_name}'")
+        else:
+            moves[name] = new_name
+
+    ops = session if session is not None else fs
+    timings = {}
+    original_names = {name: name for name in moves}  # 現在の名前 (一時的な名前を含む) -> 元の名前
+
+    def rename(src: str, dst: str):
+        started = time.perf_counter()
+        try:
+            if not ops.rename_noreplace(parent_dir / src, parent_dir / dst):
+                raise FileExistsError(f"移動先 '{dst}' が既に存在します")
+        finally:
+            timings[original_names[src]] = timings.get(original_names[src], 0) + time.perf_counter() - started
+        existing_names.discard(src)
+        existing_names.add(dst)
+
+    def fail(src: str, reason: str, message: str):
+        # このファイルの名前が空かないため、それを待っていたファイルも移動できない (循環なら一周で止まる)
+        while src in moves:
+            dst = moves.pop(src)
+            original = original_names[src]
+            where = ""
+            if src != original:
+                # 一時的な名前に退避したファイルは元の名前に戻す
+                try:
+                    restored = ops.rename_noreplace(parent_dir / src, parent_dir / original)
+                except OSError:
+                    restored = False
+                if restored:
+                    existing_names.discard(src)
+                    existing_names.add(original)
+                else:
+                    where = f" (一時的な名前 '{src}' のまま残っています)"
+            results[original] = FileResult(parent_dir / original, ACTION_ERROR, reason=reason, level=logging.ERROR,
+                                           message=f"エラー: '{original}' -> '{dst}' のリネームに失敗しました{where}: {message}")
+            src = waiting.pop(src, None)
+            reason, message = REASON_OS_ERROR, f"移動先 '{original}' が空きませんでした"
+
+    def attempt(src: str, dst: str) -> bool:
+        try:
+            rename(src, dst)
+            return True
         except PermissionError:
-            logging.error(f"エラー: '{original_path.name}' のリネームに必要な権限がありません。")
-            error_count += 1
+            fail(src, REASON_PERMISSION, "リネームに必要な権限がありません")
         except OSError as e:
-            logging.error(f"エラー: '{original_path.name}' のリネーム中にファイルシステムエラーが発生しました: {e}")
-            error_count += 1
+            fail(src, REASON_OS_ERROR, str(e))
+        return False
+
+    # 移動先の名前 -> その名前が空くのを待っているファイル
+    waiting = {dst: src for src, dst in moves.items() if dst in moves}
+    ready = deque(src for src, dst in moves.items() if dst not in moves)
+    while moves:
+        if not ready:
+            # 残りは入れ替えの循環だけ。1件を一時的な名前に退避して循環を切る
+            src = next(iter(moves))
+            temp = f".{src}.{uuid.uuid4().hex[:8]}{RENUMBER_TEMP_SUFFIX}"
+            if not attempt(src, temp):
+                continue
+            original_names[temp] = original_names.pop(src)
+            moves[temp] = moves.pop(src)
+            if moves[temp] in moves:
+                waiting[moves[temp]] = temp
+            else:
+                ready.append(temp)
+            if src in waiting:
+                ready.append(waiting.pop(src))
+            continue
+        src = ready.popleft()
+        if src not in moves:
+            continue
+        dst = moves[src]
+        if attempt(src, dst):
+            del moves[src]
+            original = original_names[src]
+            results[original] = FileResult(parent_dir / original, ACTION_RENAME, target=parent_dir / dst,
+                                           message=f"リネーム: '{original}' -> '{dst}'")
+            if src in waiting:
+                ready.append(waiting.pop(src))
+
+    for name in sorted(results):
+        result = results[name]
+        result.timings = {'metadata': metadata_seconds[name], 'rename': timings.get(name, 0.0)}
+        yield result
+
+def _rename_each(items, dry_run: bool, reservations, existing_names: set, session: fs.ApplySession = None):
+    """(パス, EXIF, 読み取り時間) を1件ずつ順にリネームし、結果を返す"""
+    for original_path, exif_data, metadata_seconds in items:
+        started = time.perf_counter()
+        result = _rename_one(original_path, exif_data, dry_run, reservations, existing_names, session)
+        result.timings = {'metadata': metadata_seconds, 'rename': time.perf_counter() - started}
+        yield result
+
+def _iter_rename(candidates, dry_run: bool, reservations, metadata_limiter, max_concurrency: int,
+                 name_cache: NameIndexCache = None, metadata_timeout: float = DEFAULT_METADATA_TIMEOUT,
+                 quarantine: Quarantine = None, sniff: bool = False, order: str = ORDER_NAME,
+                 sort_buffer: int = DEFAULT_SORT_BUFFER, renumber: bool = False, read_order: str = READ_ORDER_NAME,
+                 plan: PlanStore = None):
+    """
+    対象ファイルのEXIFを並列に先読みしつつ、リネームは連番を安定させるためパス順に逐次実行する。
+    ファイルごとの結果を順に返す。EXIF読み取りが制限時間を超えたファイルは隔離リストに追加する。
+    sniff が True の場合は先頭バイトで形式を判定し、画像・動画でなければExifToolを起動せずにスキップする。
+    リネームはディレクトリをファイルディスクリプタで開いたまま、ディレクトリからの相対名で行う (fs.apply_session)。
+    order が ORDER_CAPTURE の場合は、ディレクトリ内のEXIFを読み終えてから撮影日時順にリネームする。
+    renumber が True の場合は、ディレクトリごとにEXIFを読み終えてから連番をまとめて振り直す (_renumber_directory)。
+    read_order が READ_ORDER_NAME 以外の場合、EXIFはディスク上の位置の順に読み、リネームはパス順のまま行う (imap_physical)。
+    plan を指定すると、前回の計画から変わっていないファイルは前回のEXIFを使い、読み直さない (読み取り時間は None)。
+    """
+    def read_exif(path):
+        if plan is not None:
+            cached = plan.lookup(path)
+            if cached is not None:
+                return path, cached, None
+        started = time.perf_counter()
+        try:
+            # ExifToolの失敗はスロットの中で送出し、同時実行数のコントローラーにエラーとして記録させる
+            with metadata_limiter.slot():
+                if sniff:
+                    media_format = sniff_format(path)
+                    if media_format is None:
+                        raise UnsupportedMediaError(path)
+                    exif_data = read_metadata(path, media_format, metadata_timeout, raise_errors=True)
+                else:
+                    exif_data = get_exif_data_with_exiftool(path, metadata_timeout, raise_errors=True)
+            if plan is not None:
+                plan.remember(path, exif_data)
+        except ExifToolError:
+            # ログは出力済み。EXIFが無いものとして扱う (計画には残さず、次回読み直す)
+            exif_data = {}
         except Exception as e:
-            logging.error(f"エラー: '{original_path.name}' の処理中に予期せぬエラーが発生しました: {e}")
-            error_count += 1
+            exif_data = e
+        return path, exif_data, time.perf_counter() - started
 
-    # 処理結果のサマリーを表示
-    logging.info("処理が完了しました。")
-    logging.info(f"結果サマリー: 成功 {success_count}件, スキップ {skip_count}件, エラー {error_count}件")
+    # ディレクトリごとのファイル名の集合。存在確認のたびにファイルシステムへ問い合わせないようにする
+    name_indexes = {}
+    session = fs.apply_session() if not dry_run else None
+    try:
+        prefetched = imap_physical(read_exif, candidates, max_concurrency, read_order)
+        if order == ORDER_CAPTURE:
+            prefetched = _in_capture_order(prefetched, sort_buffer)
+        for parent_dir, items in itertools.groupby(prefetched, key=lambda item: item[0].parent):
+            if parent_dir not in name_indexes:
+                name_indexes[parent_dir] = name_cache.get(parent_dir) if name_cache else set(fs.listdir(parent_dir))
+            if renumber:
+                results = _renumber_directory(parent_dir, list(items), dry_run, name_indexes[parent_dir], session)
+            else:
+                results = _rename_each(items, dry_run, reservations, name_indexes[parent_dir], session)
+            for result in results:
+                if result.reason == REASON_TIMEOUT and quarantine is not None:
+                    quarantine.add(result.source, REASON_TIMEOUT, result.timings['metadata'])
+                yield result
+    finally:
+        if session is not None:
+            session.close()
+
+    if name_cache is not None and not dry_run:
+        for parent_dir, names in name_indexes.items():
+            name_cache.store(parent_dir, names)
+
+# ワーカープロセスごとに共有する状態（_init_rename_worker で初期化）
+_worker_state = {}
+
+def _init_rename_worker(min_concurrency: int, max_concurrency: int, metadata_timeout: float, quarantine_file: str,
+                        sniff: bool = False):
+    """ワーカープロセスの初期化。ログは親プロセスでまとめて出力するため、ここでは溜めておく"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    # fork したワーカーは親プロセスのExifToolセッションのパイプを引き継ぐため、親のプールは使わない
+    set_exiftool_pool(None)
+    _worker_state['metadata_limiter'] = AIMDController('metadata', min_concurrency, max_concurrency)
+    _worker_state['max_concurrency'] = max_concurrency
+    _worker_state['metadata_timeout'] = metadata_timeout
+    _worker_state['quarantine'] = Quarantine(quarantine_file) if quarantine_file else None
+    _worker_state['sniff'] = sniff
+    # 親プロセスが --profile で計測中であれば、このプロセスも計測する
+    from profiling import start_worker_profiler
+    start_worker_profiler()
+
+def _rename_directory(task):
+    """
+    ワーカープロセスで1ディレクトリ分のファイルをリネームし、(結果のリスト, ログ, 読み直したEXIF, 名前の一覧) を返す。
+    計画のEXIF (cached_metadata) とファイル名一覧のキャッシュ (name_entries) は親プロセスから受け取り、
+    ワーカーで読み直したEXIFと更新した一覧を親プロセスに返す (使わない場合はそれぞれ None)。
+    """
+    files, dry_run, lock, reserve_batch, order, sort_buffer, renumber, read_order, cached_metadata, name_entries = task
+    reservations = SequenceReservations(reserve_batch) if lock and not dry_run else None
+    plan = PlanMetadata(cached_metadata) if cached_metadata is not None else None
+    name_cache = NameIndexCache(name_entries) if name_entries is not None else None
+    with capture_logs() as records:
+        results = list(_iter_rename(files, dry_run, reservations,
+                                    _worker_state['metadata_limiter'], _worker_state['max_concurrency'],
+                                    name_cache=name_cache,
+                                    metadata_timeout=_worker_state['metadata_timeout'],
+                                    quarantine=_worker_state['quarantine'],
+                                    sniff=_worker_state['sniff'], order=order, sort_buffer=sort_buffer,
+                                    renumber=renumber, read_order=read_order, plan=plan))
+        if reservations is not None:
+            reservations.release_all()
+    return (results, records, plan.remembered if plan is not None else None,
+            name_cache.entries() if name_cache is not None else None)
+
+def iter_rename_results(directory: str, dry_run: bool = False, recursive: bool = False, force: bool = False,
+                        min_concurrency: int = 1, max_concurrency: int = 1, metrics_file: str = None,
+                        walk_workers: int = 1, lock: bool = False, reserve_batch: int = DEFAULT_RESERVE_BATCH,
+                        processes: int = 1, name_cache: NameIndexCache = None,
+                        metadata_timeout: float = DEFAULT_METADATA_TIMEOUT, quarantine_file: str = None,
+                        cursor_file: str = None, sniff: bool = False, order: str = ORDER_NAME,
+                        sort_buffer: int = DEFAULT_SORT_BUFFER, renumber: bool = False,
+                        read_order: str = READ_ORDER_NAME, plan_file: str = None, run: Run = None):
+    """
+    指定されたディレクトリ内の画像ファイルのファイル名を、EXIF情報に基づいてリネームし、
+    ファイルごとの結果を FileResult として順次返すジェネレーター。ファイルごとのログは出力しない。
+    途中で close() すると、実行中のファイルを終えた時点で処理を打ち切る。
+    max_concurrency が1より大きい場合、EXIF読み取りの同時実行数を遅延とエラー率に応じて自動調整する。
+    walk_workers が1より大きい場合、再帰モードのディレクトリ走査を並列に行う。
+    lock が True の場合、ディレクトリごとのロックファイルで連番を reserve_batch 件ずつ予約し、
+    同じディレクトリを同時にリネームする他のプロセスと連番が衝突しないようにする。
+    processes が1より大きい場合、再帰モードではディレクトリ単位でプロセスプールに振り分ける。
+    連番はディレクトリごとに独立しているため、各ワーカーはロックなしで自分のディレクトリを処理できる。
+    EXIF読み取りが metadata_timeout 秒を超えたファイルはExifToolを強制終了してエラーとし、
+    quarantine_file を指定した場合はそのファイルを隔離リストに追加して、以降の実行ではスキップする。
+    cursor_file を指定すると、途中で打ち切られた位置を保存し、次回はその続きから処理する
+    (最後まで処理すると位置を消去する。dry_run では位置を読むだけで保存しない)。
+    sniff が True の場合は拡張子ではなくファイルの先頭バイトで形式を判定し、形式ごとに最も軽い方法で
+    EXIFを読む (JPEG/TIFF などはPillow、HEIF や動画はExifTool)。画像・動画でないファイルはスキップする。
+    order が ORDER_CAPTURE の場合、連番をファイル名順ではなく (ディレクトリ, 日付, デバイス) ごとに撮影日時順に振る。
+    ディレクトリ内のEXIFをすべて読んでから並べ替えるため、sort_buffer 件を超えるディレクトリは一時ファイルを
+    使う外部マージソートで並べる。結果はディレクトリ内では撮影日時順に返し、カーソルはディレクトリ単位で保存する。
+    renumber が True の場合はリネーム済みのファイルも対象にし (force と同じ)、ディレクトリごとに全ファイルの
+    最終的な名前を先に決めてから連番を 0001 から振り直す。既に最終的な名前のファイルは動かさず、
+    名前の入れ替えの循環は一時的な名前を経由して解消する。lock とは併用できない。
+    read_order に 'inode' / 'extent' を指定すると、EXIFを一定件数ずつ inode 番号順・先頭エクステントの
+    物理オフセット順に読み、次の区切りのファイルの先頭は先読みを依頼しておく (回転ディスク向け)。
+    連番と結果の順序は read_order に関係なく変わらない。
+    plan_file を指定すると、今回の計画 (ファイルごとの結果と計画に使ったEXIF) を保存し、前回の計画と比べた
+    差分の種類を結果の delta に設定する。(inode 番号, サイズ, 更新日時) が前回と同じファイルはEXIFを読み直さず、
+    前回のEXIFで計画し直す (連番は他のファイルの増減で変わりうるため、名前の決定は毎回行う)。dry_run でも保存する。
+    processes と併用した場合、計画ファイルは親プロセスだけが読み書きし、ワーカーとはEXIFをやり取りする。
+    name_cache も同様に、ワーカーには担当ディレクトリの一覧を渡し、更新された一覧を親プロセスで取り込む。
+    run を指定すると、対象件数が判明した時点で run.total に設定する。
+    ディレクトリが存在しない場合は NotADirectoryError を送出する。
+    """
+    if order not in ORDERS:
+        raise ValueError(f"不明な順序です: {order}（{', '.join(ORDERS)} のいずれかを指定してください）")
+    if read_order not in READ_ORDERS:
+        raise ValueError(f"不明な読み取り順です: {read_order}（{', '.join(READ_ORDERS)} のいずれかを指定してください）")
+    if renumber and lock:
+        raise ValueError("renumber は lock と併用できません（ディレクトリ全体の連番を振り直すため）。")
+    force = force or renumber
+    target_dir = Path(directory)
+    if not fs.is_dir(target_dir):
+        raise NotADirectoryError(f"指定されたパス '{directory}' はディレクトリではありません。")
+
+    logging.info(f"ディレクトリ '{target_dir.resolve()}' の処理を開始します...")
+    if force:
+        logging.warning("強制実行モード: リネーム済みのファイルも再処理します。")
+    if renumber:
+        logging.info("連番の振り直しモード: ディレクトリごとに連番を0001から振り直します。")
+
+    if recursive:
+        logging.info("再帰モード: サブディレクトリを検索します...")
+        files_to_process = (path for path, _ in parallel_walk(target_dir, walk_workers))
+    else:
+        files_to_process = (target_dir / name for name in fs.listdir(target_dir))
+
+    # 連番を安定させるため常にディレクトリごと・ファイル名順に並べる
+    files_list = sorted(files_to_process, key=_rename_order)
+    cursor = RunCursor(cursor_file, f"rename:{target_dir.resolve()}:{'recursive' if recursive else 'flat'}") if cursor_file else None
+    positions = cursor.load() if cursor else {}
+    resume_from = positions.get(str(target_dir))
+    if resume_from:
+        logging.info(f"前回の続きから処理します（'{resume_from}' の次のファイルから）。")
+        files_list = [path for path in files_list if _rename_order(path) > _rename_order(Path(resume_from))]
+
+    quarantine = Quarantine(quarantine_file) if quarantine_file else None
+    candidates, skipped = _select_candidates(files_list, force, quarantine, sniff)
+    if run is not None:
+        run.total = len(candidates) + len(skipped)
+
+    def candidate_results():
+        if recursive and processes > 1:
+            # ディレクトリごとにまとめ、結果はディレクトリ順に親プロセスで返す
+            groups = {}
+            for path in candidates:
+                groups.setdefault(path.parent, []).append(path)
+
+            def cached_metadata(files):
+                # 計画ファイルは親プロセスで引き、前回から変わっていないファイルのEXIFだけをワーカーに渡す
+                if plan is None:
+                    return None
+                cached = {}
+                for path in files:
+                    metadata = plan.lookup(path)
+                    if metadata is not None:
+                        cached[str(path)] = metadata
+                return cached
+
+            tasks = [(files, dry_run, lock, reserve_batch, order, sort_buffer, renumber, read_order,
+                      cached_metadata(files), name_cache.entries([parent_dir]) if name_cache is not None else None)
+                     for parent_dir, files in sorted(groups.items())]
+            chunksize = max(1, len(tasks) // (processes * 8))
+            logging.info(f"プロセス並列モード: {len(tasks)}ディレクトリを {processes} プロセスで処理します。")
+
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_rename_worker,
+                                           initargs=(min_concurrency, max_concurrency, metadata_timeout, quarantine_file, sniff))
+            try:
+                for results, records, remembered, names in executor.map(_rename_directory, tasks, chunksize=chunksize):
+                    for level, message in records:
+                        logging.log(level, message)
+                    if remembered:
+                        for path, metadata in remembered.items():
+                            plan.remember(path, metadata)
+                    if names:
+                        name_cache.update(names)
+                    yield from results
+            finally:
+                # 中断された場合は未着手のディレクトリを取り消す
+                executor.shutdown(wait=True, cancel_futures=True)
+            return
+
+        metadata_limiter = AIMDController('metadata', min_concurrency, max_concurrency)
+        reservations = SequenceReservations(reserve_batch) if lock and not dry_run else None
+        try:
+            yield from _iter_rename(candidates, dry_run, reservations, metadata_limiter, max_concurrency, name_cache,
+                                    metadata_timeout, quarantine, sniff, order, sort_buffer, renumber, read_order, plan)
+        finally:
+            if reservations is not None:
+                reservations.release_all()
+            if max_concurrency > 1:
+                logging.info(f"同時実行数: EXIF読み取り 最終 {metadata_limiter.limit} (最大 {metadata_limiter.peak})")
+            if metrics_file:
+                write_concurrency_metrics(metrics_file, [metadata_limiter])
+
+    plan = PlanStore(plan_file, f"rename:{target_dir.resolve()}:{'recursive' if recursive else 'flat'}") if plan_file else None
+    if plan is not None:
+        logging.info(f"前回の計画 ({len(plan)}件) と比べて差分を報告します: '{plan.path}'")
+    # スキップした結果も処理順に並べて返し、カーソルが「ここまでは処理済み」を表すようにする
+    processed = candidate_results()
+    last_path = None
+    finished = False
+    try:
+        if order == ORDER_CAPTURE or renumber:
+            # ディレクトリ内は撮影日時順に返す・ディレクトリ単位で振り直すため、ディレクトリごとにまとめて並べ、
+            # カーソルは最後まで処理したディレクトリのファイル名順で最後のファイルに進める
+            merged = heapq.merge(skipped, processed, key=lambda r: r.source.parent)
+            current_last = None
+            for result in merged:
+                if current_last is not None and result.source.parent != current_last.parent:
+                    last_path = current_last
+                    current_last = None
+                if current_last is None or _rename_order(result.source) > _rename_order(current_last):
+                    current_last = result.source
+                if plan is not None:
+                    result.delta = plan.record(result)
+                yield result
+        else:
+            for result in heapq.merge(skipped, processed, key=lambda r: _rename_order(r.source)):
+                last_path = result.source
+                if plan is not None:
+                    result.delta = plan.record(result)
+                yield result
+        finished = True
+    finally:
+        processed.close()
+        if plan is not None:
+            plan.save(finished)
+            plan.close()
+        if cursor is not None and not dry_run:
+            if finished:
+                cursor.clear()
+            elif last_path is not None:
+                positions[str(target_dir)] = str(last_path)
+                cursor.save(positions)
+                logging.info(f"カーソルを保存しました: '{last_path}'")
+
+def rename_run(directory: str, max_seconds: float = None, max_files: int = None, **kwargs) -> Run:
+    """
+    iter_rename_results を Run として返す。引数は iter_rename_results と同じ。
+    max_seconds / max_files を指定すると予算に達した時点で打ち切る。
+    cursor_file を指定しなかった場合は、対象ディレクトリの CURSOR_FILENAME に続きの位置を保存する。
+    """
+    if (max_seconds or max_files) and not kwargs.get('cursor_file'):
+        kwargs['cursor_file'] = str(Path(directory) / CURSOR_FILENAME)
+    return Run('rename', iter_rename_results, max_seconds=max_seconds, max_files=max_files,
+               directory=directory, **kwargs)
+
+def rename_image_files(directory: str, dry_run: bool = False, recursive: bool = False, force: bool = False, quiet: bool = False,
+                       min_concurrency: int = 1, max_concurrency: int = 1, metrics_file: str = None,
+                       walk_workers: int = 1, lock: bool = False, reserve_batch: int = DEFAULT_RESERVE_BATCH,
+                       processes: int = 1, progress=None, name_cache: NameIndexCache = None,
+                       metadata_timeout: float = DEFAULT_METADATA_TIMEOUT, quarantine_file: str = None,
+                       max_seconds: float = None, max_files: int = None, cursor_file: str = None,
+                       sniff: bool = False, order: str = ORDER_NAME, sort_buffer: int = DEFAULT_SORT_BUFFER,
+                       renumber: bool = False, read_order: str = READ_ORDER_NAME, plan_file: str = None):
+    """
+    指定されたディレクトリ内の画像ファイルのファイル名を、
+    EXIF情報に基づいてリネームする (CLI向け)。各引数は iter_rename_results を参照。
+    ファイルごとの結果をログに出力し、プログレスバーを表示する。
+    progress を指定すると、処理済み件数と総件数を引数に処理の進捗ごとに呼び出す。
+    処理結果の件数を {'success', 'skip', 'error'} の辞書で返す。
+    """
+    run = rename_run(
+        directory, dry_run=dry_run, recursive=recursive, force=force,
+        min_concurrency=min_concurrency, max_concurrency=max_concurrency, metrics_file=metrics_file,
+        walk_workers=walk_workers, lock=lock, reserve_batch=reserve_batch,
+        processes=processes, name_cache=name_cache,
+        metadata_timeout=metadata_timeout, quarantine_file=quarantine_file,
+        max_seconds=max_seconds, max_files=max_files, cursor_file=cursor_file, sniff=sniff,
+        order=order, sort_buffer=sort_buffer, renumber=renumber, read_order=read_order, plan_file=plan_file,
+    )
+    try:
+        summary = drain_run(run, "ファイル処理中", quiet=quiet, progress=progress)
+    except NotADirectoryError as e:
+        logging.error(str(e))
+        return
+    return summary.counts
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    from profiling import Profiler, PROFILERS, PROFILER_SAMPLING
 
-if __name__ == '__main__':
     default_dry_run = os.getenv('RENAME_DRY_RUN', 'false').lower() in ('true', '1', 't')
     default_recursive = os.getenv('RENAME_RECURSIVE', 'false').lower() in ('true', '1', 't')
     default_force = os.getenv('RENAME_FORCE', 'false').lower() in ('true', '1', 't')
     default_log_file = os.getenv('RENAME_LOG_FILE')
+    default_min_concurrency = int(os.getenv('RENAME_MIN_CONCURRENCY', '1'))
+    default_max_concurrency = int(os.getenv('RENAME_MAX_CONCURRENCY', '1'))
+    default_walk_workers = int(os.getenv('RENAME_WALK_WORKERS', '1'))
+    default_lock = os.getenv('RENAME_LOCK', 'false').lower() in ('true', '1', 't')
+    default_processes = int(os.getenv('RENAME_PROCESSES', '1'))
+    default_metadata_timeout = float(os.getenv('RENAME_METADATA_TIMEOUT', str(DEFAULT_METADATA_TIMEOUT)))
+    default_quarantine_file = os.getenv('RENAME_QUARANTINE_FILE')
+    default_max_seconds = float(os.getenv('RENAME_MAX_SECONDS')) if os.getenv('RENAME_MAX_SECONDS') else None
+    default_max_files = int(os.getenv('RENAME_MAX_FILES')) if os.getenv('RENAME_MAX_FILES') else None
+    default_cursor_file = os.getenv('RENAME_CURSOR_FILE')
+    default_sniff = os.getenv('RENAME_SNIFF', 'false').lower() in ('true', '1', 't')
+    default_order = os.getenv('RENAME_ORDER', ORDER_NAME)
+    default_sort_buffer = int(os.getenv('RENAME_SORT_BUFFER', str(DEFAULT_SORT_BUFFER)))
+    default_renumber = os.getenv('RENAME_RENUMBER', 'false').lower() in ('true', '1', 't')
+    default_read_order = os.getenv('RENAME_READ_ORDER', READ_ORDER_NAME)
+    default_plan_file = os.getenv('RENAME_PLAN_FILE')
+    default_profile = os.getenv('RENAME_PROFILE')
+    default_profiler = os.getenv('RENAME_PROFILER', PROFILER_SAMPLING)
 
-    parser = argparse.ArgumentParser(description='EXIF情報に基づいて画像ファイルをリネームします。\n環境変数でも設定が可能です: RENAME_DRY_RUN, RENAME_RECURSIVE, RENAME_FORCE, RENAME_LOG_FILE')
+    parser = argparse.ArgumentParser(prog=prog, description='EXIF情報に基づいて画像ファイルをリネームします。\n環境変数でも設定が可能です: RENAME_DRY_RUN, RENAME_RECURSIVE, RENAME_FORCE, RENAME_LOG_FILE')
     parser.add_argument('directory', help='画像ファイルが格納されているディレクトリのパス')
     parser.add_argument('--dry-run', action='store_true', default=default_dry_run, help=f'プレビューのみ表示します。デフォルト: {default_dry_run}')
     parser.add_argument('-r', '--recursive', action='store_true', default=default_recursive, help=f'サブディレクトリも処理します。デフォルト: {default_recursive}')
     parser.add_argument('--force', action='store_true', default=default_force, help=f'リネーム済みのファイルも再処理します。デフォルト: {default_force}')
     parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力します。デフォルト: {default_log_file}')
     parser.add_argument('-q', '--quiet', action='store_true', help='プログレスバーを表示しません。')
-    args = parser.parse_args()
+    parser.add_argument('--min-concurrency', type=int, default=default_min_concurrency, help=f'EXIF読み取りの最小同時実行数。デフォルト: {default_min_concurrency}')
+    parser.add_argument('--max-concurrency', type=int, default=default_max_concurrency, help=f'EXIF読み取りの最大同時実行数。1より大きい場合は遅延に応じて自動調整します。デフォルト: {default_max_concurrency}')
+    parser.add_argument('--concurrency-metrics', help='同時実行数の推移をCSV形式で出力するファイルのパス')
+    parser.add_argument('--walk-workers', type=int, default=default_walk_workers, help=f'再帰モードでディレクトリを並列に走査するスレッド数。デフォルト: {default_walk_workers}')
+    parser.add_argument('--lock', action='store_true', default=default_lock, help=f'ディレクトリごとのロックファイルで連番を予約し、複数プロセスの同時実行に対応します。デフォルト: {default_lock}')
+    parser.add_argument('--reserve-batch', type=int, default=DEFAULT_RESERVE_BATCH, help=f'--lock 指定時に一度に予約する連番の数。デフォルト: {DEFAULT_RESERVE_BATCH}')
+    parser.add_argument('--processes', type=int, default=default_processes, help=f'再帰モードでディレクトリ単位に並列処理するプロセス数。デフォルト: {default_processes}')
+    parser.add_argument('--metadata-timeout', type=float, default=default_metadata_timeout, help=f'1ファイルのEXIF読み取りの制限時間(秒)。超えた場合はExifToolを強制終了してエラーにします。デフォルト: {default_metadata_timeout}')
+    parser.add_argument('--quarantine-file', default=default_quarantine_file, help=f'制限時間を超えたファイルを記録し、次回以降スキップする隔離リストのパス。デフォルト: {default_quarantine_file}')
+    parser.add_argument('--max-seconds', type=float, default=default_max_seconds, help=f'この秒数を超えたら処理中のファイルを終えた時点で打ち切り、続きの位置を保存します。デフォルト: {default_max_seconds}')
+    parser.add_argument('--max-files', type=int, default=default_max_files, help=f'この件数を処理したら打ち切り、続きの位置を保存します。デフォルト: {default_max_files}')
+    parser.add_argument('--cursor-file', default=default_cursor_file, help=f'続きの位置を保存するファイルのパス。指定しない場合、--max-seconds / --max-files 指定時は対象ディレクトリの {CURSOR_FILENAME} を使います。デフォルト: {default_cursor_file}')
+    parser.add_argument('--sniff', action='store_true', default=default_sniff, help=f'拡張子ではなくファイルの先頭バイトで形式を判定し、形式ごとに最も軽い方法でEXIFを読みます。デフォルト: {default_sniff}')
+    parser.add_argument('--order', choices=ORDERS, default=default_order, help=f'連番を振る順序（name: ファイル名順, capture: ディレクトリ・日付・デバイスごとに撮影日時順）。デフォルト: {default_order}')
+    parser.add_argument('--sort-buffer', type=int, default=default_sort_buffer, help=f'--order capture でメモリ上で並べ替える最大件数。超えた分は一時ファイルを使って並べ替えます。デフォルト: {default_sort_buffer}')
+    parser.add_argument('--renumber', action='store_true', default=default_renumber, help=f'リネーム済みのファイルも含め、ディレクトリごとに連番を0001から振り直します（--force を含みます）。既に正しい名前のファイルは動かしません。デフォルト: {default_renumber}')
+    parser.add_argument('--read-order', choices=READ_ORDERS, default=default_read_order, help=f'EXIFを読む順序（name: ファイル名順, inode: inode 番号順, extent: ディスク上の物理位置順）。回転ディスクではシークを減らせます。連番の順序は変わりません。デフォルト: {default_read_order}')
+    parser.add_argument('--plan-file', default=default_plan_file, help=f'今回の計画を保存し、前回の計画との差分（新規・変更・処理内容の変更）だけを出力する計画ファイルのパス（例: 対象ディレクトリの {PLAN_FILENAME}）。変わっていないファイルはEXIFを読み直しません。デフォルト: {default_plan_file}')
+    parser.add_argument('--profile', metavar='PREFIX', default=default_profile, help=f'処理全体をプロファイルし、PREFIX.pstats と flamegraph 用の PREFIX.collapsed を出力します。デフォルト: {default_profile}')
+    parser.add_argument('--profiler', choices=PROFILERS, default=default_profiler, help=f'プロファイラー（sampling: 低オーバーヘッドのサンプリング, cprofile: 全呼び出しを計測）。デフォルト: {default_profiler}')
+    args = parser.parse_args(argv)
+    if args.min_concurrency < 1 or args.max_concurrency < args.min_concurrency:
+        parser.error('--min-concurrency は1以上、--max-concurrency は --min-concurrency 以上を指定してください。')
+    if args.metadata_timeout <= 0:
+        parser.error('--metadata-timeout は0より大きい値を指定してください。')
+    if (args.max_seconds is not None and args.max_seconds <= 0) or (args.max_files is not None and args.max_files <= 0):
+        parser.error('--max-seconds / --max-files は0より大きい値を指定してください。')
+    if args.sort_buffer < 1:
+        parser.error('--sort-buffer は1以上を指定してください。')
+    if args.renumber and args.lock:
+        parser.error('--renumber は --lock と併用できません。')
 
     setup_logging(args.log_file)
-    rename_image_files(
-        directory=args.directory,
-        dry_run=args.dry_run,
-        recursive=args.recursive,
-        force=args.force,
-        quiet=args.quiet,
-    )
+    with Profiler(args.profile, args.profiler) if args.profile else contextlib.nullcontext():
+        rename_image_files(
+            directory=args.directory,
+            dry_run=args.dry_run,
+            recursive=args.recursive,
+            force=args.force,
+            quiet=args.quiet,
+            min_concurrency=args.min_concurrency,
+            max_concurrency=args.max_concurrency,
+            metrics_file=args.concurrency_metrics,
+            walk_workers=args.walk_workers,
+            lock=args.lock,
+            reserve_batch=args.reserve_batch,
+            processes=args.processes,
+            metadata_timeout=args.metadata_timeout,
+            quarantine_file=args.quarantine_file,
+            max_seconds=args.max_seconds,
+            max_files=args.max_files,
+            cursor_file=args.cursor_file,
+            sniff=args.sniff,
+            order=args.order,
+            sort_buffer=args.sort_buffer,
+            renumber=args.renumber,
+            read_order=args.read_order,
+            plan_file=args.plan_file,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+# ファイルごとの処理内容
+ACTION_RENAME = 'rename'
+ACTION_MOVE = 'move'
+ACTION_EXTRACT = 'extract'  # アーカイブのメンバーを宛先に書き出した
+ACTION_SKIP = 'skip'
+ACTION_ERROR = 'error'
+
+# スキップ・エラーの理由
+REASON_UNSUPPORTED = 'unsupported'  # サポート対象外のファイル形式
+REASON_ALREADY_RENAMED = 'already_renamed'  # リネーム済みの形式
+REASON_ALREADY_NAMED = 'already_named'  # 既に正しい名前
+REASON_NO_DATETIME = 'no_datetime'  # 撮影日時のEXIF情報が無い
+REASON_DUPLICATE = 'duplicate'  # 宛先に取り込み済み
+REASON_INVALID_DATETIME = 'invalid_datetime'  # 日時フォーマットが不正
+REASON_PERMISSION = 'permission'  # 権限エラー
+REASON_OS_ERROR = 'os_error'  # ファイルシステムエラー
+REASON_UNEXPECTED = 'unexpected'  # 予期せぬエラー
+REASON_TIMEOUT = 'timeout'  # メタデータの読み取りが制限時間を超えた
+REASON_QUARANTINED = 'quarantined'  # 隔離リストに登録済み
+REASON_VERIFY_FAILED = 'verify_failed'  # コピー先の内容がコピー元と一致しない
+
+# 前回の計画 (plan.PlanStore) と比べた差分の種類
+DELTA_NEW = 'new'  # 前回の計画に無いファイル
+DELTA_CHANGED = 'changed'  # (inode 番号, サイズ, 更新日時) が前回と異なるファイル
+DELTA_RETARGETED = 'retargeted'  # ファイルは同じだが、処理内容 (移動先など) が前回の計画と異なる
+DELTA_UNCHANGED = 'unchanged'  # 前回の計画と同じ
+DELTAS = (DELTA_NEW, DELTA_CHANGED, DELTA_RETARGETED, DELTA_UNCHANGED)
+
+# 遅延を集計するパーセンタイル
+LATENCY_PERCENTILES = (50, 99)
+
+
+def percentile(sorted_values, p: float) -> float:
+    """昇順に並んだ値の p パーセンタイル (最近傍順位法) を返す"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class FileResult:
+    """1ファイルの処理結果"""
+    source: Path
+    action: str
+    target: Optional[Path] = None
+    reason: Optional[str] = None
+    message: str = ''
+    level: int = logging.INFO
+    dry_run: bool = False
+    timings: dict = field(default_factory=dict)
+    source_root: Optional[Path] = None  # 複数ソース処理時の、ファイルが属するソースディレクトリ
+    checksum: Optional[str] = None  # コピーして検証した場合の内容のハッシュ
+    delta: Optional[str] = None  # 計画ファイルを指定した場合の、前回の計画との差分 (DELTA_*)
+
+    @property
+    def status(self) -> str:
+        """結果サマリー上の分類 ('success' / 'skip' / 'error')"""
+        if self.action == ACTION_SKIP:
+            return 'skip'
+        if self.action == ACTION_ERROR:
+            return 'error'
+        return 'success'
+
+    def to_dict(self) -> dict:
+        return {
+            'source': str(self.source),
+            'target': str(self.target) if self.target is not None else None,
+            'action': self.action,
+            'status': self.status,
+            'reason': self.reason,
+            'message': self.message,
+            'dry_run': self.dry_run,
+            'timings': self.timings,
+            'source_root': str(self.source_root) if self.source_root is not None else None,
+            'checksum': self.checksum,
+            'delta': self.delta,
+        }
+
+
+@dataclass
+class RunSummary:
+    """1回の実行の結果サマリー"""
+    command: str
+    success: int = 0
+    skip: int = 0
+    error: int = 0
+    reasons: Counter = field(default_factory=Counter)
+    # 拡張子ごとのメタデータ読み取り時間 (秒)
+    metadata_latencies: dict = field(default_factory=dict)
+    # ソースディレクトリごとの件数 (複数ソース処理時)
+    per_source: dict = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancelled: bool = False
+    budget_exhausted: bool = False  # 時間・件数の予算に達して打ち切った
+    verified: int = 0  # コピーして内容を検証したファイル数
+    deltas: Counter = field(default_factory=Counter)  # 前回の計画との差分の種類ごとの件数
+
+    def add(self, result: FileResult):
+        setattr(self, result.status, getattr(self, result.status) + 1)
+        if result.reason:
+            self.reasons[result.reason] += 1
+        if result.source_root is not None:
+            counts = self.per_source.setdefault(str(result.source_root), {'success': 0, 'skip': 0, 'error': 0})
+            counts[result.status] += 1
+        elapsed = result.timings.get('metadata')
+        if elapsed is not None:
+            self.metadata_latencies.setdefault(result.source.suffix.lower(), []).append(elapsed)
+        if result.checksum is not None:
+            self.verified += 1
+        if result.delta is not None:
+            self.deltas[result.delta] += 1
+
+    def latency_report(self) -> dict:
+        """拡張子ごとのメタデータ読み取り時間の件数・p50・p99・最大 (秒) を返す"""
+        report = {}
+        for suffix, values in sorted(self.metadata_latencies.items()):
+            ordered = sorted(values)
+            stats = {'count': len(ordered)}
+            for p in LATENCY_PERCENTILES:
+                stats[f'p{p}'] = round(percentile(ordered, p), 4)
+            stats['max'] = round(ordered[-1], 4)
+            report[suffix] = stats
+        return report
+
+    @property
+    def counts(self) -> dict:
+        return {'success': self.success, 'skip': self.skip, 'error': self.error}
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.skip + self.error
+
+    def to_dict(self) -> dict:
+        finished_at = self.finished_at or time.time()
+        return {
+            'command': self.command,
+            'counts': self.counts,
+            'reasons': dict(self.reasons),
+            'metadata_latency': self.latency_report(),
+            'sources': self.per_source,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round(finished_at - self.started_at, 3),
+            'cancelled': self.cancelled,
+            'budget_exhausted': self.budget_exhausted,
+            'verified': self.verified,
+            'deltas': dict(self.deltas),
+        }
+
+
+class Run:
+    """
+    ファイルごとの結果 (FileResult) を順次返す実行単位。
+    反復しながら結果を受け取り、cancel() で次のファイルの境界で中断できる。
+    max_seconds (秒) / max_files (件) を指定すると、予算に達した時点のファイルの境界で打ち切る。
+    winds_down が True の場合、generator_func は should_stop() を確認して自分で打ち切り、並列に実行中だった
+    ファイルの結果も返してから終える (処理済みのファイルを報告せずに終えないため)。
+    集計は summary に、判明していれば対象件数は total に入る。
+    """
+
+    def __init__(self, command: str, generator_func, max_seconds: float = None, max_files: int = None,
+                 winds_down: bool = False, **kwargs):
+        self.summary = RunSummary(command)
+        self.total = None
+        self.max_seconds = max_seconds
+        self.max_files = max_files
+        self.winds_down = winds_down
+        self._cancel_event = threading.Event()
+        self._generator_func = generator_func
+        self._kwargs = kwargs
+        self._deadline = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """処理を中断する。別スレッドからも呼び出せる"""
+        self._cancel_event.set()
+
+    def _budget_exhausted(self) -> bool:
+        if self.max_files is not None and self.summary.processed >= self.max_files:
+            return True
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def should_stop(self) -> bool:
+        """中断または予算到達により、処理を打ち切るべきかどうか"""
+        if self._budget_exhausted():
+            self.summary.budget_exhausted = True
+        return self.cancelled or self.summary.budget_exhausted
+
+    def __iter__(self):
+        if self.max_seconds is not None:
+            self._deadline = time.monotonic() + self.max_seconds
+        generator = self._generator_func(run=self, **self._kwargs)
+        try:
+            for result in generator:
+                self.summary.add(result)
+                yield result
+                if not self.winds_down and self.should_stop():
+                    break
+        finally:
+            generator.close()
+            self.summary.cancelled = self.cancelled
+            self.summary.finished_at = time.time()
+
+    def run_to_completion(self) -> RunSummary:
+        for _ in self:
+            pass
+        return self.summary
+
+
+def drain_run(run: Run, desc: str, unit: str = 'file', quiet: bool = False, progress=None) -> RunSummary:
+    """
+    CLI向けに Run を最後まで実行する。結果ごとにログを出力し、プログレスバーと
+    progress コールバック (処理済み件数, 総件数) を更新して、最後に結果サマリーを表示する。
+    計画ファイルを指定した実行では、前回の計画と同じ結果はログに出さず (DEBUG)、差分だけを出力する。
+    """
+    bar = None
+    if not quiet:
+        # tqdm は読み込みに時間がかかるため、プログレスバーを表示するときだけ読み込む
+        from tqdm import tqdm
+        bar = tqdm(desc=desc, unit=unit)
+    try:
+        for result in run:
+            logging.log(logging.DEBUG if result.delta == DELTA_UNCHANGED else result.level, result.message)
+            if bar is not None:
+                if bar.total is None and run.total is not None:
+                    bar.total = run.total
+                    bar.refresh()
+                bar.update(1)
+            if progress:
+                progress(run.summary.processed, run.total)
+    finally:
+        if bar is not None:
+            bar.close()
+
+    summary = run.summary
+    if summary.cancelled:
+        logging.warning("処理が中断されました。")
+    if summary.budget_exhausted:
+        logging.info(f"予算に達したため {summary.processed}件で処理を打ち切りました。次回は続きから処理します。")
+    logging.info("処理が完了しました。")
+    logging.info(f"結果サマリー: 成功 {summary.success}件, スキップ {summary.skip}件, エラー {summary.error}件")
+    if len(summary.per_source) > 1:
+        for source, counts in summary.per_source.items():
+            logging.info(f"  [{source}] 成功 {counts['success']}件, スキップ {counts['skip']}件, エラー {counts['error']}件")
+    for suffix, stats in summary.latency_report().items():
+        logging.info(
+            f"メタデータ読み取り時間 [{suffix}]: {stats['count']}件, "
+            f"p50 {stats['p50']:.3f}秒, p99 {stats['p99']:.3f}秒, 最大 {stats['max']:.3f}秒"
+        )
+    if summary.reasons.get(REASON_TIMEOUT):
+        logging.warning(f"制限時間を超えたファイル: {summary.reasons[REASON_TIMEOUT]}件（隔離リストを確認してください）")
+    if summary.deltas:
+        logging.info(
+            f"前回の計画との差分: 新規 {summary.deltas[DELTA_NEW]}件, 変更 {summary.deltas[DELTA_CHANGED]}件, "
+            f"処理内容の変更 {summary.deltas[DELTA_RETARGETED]}件, 変更なし {summary.deltas[DELTA_UNCHANGED]}件"
+        )
+    if summary.verified:
+        logging.info(f"コピーして内容を検証したファイル: {summary.verified}件")
+    if summary.reasons.get(REASON_VERIFY_FAILED):
+        logging.error(f"検証に失敗したファイル: {summary.reasons[REASON_VERIFY_FAILED]}件（移動元は削除していません）")
+    return summary
@@ -0,0 +1,162 @@
+import ctypes
+import errno
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows では fcntl が使えないため、ロックなしで動作する
+    fcntl = None
+
+# 定数定義
+LOCK_FILENAME = '.image_renamer.lock'  # 連番予約を記録するディレクトリごとのロックファイル
+DEFAULT_RESERVE_BATCH = 16  # 一度に予約する連番の数
+RESERVATION_TTL_SECONDS = 600  # 予約の有効期限（プロセスが異常終了した場合に解放される）
+RENAME_NOREPLACE = 1
+AT_FDCWD = -100
+
+
+def _load_renameat2():
+    """glibc の renameat2 を取得する。使えない環境では None を返す"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError, TypeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+    return renameat2
+
+_renameat2 = _load_renameat2()
+
+
+def rename_noreplace(src, dst, src_dir_fd: int = None, dst_dir_fd: int = None) -> bool:
+    """
+    移動先が存在しない場合に限り、src を dst にアトミックにリネームする。
+    移動先が既に存在する場合は何もせず False を返す。
+    src_dir_fd / dst_dir_fd を指定すると、src / dst はそのディレクトリからの相対パスになる (renameat2 と同じ)。
+    renameat2(RENAME_NOREPLACE) が使えなければ link + unlink で代用する。
+    """
+    src_bytes = os.fsencode(src)
+    dst_bytes = os.fsencode(dst)
+    if _renameat2 is not None:
+        src_fd = AT_FDCWD if src_dir_fd is None else src_dir_fd
+        dst_fd = AT_FDCWD if dst_dir_fd is None else dst_dir_fd
+        if _renameat2(src_fd, src_bytes, dst_fd, dst_bytes, RENAME_NOREPLACE) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err == errno.EEXIST:
+            return False
+        if err not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise OSError(err, os.strerror(err), str(src), None, str(dst))
+
+    try:
+        os.link(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS, errno.EXDEV):
+            raise
+        # ハードリンクを作れないファイルシステムでは、存在確認してからリネームする
+        try:
+            os.stat(dst, dir_fd=dst_dir_fd, follow_symlinks=False)
+            return False
+        except FileNotFoundError:
+            pass
+        os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+        return True
+    os.unlink(src, dir_fd=src_dir_fd)
+    return True
+
+
+@contextmanager
+def _locked_state(directory: Path):
+    """ディレクトリのロックファイルを排他ロックし、予約状態を読み書きする"""
+    lock_path = Path(directory) / LOCK_FILENAME
+    with open(lock_path, 'a+', encoding='utf-8') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            try:
+                state = json.loads(content) if content.strip() else {}
+            except json.JSONDecodeError:
+                logging.warning(f"ロックファイル '{lock_path}' が壊れているため初期化します。")
+                state = {}
+            state.setdefault('reservations', [])
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SequenceReservations:
+    """
+    複数プロセスが同じディレクトリを同時にリネームしても連番が衝突しないよう、
+    ディレクトリごとのロックファイルで連番の範囲をまとめて予約する。
+    ロックを取るのは範囲を使い切ったときだけなので、ファイルごとに直列化されることはない。
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_RESERVE_BATCH, owner: str = None):
+        self.batch_size = batch_size
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._ranges = {}  # (ディレクトリ, キー) -> [次の連番, 範囲の終端]
+
+    def next_counter(self, directory: Path, key: str) -> int:
+        """予約済みの範囲から次の連番を取り出す。使い切っていれば次の範囲を予約する"""
+        current = self._ranges.get((directory, key))
+        if current is None or current[0] >= current[1]:
+            hint = current[1] if current else 1
+            current = self._reserve(directory, key, hint)
+            self._ranges[(directory, key)] = current
+        counter = current[0]
+        current[0] += 1
+        return counter
+
+    def _reserve(self, directory: Path, key: str, hint: int):
+        now = time.time()
+        with _locked_state(directory) as state:
+            # 期限切れの予約と、このプロセスが使い切った同じキーの予約を取り除く
+            reservations = [
+                r for r in state['reservations']
+                if r['expires'] > now and not (r['owner'] == self.owner and r['key'] == key)
+            ]
+            others = sorted(
+                (r for r in reservations if r['key'] == key and r['owner'] != self.owner),
+                key=lambda r: r['start']
+            )
+            start = hint
+            for r in others:
+                if r['start'] < start + self.batch_size and start < r['end']:
+                    start = r['end']
+            end = start + self.batch_size
+            for r in reservations:
+                if r['owner'] == self.owner:
+                    r['expires'] = now + RESERVATION_TTL_SECONDS
+            reservations.append({
+                'key': key, 'start': start, 'end': end,
+                'owner': self.owner, 'expires': now + RESERVATION_TTL_SECONDS,
+            })
+            state['reservations'] = reservations
+        return [start, end]
+
+    def release_all(self):
+        """このプロセスの予約をすべて解放する"""
+        for directory in {directory for directory, _ in self._ranges}:
+            try:
+                with _locked_state(directory) as state:
+                    state['reservations'] = [r for r in state['reservations'] if r['owner'] != self.owner]
+            except OSError as e:
+                logging.warning(f"連番の予約を解放できませんでした ({directory}): {e}")
+        self._ranges.clear()
@@ -0,0 +1,340 @@
+import argparse
+import inspect
+import json
+import logging
+import os
+import signal
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from utils import setup_logging, set_exiftool_pool
+from exiftool_session import ExifToolPool
+from rename_images import iter_rename_results, rename_run, NameIndexCache
+from organize_files import iter_organize_results, organize_run
+from dest_index import DestinationIndex
+
+# 定数定義
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_JOBS = 2  # 同時に実行するジョブ数
+DEFAULT_EXIFTOOL_SESSIONS = 2  # 常駐させるExifToolセッション数
+# ジョブのパラメータとして受け付けない引数（サーバー側で決める）
+RESERVED_PARAMETERS = {'run', 'name_cache', 'dest_index', 'metrics_file'}
+
+
+class Job:
+    """サーバーで実行する1件のジョブ"""
+
+    def __init__(self, command: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.params = params
+        self.status = 'queued'
+        self.run = None
+        self.cancel_requested = False
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def cancel(self):
+        """ジョブを中断する。実行前なら実行せず、実行中なら処理中のファイルを終えた時点で止める"""
+        self.cancel_requested = True
+        if self.run is not None:
+            self.run.cancel()
+
+    def to_dict(self) -> dict:
+        processed = self.run.summary.processed if self.run else 0
+        total = self.run.total if self.run else None
+        return {
+            'id': self.id,
+            'command': self.command,
+            'params': self.params,
+            'status': self.status,
+            'progress': {'processed': processed, 'total': total},
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    ジョブを受け付けて並行実行する。ExifToolセッション、ファイル名一覧のキャッシュ、
+    宛先インデックスはジョブをまたいで保持し、起動コストを毎回払わないようにする。
+    """
+
+    # コマンドごとの (実行する関数, その関数が残りの引数を渡す関数)
+    COMMANDS = {
+        'rename': (rename_run, iter_rename_results),
+        'organize': (organize_run, iter_organize_results),
+    }
+
+    def __init__(self, max_jobs: int = DEFAULT_MAX_JOBS):
+        self.jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._name_cache = NameIndexCache()
+        self._dest_indexes = {}
+        # 同じ宛先への organize は移動先の決定が衝突しないよう1件ずつ実行する
+        self._dest_locks = {}
+        self.accepting = True
+
+    def validate(self, command: str, params: dict):
+        funcs = self.COMMANDS.get(command)
+        if funcs is None:
+            raise ValueError(f"不明なコマンドです: {command}（rename, organize のいずれかを指定してください）")
+        run_func, iter_func = funcs
+        signature = inspect.signature(iter_func)
+        # *_run だけが受け取る引数 (max_seconds / max_files などの予算)。残りは iter_*_results に渡される
+        run_only = {
+            name for name, parameter in inspect.signature(run_func).parameters.items()
+            if parameter.kind != inspect.Parameter.VAR_KEYWORD and name not in signature.parameters
+        }
+        unknown = set(params) - ((set(signature.parameters) | run_only) - RESERVED_PARAMETERS)
+        if unknown:
+            raise ValueError(f"不明なパラメータです: {', '.join(sorted(unknown))}")
+        try:
+            signature.bind(**{name: value for name, value in params.items() if name not in run_only})
+        except TypeError as e:
+            raise ValueError(f"パラメータが不正です: {e}")
+
+    def submit(self, command: str, params: dict) -> Job:
+        if not self.accepting:
+            raise RuntimeError("シャットダウン中のため新しいジョブを受け付けません。")
+        self.validate(command, params)
+        job = Job(command, params)
+        with self._lock:
+            self.jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logging.info(f"ジョブを受け付けました: {job.id} ({command})")
+        return job
+
+    def _shared_dest_index(self, destination: str):
+        key = Path(destination).resolve()
+        with self._lock:
+            if key not in self._dest_indexes:
+                self._dest_indexes[key] = DestinationIndex(key)
+            return self._dest_indexes[key]
+
+    def _dest_lock(self, destination: str):
+        key = Path(destination).resolve()
+        with self._lock:
+            return self._dest_locks.setdefault(key, threading.Lock())
+
+    def _run(self, job: Job):
+        if job.cancel_requested:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            logging.info(f"ジョブが実行前に中断されました: {job.id}")
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            params = dict(job.params)
+            if job.command == 'rename':
+                job.run = rename_run(**params, name_cache=self._name_cache)
+                self._drain(job)
+            else:
+                destination = params.get('dest_dir')
+                if params.get('use_dest_index') and not params.get('dry_run'):
+                    params['dest_index'] = self._shared_dest_index(destination)
+                job.run = organize_run(**params)
+                with self._dest_lock(destination):
+                    self._drain(job)
+            job.result = job.run.summary.to_dict()
+            job.status = 'cancelled' if job.run.cancelled else 'succeeded'
+        except NotADirectoryError as e:
+            logging.error(f"ジョブ {job.id}: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        except Exception as e:
+            logging.error(f"ジョブ {job.id} の実行中に予期せぬエラーが発生しました: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            logging.info(f"ジョブが終了しました: {job.id} ({job.status})")
+
+    def _drain(self, job: Job):
+        # cancel が run の作成前に呼ばれていた場合に備えて反映する
+        if job.cancel_requested:
+            job.run.cancel()
+        for result in job.run:
+            logging.log(result.level, result.message)
+
+    def shutdown(self):
+        """新規受付を止め、実行中のジョブの完了を待ってから資源を解放する"""
+        self.accepting = False
+        self._executor.shutdown(wait=True)
+        for index in self._dest_indexes.values():
+            index.close()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    ジョブAPI:
+      POST /jobs              {"command": "rename"|"organize", "params": {...}} を受け付ける
+      GET  /jobs              ジョブの一覧
+      GET  /jobs/<id>         ジョブの状態と進捗
+      GET  /jobs/<id>/result  完了したジョブの結果サマリー
+      POST /jobs/<id>/cancel  ジョブを中断する
+      POST /shutdown          実行中のジョブを待ってから停止する
+    """
+
+    server_version = 'ImageRenamer'
+
+    def address_string(self):
+        # Unixソケットの場合は client_address が空になる
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        manager = self.server.manager
+        parts = [p for p in self.path.split('/') if p]
+        if parts == ['jobs']:
+            self._send_json(200, [job.to_dict() for job in manager.jobs.values()])
+            return
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = manager.jobs.get(parts[1])
+            if job is None:
+                self._send_json(404, {'error': 'ジョブが見つかりません。'})
+            elif len(parts) == 2:
+                self._send_json(200, job.to_dict())
+            elif parts[2] == 'result':
+                if job.finished_at is None:
+                    self._send_json(409, {'error': 'ジョブはまだ完了していません。', 'status': job.status})
+                else:
+                    self._send_json(200, {'id': job.id, 'status': job.status, 'result': job.result, 'error': job.error})
+            else:
+                self._send_json(404, {'error': '不明なパスです。'})
+            return
+        self._send_json(404, {'error': '不明なパスです。'})
+
+    def do_POST(self):
+        manager = self.server.manager
+        parts = [p for p in self.path.split('/') if p]
+        if self.path == '/jobs':
+            try:
+                payload = self._read_json()
+                job = manager.submit(payload.get('command'), payload.get('params', {}))
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            except RuntimeError as e:
+                self._send_json(503, {'error': str(e)})
+                return
+            self._send_json(202, job.to_dict())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            job = manager.jobs.get(parts[1])
+            if job is None:
+                self._send_json(404, {'error': 'ジョブが見つかりません。'})
+                return
+            job.cancel()
+            logging.info(f"ジョブの中断を受け付けました: {job.id}")
+            self._send_json(202, job.to_dict())
+        elif self.path == '/shutdown':
+            self._send_json(202, {'status': 'shutting down'})
+            self.server.request_shutdown()
+        else:
+            self._send_json(404, {'error': '不明なパスです。'})
+
+
+class _ShutdownMixin:
+    def request_shutdown(self):
+        # serve_forever を実行しているスレッド以外から止める必要がある
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+class JobHTTPServer(_ShutdownMixin, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class JobUnixHTTPServer(_ShutdownMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(manager: JobManager, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str = None):
+    """ローカルHTTP、または socket_path 指定時はUnixソケットで待ち受けるサーバーを作成する"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = JobUnixHTTPServer(socket_path, JobRequestHandler)
+    else:
+        server = JobHTTPServer((host, port), JobRequestHandler)
+    server.manager = manager
+    return server
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str = None,
+          max_jobs: int = DEFAULT_MAX_JOBS, exiftool_sessions: int = DEFAULT_EXIFTOOL_SESSIONS):
+    """ジョブサーバーを起動し、停止要求 (SIGTERM/SIGINT または POST /shutdown) まで待ち受ける"""
+    pool = ExifToolPool(exiftool_sessions)
+    set_exiftool_pool(pool)
+    manager = JobManager(max_jobs)
+    server = create_server(manager, host, port, socket_path)
+
+    def handle_signal(signum, frame):
+        logging.info("停止シグナルを受信しました。実行中のジョブの完了を待って終了します。")
+        server.request_shutdown()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    address = socket_path if socket_path else f"http://{host}:{port}"
+    logging.info(f"ジョブサーバーを起動しました: {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        manager.shutdown()
+        set_exiftool_pool(None)
+        pool.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logging.info(f"ジョブサーバーを停止しました。(メタデータキャッシュ: ヒット {pool.hits}件, ミス {pool.misses}件)")
+
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    default_host = os.getenv('SERVE_HOST', DEFAULT_HOST)
+    default_port = int(os.getenv('SERVE_PORT', str(DEFAULT_PORT)))
+    default_socket = os.getenv('SERVE_SOCKET')
+    default_log_file = os.getenv('SERVE_LOG_FILE')
+
+    parser = argparse.ArgumentParser(prog=prog, description='rename/organize のジョブをJSONで受け付ける常駐サーバーを起動します。')
+    parser.add_argument('--host', default=default_host, help=f'待ち受けるホスト。デフォルト: {default_host}')
+    parser.add_argument('--port', type=int, default=default_port, help=f'待ち受けるポート。デフォルト: {default_port}')
+    parser.add_argument('--socket', default=default_socket, help='指定した場合、HTTPの代わりにこのUnixソケットで待ち受けます。')
+    parser.add_argument('--max-jobs', type=int, default=DEFAULT_MAX_JOBS, help=f'同時に実行するジョブ数。デフォルト: {DEFAULT_MAX_JOBS}')
+    parser.add_argument('--exiftool-sessions', type=int, default=DEFAULT_EXIFTOOL_SESSIONS, help=f'常駐させるExifToolセッション数。デフォルト: {DEFAULT_EXIFTOOL_SESSIONS}')
+    parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力します。デフォルト: {default_log_file}')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file)
+    serve(args.host, args.port, args.socket, args.max_jobs, args.exiftool_sessions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import io
+import logging
+
+import fs
+from utils import (
+    get_exif_data_with_exiftool,
+    get_exif_data_from_bytes,
+    DEFAULT_METADATA_TIMEOUT,
+    EXIFTOOL_DATETIME_ORIGINAL_TAG,
+    EXIFTOOL_MODEL_TAG,
+    EXIFTOOL_SOFTWARE_TAG,
+)
+
+# 定数定義
+SNIFF_BYTES = 64  # 形式の判定に読む先頭のバイト数
+
+# メタデータの読み取り方法。軽いものから順に、読まない / Pillow (プロセス内) / ExifTool (外部プロセス)
+READER_NONE = 'none'
+READER_PILLOW = 'pillow'
+READER_EXIFTOOL = 'exiftool'
+
+# 形式ごとの読み取り方法。撮影日時を持たない形式はExifToolを起動しない
+FORMAT_READERS = {
+    'jpeg': READER_PILLOW,
+    'png': READER_PILLOW,
+    'webp': READER_PILLOW,
+    'tiff': READER_PILLOW,  # DNG / NEF / ARW などTIFFベースのRAWを含む
+    'gif': READER_EXIFTOOL,  # 撮影日時は XMP にのみ持つため、ExifToolで読む
+    'bmp': READER_NONE,
+    'cr2': READER_EXIFTOOL,
+    'cr3': READER_EXIFTOOL,
+    'orf': READER_EXIFTOOL,
+    'rw2': READER_EXIFTOOL,
+    'raf': READER_EXIFTOOL,
+    'heif': READER_EXIFTOOL,
+    'avif': READER_EXIFTOOL,
+    'mp4': READER_EXIFTOOL,
+    'mov': READER_EXIFTOOL,
+    '3gp': READER_EXIFTOOL,
+    'avi': READER_EXIFTOOL,
+    'mkv': READER_EXIFTOOL,
+    'webm': READER_EXIFTOOL,
+    'wmv': READER_EXIFTOOL,
+    'flv': READER_EXIFTOOL,
+}
+
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+ASF_HEADER_GUID = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+BMP_HEADER_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+# Pillow で読むEXIFタグの番号
+EXIF_IFD_POINTER = 0x8769
+PILLOW_TAGS = {
+    EXIFTOOL_DATETIME_ORIGINAL_TAG: 0x9003,
+    EXIFTOOL_MODEL_TAG: 0x0110,
+    EXIFTOOL_SOFTWARE_TAG: 0x0131,
+}
+
+
+# Pillow は初めてEXIFを読むときに読み込む (起動時間を短くするため)。False は Pillow が無い環境
+_pillow_image = None
+
+
+def _load_pillow():
+    """PIL.Image を返す。Pillow が無い環境では None (全形式をExifToolで読む)"""
+    global _pillow_image
+    if _pillow_image is None:
+        try:
+            from PIL import Image
+            _pillow_image = Image
+        except ImportError:
+            _pillow_image = False
+    return _pillow_image or None
+
+
+class UnsupportedMediaError(Exception):
+    """ファイルの内容が対応している画像・動画の形式ではない"""
+
+
+def identify_format(head: bytes):
+    """ファイルの先頭バイトから実際の形式名を返す。画像・動画と判定できなければ None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'cr2' if head[8:10] == b'CR' else 'tiff'
+    if head[:4] in (b'IIRO', b'IIRS', b'MMOR'):
+        return 'orf'
+    if head[:4] == b'IIU\x00':
+        return 'rw2'
+    if head.startswith(b'FUJIFILMCCD-RAW'):
+        return 'raf'
+    if head[:4] == b'RIFF':
+        return {b'WEBP': 'webp', b'AVI ': 'avi'}.get(head[8:12])
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm' if b'webm' in head else 'mkv'
+    if head[:16] == ASF_HEADER_GUID:
+        return 'wmv'
+    if head[:3] == b'FLV':
+        return 'flv'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in HEIF_BRANDS:
+            return 'heif'
+        if brand in (b'avif', b'avis'):
+            return 'avif'
+        if brand == b'crx ':
+            return 'cr3'
+        if brand == b'qt  ':
+            return 'mov'
+        if brand.startswith(b'3g'):
+            return '3gp'
+        return 'mp4'
+    if head[4:8] in QUICKTIME_ATOMS:
+        return 'mov'
+    # "BM" は2バイトしかないため、続くヘッダーのサイズも確認する
+    if head[:2] == b'BM' and len(head) >= 18 and int.from_bytes(head[14:18], 'little') in BMP_HEADER_SIZES:
+        return 'bmp'
+    return None
+
+
+def sniff_format(file_path):
+    """ファイルの先頭を読み、実際の形式名を返す。画像・動画でなければ None"""
+    head = fs.read_ranges(file_path, [(0, SNIFF_BYTES)])[0]
+    return identify_format(head)
+
+
+def _clean(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return str(value).strip('\x00 ').strip()
+
+
+def read_exif_with_pillow(file_path) -> dict:
+    """
+    Pillow でヘッダーのEXIFだけを読み、ExifToolと同じタグ名の辞書を返す (画素は展開しない)。
+    file_path にはファイルオブジェクトも指定できる。
+    """
+    with _load_pillow().open(file_path) as image:
+        exif = image.getexif()
+    exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+    data = {}
+    for name, tag in PILLOW_TAGS.items():
+        value = exif_ifd.get(tag, exif.get(tag))
+        if value is not None and _clean(value):
+            data[name] = _clean(value)
+    return data
+
+
+def read_metadata(file_path, media_format: str, timeout: float = DEFAULT_METADATA_TIMEOUT,
+                  raise_errors: bool = False) -> dict:
+    """
+    形式に応じて最も軽い方法でメタデータを読み、ExifToolと同じタグ名の辞書を返す。
+    Pillow で読めなかった場合と、EXIFに撮影日時が無い場合 (XMP にのみ持つファイル) はExifToolで読み直す。raise_errors は get_exif_data_with_exiftool と同じ。
+    """
+    if media_format not in FORMAT_READERS:
+        raise UnsupportedMediaError(f"'{file_path}' は対応している画像・動画の形式ではありません。")
+    reader = FORMAT_READERS[media_format]
+    if reader == READER_NONE:
+        return {}
+    if reader == READER_PILLOW and _load_pillow() is not None:
+        try:
+            data = read_exif_with_pillow(file_path)
+        except Exception as e:
+            logging.debug(f"Pillow でEXIFを読み取れないため、ExifToolで読み取ります ({file_path}): {e}")
+        else:
+            if data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG):
+                return data
+            logging.debug(f"EXIFに撮影日時が無いため、ExifToolで XMP なども読み取ります ({file_path})")
+    return get_exif_data_with_exiftool(file_path, timeout, raise_errors)
+
+
+def read_metadata_from_bytes(head: bytes, media_format: str, label, timeout: float = DEFAULT_METADATA_TIMEOUT) -> dict:
+    """
+    ファイルの先頭部分 (head) だけからメタデータを読み、ExifToolと同じタグ名の辞書を返す。
+    アーカイブのメンバーのように、ファイルとして開けない内容に使う。label はログに出す名前。
+    media_format が None (形式を判定していない) の場合はExifToolで読む。
+    """
+    reader = FORMAT_READERS.get(media_format, READER_EXIFTOOL)
+    if reader == READER_NONE:
+        return {}
+    if reader == READER_PILLOW and _load_pillow() is not None:
+        try:
+            data = read_exif_with_pillow(io.BytesIO(head))
+        except Exception as e:
+            logging.debug(f"Pillow でEXIFを読み取れないため、ExifToolで読み取ります ({label}): {e}")
+        else:
+            if data.get(EXIFTOOL_DATETIME_ORIGINAL_TAG):
+                return data
+            logging.debug(f"EXIFに撮影日時が無いため、ExifToolで XMP なども読み取ります ({label})")
+    return get_exif_data_from_bytes(head, label, timeout)
@@ -0,0 +1,93 @@
+import json
+import logging
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import api
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+def test_rename_yields_file_results(mock_exiftool, tmp_path):
+    """ファイルごとの結果が FileResult として返り、サマリーに集計されること"""
+    (tmp_path / "IMG_1.JPG").write_bytes(b"x")
+    (tmp_path / "20230101_0001_Old.jpg").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+
+    run = api.rename(str(tmp_path))
+    results = {r.source.name: r for r in run}
+
+    renamed = results["IMG_1.JPG"]
+    assert renamed.action == api.ACTION_RENAME
+    assert renamed.status == 'success'
+    assert renamed.target == tmp_path / "20230101_0001_Cam.jpg"
+    assert set(renamed.timings) == {'metadata', 'rename'}
+    assert results["20230101_0001_Old.jpg"].reason == api.REASON_ALREADY_RENAMED
+    assert results["notes.txt"].reason == api.REASON_UNSUPPORTED
+
+    summary = run.summary.to_dict()
+    assert run.total == 3
+    assert summary['counts'] == {'success': 1, 'skip': 2, 'error': 0}
+    assert summary['reasons'] == {api.REASON_ALREADY_RENAMED: 1, api.REASON_UNSUPPORTED: 1}
+    assert summary['cancelled'] is False
+
+
+def test_rename_does_not_log_per_file(mock_exiftool, tmp_path, caplog):
+    """APIではファイルごとのログを出力せず、結果のメッセージとして返すこと"""
+    (tmp_path / "IMG_1.JPG").write_bytes(b"x")
+    with caplog.at_level(logging.INFO):
+        results = list(api.rename(str(tmp_path), dry_run=True))
+    assert results[0].message == "[DRY RUN] リネーム: 'IMG_1.JPG' -> '20230101_0001_Cam.jpg'"
+    assert results[0].dry_run
+    assert "リネーム:" not in caplog.text
+
+
+def test_cancel_stops_mid_run(mock_exiftool, tmp_path):
+    """cancel() すると残りのファイルは処理されないこと"""
+    for i in range(5):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    run = api.rename(str(tmp_path))
+    processed = []
+    for result in run:
+        processed.append(result)
+        if len(processed) == 2:
+            run.cancel()
+
+    assert len(processed) == 2
+    assert run.summary.cancelled
+    assert run.summary.counts == {'success': 2, 'skip': 0, 'error': 0}
+    assert len(list(tmp_path.glob("IMG_*.JPG"))) == 3
+
+
+def test_organize_yields_file_results(mock_exiftool, tmp_path):
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    (source / "IMG_1.JPG").write_bytes(b"x")
+
+    run = api.organize(str(source), str(dest), sort=True)
+    results = list(run)
+    assert run.total == 1
+    assert results[0].action == api.ACTION_MOVE
+    assert results[0].target == dest / "2023" / "01" / "IMG_1.JPG"
+    assert results[0].target.exists()
+    assert run.summary.finished_at is not None
+
+
+def test_invalid_directory_raises(tmp_path):
+    with pytest.raises(NotADirectoryError):
+        list(api.rename(str(tmp_path / "missing")))
+    with pytest.raises(NotADirectoryError):
+        list(api.iter_organize_results(str(tmp_path), str(tmp_path / "missing")))
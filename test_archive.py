@@ -0,0 +1,194 @@
+import io
+import json
+import os
+import tarfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+from PIL import Image
+
+import api
+from archive import member_file_name, iter_archive_members
+from results import ACTION_EXTRACT, REASON_DUPLICATE, REASON_UNSUPPORTED
+
+
+def jpeg_bytes(datetime_str: str) -> bytes:
+    img = Image.new('RGB', (8, 8), color='blue')
+    exif = img.getexif()
+    exif.get_ifd(0x8769)[0x9003] = datetime_str
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def write_tgz(path: Path, members: dict, mtime: float = 0):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = mtime
+            archive.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def dest(tmp_path):
+    path = tmp_path / "dest"
+    path.mkdir()
+    return path
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('Takeout/Google Photos/IMG_1.jpg', 'IMG_1.jpg'),
+    ('../../etc/IMG_2.jpg', 'IMG_2.jpg'),
+    ('DCIM\\IMG_3.jpg', 'IMG_3.jpg'),
+    ('__MACOSX/DCIM/._IMG_4.jpg', None),
+    ('DCIM/.thumbnail', None),
+])
+def test_member_file_name(name, expected):
+    assert member_file_name(name) == expected
+
+
+def test_zip_members_are_read_in_file_order(tmp_path):
+    """ZIPのメンバーはアーカイブ内の位置の順に返すこと"""
+    path = tmp_path / "photos.zip"
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name in ("c.jpg", "a.jpg", "b.jpg"):
+            archive.writestr(name, name.encode())
+    assert [member.name for member in iter_archive_members(path)] == ["c.jpg", "a.jpg", "b.jpg"]
+
+
+def test_zip_member_with_zero_date_uses_archive_mtime(tmp_path):
+    """日付が0 (1980-00-00) のZIPメンバーはアーカイブの更新日時を使うこと"""
+    path = tmp_path / "photos.zip"
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr(zipfile.ZipInfo("IMG_1.jpg", date_time=(1980, 0, 0, 0, 0, 0)), b"data")
+    os.utime(path, (1700000000, 1700000000))
+    assert [member.mtime for member in iter_archive_members(path)] == [1700000000]
+
+
+def test_organize_extracts_tgz_without_exiftool(tmp_path, dest):
+    """TARのメンバーを先頭のEXIFで振り分け、アーカイブは残すこと"""
+    archive_path = tmp_path / "takeout.tgz"
+    write_tgz(archive_path, {
+        "Takeout/IMG_1.jpg": jpeg_bytes("2021:03:04 05:06:07"),
+        "Takeout/IMG_1.jpg.json": b'{"title": "IMG_1.jpg"}',
+    })
+
+    with patch('subprocess.run') as mock_run:
+        results = list(api.organize(str(archive_path), str(dest)))
+    mock_run.assert_not_called()
+
+    extracted = [r for r in results if r.action == ACTION_EXTRACT]
+    assert len(extracted) == 1
+    assert extracted[0].target == dest / "2021" / "03" / "IMG_1.jpg"
+    assert extracted[0].source_root == archive_path
+    assert extracted[0].target.read_bytes() == jpeg_bytes("2021:03:04 05:06:07")
+    assert [r.reason for r in results if r.action != ACTION_EXTRACT] == [REASON_UNSUPPORTED]
+    assert archive_path.exists()
+    assert not list(dest.rglob("*.partial"))
+
+
+def test_organize_zip_falls_back_to_member_mtime(tmp_path, dest):
+    """EXIFの無いメンバーはメンバーの更新日時で振り分けること"""
+    archive_path = tmp_path / "backup.zip"
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr(zipfile.ZipInfo("DCIM/MOV_1.mp4", date_time=(2019, 7, 8, 9, 10, 12)), b'\x00\x00\x00\x18ftypisom' + b'\x00' * 100)
+
+    with patch('subprocess.run') as mock_run:
+        mock_run.return_value = MagicMock(stdout=json.dumps([{}]).encode(), stderr=b"", returncode=0)
+        results = list(api.organize(str(archive_path), str(dest)))
+
+    # ExifToolにはファイルではなく先頭のバイト列を標準入力で渡す
+    assert mock_run.call_args.args[0][-1] == '-'
+    assert mock_run.call_args.kwargs['input'].startswith(b'\x00\x00\x00\x18ftyp')
+    target = dest / "2019" / "07" / "MOV_1.mp4"
+    assert [r.target for r in results] == [target]
+    assert datetime.fromtimestamp(os.stat(target).st_mtime) == datetime(2019, 7, 8, 9, 10, 12)
+
+
+def test_organize_reports_unreadable_zip_members_and_continues(tmp_path, dest):
+    """未対応の圧縮方式・暗号化されたメンバーはそのメンバーだけをエラーにして続けること"""
+    archive_path = tmp_path / "backup.zip"
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr("IMG_0.jpg", b"encrypted")
+        archive.writestr("IMG_1.jpg", b"deflate64")
+        archive.writestr("IMG_2.jpg", jpeg_bytes("2021:03:04 05:06:07"))
+    # 中央ディレクトリのエントリを書き換え、1件目を暗号化、2件目を Deflate64 (圧縮方式 9) にする
+    data = bytearray(archive_path.read_bytes())
+    first = data.index(b'PK\x01\x02')
+    second = data.index(b'PK\x01\x02', first + 4)
+    data[first + 8] |= 0x1
+    data[second + 10] = 9
+    archive_path.write_bytes(bytes(data))
+
+    results = list(api.organize(str(archive_path), str(dest)))
+    assert [(r.source.name, r.status) for r in results] == [
+        ("IMG_0.jpg", 'error'), ("IMG_1.jpg", 'error'), ("IMG_2.jpg", 'success'),
+    ]
+    assert [r.reason for r in results[:2]] == [REASON_UNSUPPORTED, REASON_UNSUPPORTED]
+    assert (dest / "2021" / "03" / "IMG_2.jpg").exists()
+
+
+def test_organize_archive_checks_dest_index_before_writing(tmp_path, dest):
+    """宛先インデックスに同じ内容があるメンバーは書き出さずにスキップし、末尾だけ違うメンバーは展開すること"""
+    data = bytes(range(256)) * 1200
+    (dest / "2020" / "01").mkdir(parents=True)
+    (dest / "2020" / "01" / "IMG_A.jpg").write_bytes(data)
+    archive_path = tmp_path / "backup.zip"
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr(zipfile.ZipInfo("DCIM/IMG_B.jpg", date_time=(2021, 3, 4, 5, 6, 7)), data)
+        archive.writestr(zipfile.ZipInfo("DCIM/IMG_C.jpg", date_time=(2021, 3, 4, 5, 6, 7)), data[:-1] + b'\x00')
+
+    with patch('subprocess.run') as mock_run:
+        mock_run.return_value = MagicMock(stdout=json.dumps([{}]).encode(), stderr=b"", returncode=0)
+        results = list(api.organize(str(archive_path), str(dest), use_dest_index=True))
+
+    assert [(r.source.name, r.reason) for r in results] == [("IMG_B.jpg", REASON_DUPLICATE), ("IMG_C.jpg", None)]
+    assert results[0].target == dest / "2020" / "01" / "IMG_A.jpg"
+    assert sorted(path.name for path in dest.rglob("*.jpg")) == ["IMG_A.jpg", "IMG_C.jpg"]
+    assert not list(dest.rglob("*.partial"))
+
+
+def test_organize_archive_rerun_skips_extracted(tmp_path, dest):
+    """再実行しても、展開済みのメンバーは重複して書き出さないこと"""
+    archive_path = tmp_path / "takeout.tar.gz"
+    write_tgz(archive_path, {"IMG_1.jpg": jpeg_bytes("2021:03:04 05:06:07")})
+    first = list(api.organize(str(archive_path), str(dest)))
+    second = list(api.organize(str(archive_path), str(dest)))
+
+    assert [r.action for r in first] == [ACTION_EXTRACT]
+    assert [r.reason for r in second] == [REASON_DUPLICATE]
+    assert [p.name for p in dest.rglob("*.jpg")] == ["IMG_1.jpg"]
+
+
+def test_organize_mixes_directory_and_archive_sources(tmp_path, dest):
+    """ディレクトリとアーカイブを同時にソースに指定できること"""
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "IMG_2.jpg").write_bytes(jpeg_bytes("2022:01:01 00:00:00"))
+    archive_path = tmp_path / "takeout.zip"
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr("IMG_1.jpg", jpeg_bytes("2021:03:04 05:06:07"))
+
+    with patch('subprocess.run') as mock_run:
+        mock_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2022:01:01 00:00:00"}]), stderr="", returncode=0
+        )
+        run = api.organize([str(source), str(archive_path)], str(dest))
+        run.run_to_completion()
+
+    assert run.summary.success == 2
+    assert (dest / "2021" / "03" / "IMG_1.jpg").exists()
+    assert (dest / "2022" / "01" / "IMG_2.jpg").exists()
+
+
+def test_organize_reports_corrupt_archive(tmp_path, dest):
+    archive_path = tmp_path / "broken.tgz"
+    archive_path.write_bytes(b'\x1f\x8b' + b'\x00' * 32)
+    results = list(api.organize(str(archive_path), str(dest)))
+    assert len(results) == 1
+    assert results[0].status == 'error'
+    assert results[0].source == archive_path
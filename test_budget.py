@@ -0,0 +1,133 @@
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import api
+from cursor import RunCursor, LowWaterMark, CURSOR_FILENAME
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+def test_max_files_resumes_from_cursor(mock_exiftool, tmp_path):
+    """件数の予算で打ち切り、次回は続きのファイルから処理すること"""
+    for i in range(5):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    run = api.rename(str(tmp_path), max_files=2)
+    first = [r.source.name for r in run]
+    assert first == ["IMG_0.JPG", "IMG_1.JPG"]
+    assert run.summary.budget_exhausted
+    assert (tmp_path / CURSOR_FILENAME).exists()
+
+    run = api.rename(str(tmp_path), max_files=2)
+    assert [r.source.name for r in run] == ["IMG_2.JPG", "IMG_3.JPG"]
+
+    run = api.rename(str(tmp_path), max_files=2)
+    assert [r.source.name for r in run] == ["IMG_4.JPG"]
+    assert not run.summary.budget_exhausted
+    # 最後まで処理したらカーソルは消える
+    assert not (tmp_path / CURSOR_FILENAME).exists()
+    assert len(list(tmp_path.glob("20230101_*_Cam.jpg"))) == 5
+
+
+def test_max_seconds_stops_at_file_boundary(mock_exiftool, tmp_path):
+    """時間の予算を使い切ったら処理中のファイルを終えて止まること"""
+    for i in range(3):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    run = api.rename(str(tmp_path), max_seconds=1e-9)
+    results = list(run)
+    assert len(results) == 1
+    assert results[0].status == 'success'
+    assert run.summary.to_dict()['budget_exhausted'] is True
+
+
+def test_dry_run_does_not_save_cursor(mock_exiftool, tmp_path):
+    for i in range(3):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+    list(api.rename(str(tmp_path), dry_run=True, max_files=1))
+    assert not (tmp_path / CURSOR_FILENAME).exists()
+
+
+def test_organize_resumes_per_source(mock_exiftool, tmp_path):
+    """複数ソースでもソースごとの位置から再開すること"""
+    sources = [tmp_path / "a", tmp_path / "b"]
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    for source in sources:
+        source.mkdir()
+        for i in range(3):
+            (source / f"{source.name}{i}.jpg").write_bytes(source.name.encode() + bytes([i]))
+    cursor_file = tmp_path / "cursor.json"
+
+    run = api.organize([str(s) for s in sources], str(dest), max_files=2, cursor_file=str(cursor_file))
+    assert sorted(r.source.name for r in run) == ["a0.jpg", "b0.jpg"]
+
+    positions = RunCursor(cursor_file, f"organize:{dest.resolve()}").load()
+    assert positions == {str(sources[0]): str(sources[0] / "a0.jpg"), str(sources[1]): str(sources[1] / "b0.jpg")}
+
+    run = api.organize([str(s) for s in sources], str(dest), cursor_file=str(cursor_file))
+    assert sorted(r.source.name for r in run) == ["a1.jpg", "a2.jpg", "b1.jpg", "b2.jpg"]
+    assert not cursor_file.exists()
+
+
+def test_organize_budget_reports_every_moved_file(mock_exiftool, tmp_path):
+    """並列に処理中のファイルも報告し、移動したファイルとカーソルが一致すること"""
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    for i in range(40):
+        (source / f"IMG_{i:02d}.jpg").write_bytes(bytes([i]))
+    cursor_file = tmp_path / "cursor.json"
+
+    run = api.organize(str(source), str(dest), max_files=1, max_concurrency=4, cursor_file=str(cursor_file))
+    reported = sorted(r.source.name for r in run)
+    moved = sorted(path.name for path in dest.rglob("*.jpg"))
+    assert run.summary.budget_exhausted
+    assert 1 <= len(reported) <= 8  # 打ち切り時に投入済みだったタスク (ワーカー数の2倍) まで
+    assert moved == reported
+    positions = RunCursor(cursor_file, f"organize:{dest.resolve()}").load()
+    assert positions == {str(source): str(source / reported[-1])}
+
+    run = api.organize(str(source), str(dest), cursor_file=str(cursor_file))
+    assert len(list(run)) == 40 - len(reported)
+    assert len(list(dest.rglob("*.jpg"))) == 40
+
+
+def test_low_water_mark_waits_for_gaps():
+    mark = LowWaterMark(["a", "b", "c"])
+    mark.mark("b")
+    assert mark.position is None
+    mark.mark("a")
+    assert mark.position == "b"
+    mark.mark("c")
+    assert mark.position == "c"
+
+
+def test_capture_order_saves_cursor_per_directory(mock_exiftool, tmp_path):
+    """撮影日時順では、途中で打ち切ったディレクトリは次回に最初から処理すること"""
+    for sub in ("a", "b"):
+        (tmp_path / sub).mkdir()
+        for i in range(2):
+            (tmp_path / sub / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    run = api.rename(str(tmp_path), recursive=True, order=api.ORDER_CAPTURE, max_files=3)
+    assert [r.source.parent.name for r in run] == ["a", "a", "b"]
+    positions = RunCursor(tmp_path / CURSOR_FILENAME, f"rename:{tmp_path.resolve()}:recursive").load()
+    assert positions == {str(tmp_path): str(tmp_path / "a" / "IMG_1.JPG")}
+
+    run = api.rename(str(tmp_path), recursive=True, order=api.ORDER_CAPTURE, max_files=3)
+    results = list(run)
+    assert {r.source.parent.name for r in results} == {"b"}
+    assert [r.status for r in results].count('success') == 1
+    assert not (tmp_path / CURSOR_FILENAME).exists()
@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from catalog import Catalog, format_summary, CATALOG_FILENAME
+from utils import MetadataTimeoutError
+
+METADATA = {
+    "IMG_1.jpg": {"DateTimeOriginal": "2021:03:04 05:06:07", "Model": "iPhone 12"},
+    "IMG_2.jpg": {"DateTimeOriginal": "2021:03:20 10:00:00", "Model": "iPhone 12"},
+    "MOV_1.mp4": {"DateTimeOriginal": "2022:01:01 00:00:00", "Model": "Pixel 8"},
+    "SCAN_1.png": {"Software": "ScanApp v1.2"},
+}
+
+
+def mock_exiftool(command, **kwargs):
+    name = command[-1].rsplit('/', 1)[-1]
+    return MagicMock(stdout=json.dumps([METADATA.get(name, {})]), stderr="", returncode=0)
+
+
+@pytest.fixture
+def library(tmp_path):
+    (tmp_path / "2021" / "03").mkdir(parents=True)
+    (tmp_path / "2022").mkdir()
+    (tmp_path / "2021" / "03" / "IMG_1.jpg").write_bytes(b"a" * 10)
+    (tmp_path / "2021" / "03" / "IMG_2.jpg").write_bytes(b"b" * 20)
+    (tmp_path / "2022" / "MOV_1.mp4").write_bytes(b"c" * 300)
+    (tmp_path / "SCAN_1.png").write_bytes(b"d" * 4)
+    (tmp_path / "notes.txt").write_text("not media")
+    return tmp_path
+
+
+def test_refresh_is_incremental(library):
+    catalog = Catalog(library)
+    try:
+        with patch('subprocess.run', side_effect=mock_exiftool) as mock_run:
+            assert catalog.refresh() == {'added': 4, 'updated': 0, 'removed': 0, 'unchanged': 0}
+            assert mock_run.call_count == 4
+
+            # 変更の無いファイルはメタデータを読み直さない
+            mock_run.reset_mock()
+            assert catalog.refresh() == {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 4}
+            mock_run.assert_not_called()
+
+            (library / "2021" / "03" / "IMG_1.jpg").write_bytes(b"a" * 11)
+            (library / "SCAN_1.png").unlink()
+            assert catalog.refresh() == {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 2}
+            assert mock_run.call_count == 1
+        assert len(catalog) == 3
+    finally:
+        catalog.close()
+    assert (library / CATALOG_FILENAME).exists()
+
+
+def test_summarize_groups_by_date_device_and_extension(library):
+    catalog = Catalog(library)
+    try:
+        with patch('subprocess.run', side_effect=mock_exiftool):
+            catalog.refresh(workers=2)
+        by_month = catalog.summarize(['year', 'month'])
+        by_device = catalog.summarize(['device', 'extension'])
+        total = catalog.summarize([])
+    finally:
+        catalog.close()
+
+    assert by_month == [
+        {'year': '2021', 'month': '03', 'count': 2, 'total_bytes': 30, 'missing_date': 0},
+        {'year': '2022', 'month': '01', 'count': 1, 'total_bytes': 300, 'missing_date': 0},
+        {'year': None, 'month': None, 'count': 1, 'total_bytes': 4, 'missing_date': 1},
+    ]
+    assert {(row['device'], row['extension']): row['count'] for row in by_device} == {
+        ('Pixel_8', '.mp4'): 1, ('ScanApp', '.png'): 1, ('iPhone_12', '.jpg'): 2,
+    }
+    assert total == [{'count': 4, 'total_bytes': 334, 'missing_date': 1}]
+
+
+def test_timeout_is_retried_on_next_refresh(library):
+    catalog = Catalog(library)
+    try:
+        with patch('catalog.get_exif_data_with_exiftool', side_effect=MetadataTimeoutError("slow")):
+            catalog.refresh()
+        with patch('subprocess.run', side_effect=mock_exiftool) as mock_run:
+            counts = catalog.refresh()
+        assert counts['updated'] == 4
+        assert mock_run.call_count == 4
+        assert catalog.summarize([])[0]['missing_date'] == 1
+    finally:
+        catalog.close()
+
+
+def test_format_summary_csv():
+    summary = [{'year': '2021', 'count': 2, 'total_bytes': 30, 'missing_date': 0}]
+    rows = list(csv.DictReader(io.StringIO(format_summary(summary, ['year'], 'csv'))))
+    assert rows == [{'year': '2021', 'count': '2', 'total_bytes': '30', 'missing_date': '0'}]
+
+
+def test_summarize_rejects_unknown_column(library):
+    catalog = Catalog(library)
+    try:
+        with pytest.raises(ValueError):
+            catalog.summarize(['path; DROP TABLE media'])
+    finally:
+        catalog.close()
@@ -0,0 +1,238 @@
+import csv
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+import pytest
+from unittest.mock import patch, MagicMock
+
+from concurrency import AIMDController, Lane, imap_bounded, run_lanes, weighted_interleave, write_concurrency_metrics
+
+# テスト用のダミーディレクトリ
+SOURCE_DIR = Path("./test_concurrency_source")
+DEST_DIR = Path("./test_concurrency_dest")
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown():
+    for d in (SOURCE_DIR, DEST_DIR):
+        if d.exists():
+            shutil.rmtree(d)
+        d.mkdir()
+    yield
+    for d in (SOURCE_DIR, DEST_DIR):
+        if d.exists():
+            shutil.rmtree(d)
+
+
+def test_aimd_increases_when_latency_is_stable():
+    """遅延が安定していれば上限まで加算的に増えること"""
+    controller = AIMDController('test', min_limit=1, max_limit=4)
+    for _ in range(100):
+        controller.acquire()
+        controller.release(0.01)
+    assert controller.limit == 4
+    assert [limit for _, limit in controller.history] == [1, 2, 3, 4]
+
+
+def test_aimd_backs_off_on_errors():
+    """エラー率が高いと乗算的に減り、下限を下回らないこと"""
+    controller = AIMDController('test', min_limit=2, max_limit=8)
+    controller.limit = 8
+    for _ in range(8):
+        controller.acquire()
+        controller.release(0.01, error=True)
+    assert controller.limit == 4
+    for _ in range(40):
+        controller.acquire()
+        controller.release(0.01, error=True)
+    assert controller.limit == 2
+
+
+def test_aimd_backs_off_on_latency_spike():
+    """遅延がベースラインから大きく悪化すると同時実行数を減らすこと"""
+    controller = AIMDController('test', min_limit=1, max_limit=8)
+    controller.limit = 8
+    for _ in range(8):
+        controller.acquire()
+        controller.release(0.01)
+    for _ in range(8):
+        controller.acquire()
+        controller.release(1.0)
+    assert controller.limit < 8
+
+
+def test_aimd_slot_records_exception():
+    """slot内の例外がエラーとして記録され、再送出されること"""
+    controller = AIMDController('test', min_limit=1, max_limit=2)
+    with pytest.raises(OSError):
+        with controller.slot():
+            raise OSError("boom")
+    assert controller.in_flight == 0
+
+
+def test_aimd_invalid_bounds():
+    with pytest.raises(ValueError):
+        AIMDController('test', min_limit=3, max_limit=2)
+
+
+def test_imap_bounded_ordered():
+    results = list(imap_bounded(lambda x: x * 2, range(50), max_workers=4, ordered=True))
+    assert results == [x * 2 for x in range(50)]
+
+
+def test_imap_bounded_unordered():
+    results = list(imap_bounded(lambda x: x * 2, range(50), max_workers=4))
+    assert sorted(results) == [x * 2 for x in range(50)]
+
+
+def test_weighted_interleave_is_proportional():
+    """重みに比例した割合で取り出し、尽きたストリームがあっても残りを最後まで返すこと"""
+    big = [f"big{i}" for i in range(100)]
+    small = [f"small{i}" for i in range(5)]
+    heavy = [f"heavy{i}" for i in range(100)]
+    picked = list(weighted_interleave([big, small, heavy], [1, 1, 2]))
+
+    first = [index for index, _ in picked[:12]]
+    assert first.count(0) == 3 and first.count(1) == 3 and first.count(2) == 6
+    # small は大きなストリームの後回しにされず、早い段階で処理し終わる
+    assert max(i for i, (index, _) in enumerate(picked) if index == 1) < 20
+    assert [item for index, item in picked if index == 0] == big
+    assert len(picked) == 205
+
+
+def test_write_concurrency_metrics(tmp_path):
+    controller = AIMDController('metadata', min_limit=1, max_limit=2)
+    for _ in range(10):
+        controller.acquire()
+        controller.release(0.01)
+    metrics_file = tmp_path / "metrics.csv"
+    write_concurrency_metrics(metrics_file, [controller])
+
+    with open(metrics_file, encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]['controller'] == 'metadata'
+    assert [int(row['limit']) for row in rows] == [1, 2]
+
+
+@patch('subprocess.run')
+def test_organize_concurrent_no_collisions(mock_subprocess_run, tmp_path):
+    """並列実行時も同名ファイルが上書きされずに連番付きで移動されること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+        stderr="",
+        returncode=0
+    )
+
+    for i in range(10):
+        sub = SOURCE_DIR / f"sub{i}"
+        sub.mkdir()
+        (sub / "IMG_0001.JPG").write_bytes(b"dummy")
+
+    metrics_file = tmp_path / "metrics.csv"
+    from organize_files import organize_files
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=False, quiet=True,
+                   min_concurrency=1, max_concurrency=4, metrics_file=str(metrics_file))
+
+    moved = list((DEST_DIR / "2023" / "06").iterdir())
+    assert len(moved) == 10
+    assert not list(SOURCE_DIR.rglob("*.JPG"))
+    assert metrics_file.exists()
+
+
+@patch('subprocess.run')
+def test_rename_concurrent_keeps_sequence_order(mock_subprocess_run):
+    """EXIF読み取りを並列化しても、連番はファイル名順に付与されること"""
+    def mock_exiftool(command, **kwargs):
+        return MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam", "SourceFile": command[-1]}]),
+            stderr="", returncode=0
+        )
+    mock_subprocess_run.side_effect = mock_exiftool
+
+    for i in range(6):
+        (SOURCE_DIR / f"IMG_{i}.JPG").write_bytes(f"{i}".encode())
+
+    from rename_images import rename_image_files
+    rename_image_files(str(SOURCE_DIR), quiet=True, max_concurrency=4)
+
+    for i in range(6):
+        renamed = SOURCE_DIR / f"20230101_{i + 1:04d}_Cam.jpg"
+        assert renamed.read_bytes() == f"{i}".encode()
+
+
+def test_run_lanes_small_files_not_blocked_by_large():
+    """大きいファイルのレーンが詰まっていても、小さいファイルのレーンは処理が進むこと"""
+    release_large = threading.Event()
+    lanes = [Lane('small', 2), Lane('large', 1)]
+
+    def func(item, lane):
+        if lane.name == 'large':
+            assert release_large.wait(timeout=5)
+        return item
+
+    items = ['big1', 'big2'] + [f'small{i}' for i in range(20)]
+    results = []
+    for result in run_lanes(func, items, lanes, lambda item: 'large' if item.startswith('big') else 'small'):
+        results.append(result)
+        if sum(1 for r in results if r.startswith('small')) == 20:
+            release_large.set()
+
+    assert set(results[:20]) == {f'small{i}' for i in range(20)}
+    assert set(results[20:]) == {'big1', 'big2'}
+
+
+def test_run_lanes_stop_reports_every_started_item():
+    """打ち切り後は補充せず、始まっていないタスクは取り消し、実行したタスクの結果はすべて返すこと"""
+    started = []
+
+    def func(item, lane):
+        started.append(item)
+        time.sleep(0.02)
+        return item
+
+    results = []
+    for result in run_lanes(func, range(100), [Lane('default', 2)], lambda item: 'default', lambda: bool(results)):
+        results.append(result)
+    assert sorted(results) == sorted(started)
+    assert len(results) <= 4
+
+
+def test_exiftool_failures_are_recorded_as_errors(tmp_path):
+    """ExifToolの失敗は空のEXIFとして扱いつつ、コントローラーにはエラーとして記録して同時実行数を上げないこと"""
+    import subprocess
+    import api
+    for i in range(16):
+        (tmp_path / f"IMG_{i:02d}.JPG").write_bytes(b"x")
+    metrics_file = tmp_path / "metrics.csv"
+    failure = subprocess.CalledProcessError(1, 'exiftool', stderr="Error: File format error")
+    with patch('subprocess.run', side_effect=failure):
+        results = list(api.rename(str(tmp_path), max_concurrency=4, metrics_file=str(metrics_file)))
+
+    assert {r.reason for r in results} == {api.REASON_NO_DATETIME}
+    with open(metrics_file, encoding='utf-8') as f:
+        assert {row['limit'] for row in csv.DictReader(f)} == {'1'}
+
+
+@patch('subprocess.run')
+def test_organize_with_size_lanes(mock_subprocess_run, tmp_path):
+    """サイズ閾値でレーンを分けても全ファイルが整理されること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+        stderr="",
+        returncode=0
+    )
+    (SOURCE_DIR / "IMG_SMALL.JPG").write_bytes(b"x" * 10)
+    (SOURCE_DIR / "MOV_LARGE.MKV").write_bytes(b"x" * 2048)
+
+    metrics_file = tmp_path / "metrics.csv"
+    from organize_files import organize_files
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=False, quiet=True,
+                   large_file_threshold=1024, small_lane_workers=2, large_lane_workers=1,
+                   metrics_file=str(metrics_file))
+
+    assert (DEST_DIR / "2023" / "06" / "IMG_SMALL.JPG").exists()
+    assert (DEST_DIR / "2023" / "06" / "MOV_LARGE.MKV").exists()
+    with open(metrics_file, encoding='utf-8') as f:
+        controllers = {row['controller'] for row in csv.DictReader(f)}
+    assert controllers == {'small/metadata', 'small/move', 'large/metadata', 'large/move'}
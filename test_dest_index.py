@@ -0,0 +1,142 @@
+import json
+import shutil
+from pathlib import Path
+import pytest
+from unittest.mock import patch, MagicMock
+
+from dest_index import BloomFilter, DestinationIndex, compute_fingerprint, compute_fingerprint_from_bytes, INDEX_FILENAME
+
+# テスト用のダミーディレクトリ
+SOURCE_DIR = Path("./test_index_source")
+DEST_DIR = Path("./test_index_dest")
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown():
+    for d in (SOURCE_DIR, DEST_DIR):
+        if d.exists():
+            shutil.rmtree(d)
+        d.mkdir()
+    yield
+    for d in (SOURCE_DIR, DEST_DIR):
+        if d.exists():
+            shutil.rmtree(d)
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(100)
+    for i in range(100):
+        bloom.add(f"key{i}")
+    assert all(f"key{i}" in bloom for i in range(100))
+    false_positives = sum(1 for i in range(1000) if f"other{i}" in bloom)
+    assert false_positives < 50
+
+
+def test_compute_fingerprint(tmp_path):
+    a = tmp_path / "a.jpg"
+    b = tmp_path / "b.jpg"
+    c = tmp_path / "c.jpg"
+    a.write_bytes(b"x" * 300000)
+    b.write_bytes(b"x" * 300000)
+    c.write_bytes(b"x" * 299999 + b"y")
+    assert compute_fingerprint(a) == compute_fingerprint(b)
+    assert compute_fingerprint(a) != compute_fingerprint(c)
+
+
+@pytest.mark.parametrize('size', [10, 100000, 300000])
+def test_compute_fingerprint_from_bytes(tmp_path, size):
+    """書き出す前のストリームの先頭・末尾から、ファイルと同じ指紋を計算できること"""
+    data = bytes(i % 251 for i in range(size))
+    (tmp_path / "a.jpg").write_bytes(data)
+    assert compute_fingerprint_from_bytes(data[:256 * 1024], data[-64 * 1024:], size) == compute_fingerprint(tmp_path / "a.jpg")
+
+
+def test_rebuild_scans_year_month_dirs():
+    month_dir = DEST_DIR / "2023" / "06"
+    month_dir.mkdir(parents=True)
+    (month_dir / "IMG_1.JPG").write_bytes(b"one")
+    (DEST_DIR / "other").mkdir()
+    (DEST_DIR / "other" / "IMG_2.JPG").write_bytes(b"two")
+
+    index = DestinationIndex(DEST_DIR)
+    assert index.needs_rebuild
+    index.rebuild(workers=2)
+    assert len(index) == 1
+    index.close()
+    assert (DEST_DIR / INDEX_FILENAME).exists()
+
+
+def test_organize_skips_already_imported(mock_exiftool):
+    """宛先に同じ内容のファイルがあれば、EXIF読み取りも移動もせずにスキップすること"""
+    month_dir = DEST_DIR / "2023" / "06"
+    month_dir.mkdir(parents=True)
+    (month_dir / "IMG_OLD.JPG").write_bytes(b"same content")
+    (SOURCE_DIR / "IMG_COPY.JPG").write_bytes(b"same content")
+    (SOURCE_DIR / "IMG_NEW.JPG").write_bytes(b"new content")
+
+    from organize_files import organize_files
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=False, quiet=True, use_dest_index=True)
+
+    assert (SOURCE_DIR / "IMG_COPY.JPG").exists()
+    assert not (month_dir / "IMG_COPY.JPG").exists()
+    assert (month_dir / "IMG_NEW.JPG").exists()
+    assert mock_exiftool.call_count == 1
+
+
+def test_organize_updates_index_incrementally(mock_exiftool):
+    """配置したファイルがインデックスに追加され、次回の取り込みでスキップされること"""
+    (SOURCE_DIR / "IMG_1.JPG").write_bytes(b"content")
+
+    from organize_files import organize_files
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=False, quiet=True, use_dest_index=True)
+
+    index = DestinationIndex(DEST_DIR)
+    assert not index.needs_rebuild
+    assert len(index) == 1
+    index.close()
+
+    (SOURCE_DIR / "IMG_1_again.JPG").write_bytes(b"content")
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=False, quiet=True, use_dest_index=True)
+    assert (SOURCE_DIR / "IMG_1_again.JPG").exists()
+
+
+def test_organize_dry_run_does_not_write_index(mock_exiftool):
+    (SOURCE_DIR / "IMG_1.JPG").write_bytes(b"content")
+
+    from organize_files import organize_files
+    organize_files(str(SOURCE_DIR), str(DEST_DIR), dry_run=True, quiet=True, use_dest_index=True)
+
+    assert not (DEST_DIR / INDEX_FILENAME).exists()
+
+
+def test_organize_skips_already_imported_in_memory(mock_exiftool):
+    """メモリ上のファイルシステムでも、インデックスの構築と取り込み済みの判定ができること"""
+    import fs
+    from organize_files import organize_run
+
+    backend = fs.MemoryBackend()
+    backend.add_file("/dest/2023/06/IMG_OLD.JPG", data=b"same content")
+    backend.add_file("/source/IMG_COPY.JPG", data=b"same content")
+    backend.add_file("/source/IMG_NEW.JPG", data=b"new content")
+    fs.set_backend(backend)
+    index = DestinationIndex("/dest", index_file=":memory:")
+    try:
+        organize_run("/source", "/dest", use_dest_index=True, dest_index=index).run_to_completion()
+        assert len(index) == 2
+    finally:
+        index.close()
+        fs.set_backend(None)
+
+    assert backend.files() == [
+        Path("/dest/2023/06/IMG_NEW.JPG"), Path("/dest/2023/06/IMG_OLD.JPG"), Path("/source/IMG_COPY.JPG"),
+    ]
+    assert mock_exiftool.call_count == 1
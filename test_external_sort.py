@@ -0,0 +1,25 @@
+import random
+
+import pytest
+
+from external_sort import ExternalSorter
+
+
+@pytest.mark.parametrize('buffer_size', [1000, 7])
+def test_sorts_with_and_without_spilling(tmp_path, buffer_size):
+    rng = random.Random(1)
+    items = [[rng.randrange(100), f"name{i}"] for i in range(100)]
+    with ExternalSorter(buffer_size=buffer_size, temp_dir=tmp_path) as sorter:
+        for item in items:
+            sorter.add(item)
+        assert len(sorter) == 100
+        assert sorter.spilled == 100 // buffer_size
+        assert list(sorter) == sorted(items)
+    assert not list(tmp_path.iterdir())
+
+
+def test_key_is_applied_to_spilled_items(tmp_path):
+    with ExternalSorter(key=lambda item: item['time'], buffer_size=2, temp_dir=tmp_path) as sorter:
+        for name, time in [("a", 3), ("b", 1), ("c", 2)]:
+            sorter.add({'name': name, 'time': time})
+        assert [item['name'] for item in sorter] == ["b", "c", "a"]
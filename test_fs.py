@@ -0,0 +1,159 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import fs
+from fs import MemoryBackend
+from benchmark import run_benchmark
+
+
+def test_memory_backend_operations():
+    backend = MemoryBackend()
+    backend.add_file('/lib/a/IMG_1.JPG', size=10)
+    backend.add_file('/lib/a/IMG_2.JPG', size=20)
+
+    assert sorted(backend.listdir('/lib/a')) == ['IMG_1.JPG', 'IMG_2.JPG']
+    assert backend.stat('/lib/a/IMG_2.JPG').st_size == 20
+    # 移動先が存在する場合は上書きしない
+    assert backend.rename_noreplace('/lib/a/IMG_1.JPG', '/lib/a/IMG_2.JPG') is False
+    assert backend.rename_noreplace('/lib/a/IMG_1.JPG', '/lib/a/IMG_3.JPG') is True
+    backend.mkdir('/lib/b/c')
+    backend.move('/lib/a/IMG_3.JPG', '/lib/b/c/IMG_3.JPG')
+    assert backend.files() == [Path('/lib/a/IMG_2.JPG'), Path('/lib/b/c/IMG_3.JPG')]
+    assert [e.name for e in backend.scandir('/lib/b') if e.is_dir()] == ['c']
+    with pytest.raises(FileNotFoundError):
+        backend.stat('/lib/missing')
+
+
+def test_memory_backend_injects_failures():
+    backend = MemoryBackend(failure_rate={'stat': 1.0})
+    backend.add_file('/lib/IMG_1.JPG')
+    with pytest.raises(OSError):
+        backend.stat('/lib/IMG_1.JPG')
+    assert backend.exists('/lib/IMG_1.JPG')
+    assert backend.calls == {'stat': 1, 'exists': 1}
+
+
+def test_rename_runs_in_memory():
+    """rename がメモリ上のファイルシステムだけで動作し、実ファイルシステムに戻ること"""
+    report = run_benchmark('rename', files=200, dirs=4, seed=1)
+    assert report['counts'] == {'success': 200, 'skip': 0, 'error': 0}
+    assert report['calls']['rename'] == 200
+    assert isinstance(fs.get_backend(), fs.PosixBackend)
+
+
+def test_organize_error_storm_is_reported_per_file():
+    """移動の障害が注入されても、失敗したファイルだけがエラーになること"""
+    report = run_benchmark('organize', files=200, dirs=4, failure_rate={'move': 0.5}, seed=1, max_concurrency=4)
+    counts = report['counts']
+    assert counts['success'] + counts['error'] == 200
+    assert 0 < counts['error'] < 200
+    assert report['reasons'] == {'os_error': counts['error']}
+
+
+def test_apply_session_uses_directory_fds(tmp_path, monkeypatch):
+    """移動・リネームはディレクトリのファイルディスクリプタからの相対名で行い、ディレクトリは1回だけ作成すること"""
+    source = tmp_path / "source"
+    source.mkdir()
+    for i in range(3):
+        (source / f"IMG_{i}.JPG").write_text(str(i))
+    renames, mkdirs = [], []
+    real_rename = os.rename
+    monkeypatch.setattr(fs.os, 'rename', lambda *args, **kwargs: renames.append(kwargs) or real_rename(*args, **kwargs))
+    backend = fs.PosixBackend()
+    real_mkdir = backend.mkdir
+    monkeypatch.setattr(backend, 'mkdir', lambda path: mkdirs.append(path) or real_mkdir(path))
+
+    target = tmp_path / "dest" / "2023" / "01"
+    with backend.apply_session() as session:
+        for i in range(2):
+            session.mkdir(target)
+            session.move(source / f"IMG_{i}.JPG", target / f"IMG_{i}.JPG")
+        assert session.rename_noreplace(source / "IMG_2.JPG", source / "IMG_9.JPG") is True
+        (source / "IMG_3.JPG").write_text("3")
+        assert session.rename_noreplace(source / "IMG_3.JPG", source / "IMG_9.JPG") is False
+
+    assert mkdirs == [str(target)]
+    assert all(kwargs['src_dir_fd'] is not None and kwargs['dst_dir_fd'] is not None for kwargs in renames)
+    assert sorted(p.name for p in target.iterdir()) == ["IMG_0.JPG", "IMG_1.JPG"]
+    assert (source / "IMG_9.JPG").read_text() == "2"
+    assert (source / "IMG_3.JPG").exists()
+
+
+def test_apply_session_closes_unused_fds(tmp_path):
+    dirs = [tmp_path / f"d{i}" for i in range(4)]
+    for directory in dirs:
+        directory.mkdir()
+        (directory / "a.jpg").write_text("x")
+    session = fs.PosixApplySession(fs.PosixBackend(), max_open=2)
+    for directory in dirs:
+        session.move(directory / "a.jpg", directory / "b.jpg")
+    assert len(session._fds) == 2
+    session.close()
+    assert not session._fds
+    assert all((directory / "b.jpg").exists() for directory in dirs)
+
+
+def test_organize_creates_each_target_directory_once():
+    report = run_benchmark('organize', files=200, dirs=4, seed=1)
+    assert report['counts']['success'] == 200
+    # 移動先は YYYY/MM の月フォルダごとに1回だけ作成する
+    assert 0 < report['calls']['mkdir'] < 200
+
+
+def test_memory_backend_contents():
+    """内容を指定したファイルはその内容を、指定しないファイルは inode ごとに決まる内容を読めること"""
+    backend = MemoryBackend()
+    backend.add_file('/lib/a.txt', data=b'hello world')
+    backend.add_file('/lib/b.JPG', size=200)
+    backend.add_file('/lib/c.JPG', size=200)
+
+    assert backend.read_ranges('/lib/a.txt', [(0, 5), (6, 100)]) == [b'hello', b'world']
+    content = backend.read_bytes('/lib/b.JPG')
+    assert len(content) == 200
+    assert backend.read_ranges('/lib/b.JPG', [(70, 20), (190, 50)]) == [content[70:90], content[190:]]
+    assert content != backend.read_bytes('/lib/c.JPG')
+
+    backend.write_bytes('/lib/d.json', b'{}')
+    assert backend.stat('/lib/d.json').st_size == 2
+    # 移動・リネームしても内容は変わらない
+    backend.move('/lib/b.JPG', '/lib/e.JPG')
+    backend.rename_noreplace('/lib/d.json', '/lib/f.json')
+    assert backend.read_bytes('/lib/e.JPG') == content
+    assert backend.read_bytes('/lib/f.json') == b'{}'
+    with pytest.raises(FileNotFoundError):
+        backend.write_bytes('/missing/x', b'')
+    assert backend.calls['read'] == 6 and backend.calls['write'] == 2
+
+
+def test_organize_with_dest_index_runs_in_memory():
+    """宛先インデックスを使う organize がメモリ上のファイルシステムで動作すること"""
+    report = run_benchmark('organize', files=50, dirs=2, seed=1, use_dest_index=True)
+    assert report['counts'] == {'success': 50, 'skip': 0, 'error': 0}
+    assert report['calls']['read'] >= 50
+    assert isinstance(fs.get_backend(), fs.PosixBackend)
+
+
+def test_rename_sniff_runs_in_memory():
+    """--sniff の形式判定がメモリ上のファイルシステムから先頭を読むこと"""
+    from unittest.mock import patch, MagicMock
+    from rename_images import iter_rename_results
+    from results import REASON_UNSUPPORTED
+
+    backend = MemoryBackend()
+    backend.add_file('/mem/IMG_1.bin', data=b'\xff\xd8\xff\xe0\x00\x10JFIF' + b'\x00' * 100)
+    backend.add_file('/mem/notes.jpg', data=b'hello')
+    fs.set_backend(backend)
+    try:
+        with patch('subprocess.run') as mock_run:
+            mock_run.return_value = MagicMock(
+                stdout='[{"DateTimeOriginal": "2023:01:02 03:04:05", "Model": "Cam"}]', stderr="", returncode=0
+            )
+            results = {r.source.name: r for r in iter_rename_results('/mem', dry_run=True, sniff=True)}
+    finally:
+        fs.set_backend(None)
+
+    assert results['IMG_1.bin'].target.name == '20230102_0001_Cam.bin'
+    assert results['notes.jpg'].reason == REASON_UNSUPPORTED
+    assert backend.calls['read'] == 2
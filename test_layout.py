@@ -0,0 +1,111 @@
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from dest_index import DestinationIndex
+from layout import LayoutPolicy, bucket_name, read_layout_marker, LAYOUT_MARKER
+from organize_files import organize_files
+from rebalance import rebalance_layout
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+def test_organize_splits_month_over_threshold(mock_exiftool, tmp_path):
+    """月フォルダのエントリ数が閾値を超えると、以降は日ごとのサブフォルダに配置すること"""
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    for i in range(4):
+        (source / f"IMG_{i}.JPG").write_bytes(bytes([i]))
+
+    organize_files(str(source), str(dest), dry_run=False, sort=True, split_threshold=2)
+
+    month = dest / "2023" / "06"
+    assert sorted(p.name for p in month.iterdir() if p.is_file() and p.name != LAYOUT_MARKER) == ["IMG_0.JPG", "IMG_1.JPG"]
+    assert sorted(p.name for p in (month / "15").iterdir()) == ["IMG_2.JPG", "IMG_3.JPG"]
+    assert read_layout_marker(month) == ('day', 16)
+
+
+def test_split_month_is_kept_without_threshold(tmp_path):
+    """分割済みの月フォルダには、閾値を指定しなくても記録された方法で配置すること"""
+    from datetime import datetime
+    month = tmp_path / "2023" / "06"
+    LayoutPolicy(tmp_path, split_threshold=1, split_mode='hash', buckets=4).split(month)
+
+    target = LayoutPolicy(tmp_path).target_dir(datetime(2023, 6, 1), "IMG_1.JPG")
+    assert target == month / bucket_name("IMG_1.JPG", 4)
+    assert len(bucket_name("IMG_1.JPG", 256)) == 2
+
+
+def test_rebalance_moves_flat_files_into_buckets(tmp_path):
+    """再配置で閾値を超えた月フォルダのファイルをサブフォルダに移し、インデックスも更新すること"""
+    month = tmp_path / "2023" / "06"
+    month.mkdir(parents=True)
+    small = tmp_path / "2023" / "07"
+    small.mkdir()
+    for i in range(3):
+        (month / f"IMG_{i}.JPG").write_bytes(bytes([i]))
+    (small / "IMG_9.JPG").write_bytes(b"x")
+    index = DestinationIndex(tmp_path)
+    index.rebuild(1)
+    index.close()
+
+    counts = rebalance_layout(str(tmp_path), split_threshold=2, split_mode='hash', split_buckets=4, quiet=True)
+
+    assert counts == {'success': 3, 'skip': 0, 'error': 0}
+    assert not any(p.is_file() and p.name != LAYOUT_MARKER for p in month.iterdir())
+    for i in range(3):
+        assert (month / bucket_name(f"IMG_{i}.JPG", 4) / f"IMG_{i}.JPG").exists()
+    assert (small / "IMG_9.JPG").exists()
+    assert read_layout_marker(small) is None
+
+    index = DestinationIndex(tmp_path)
+    existing, _ = index.lookup(month / bucket_name("IMG_0.JPG", 4) / "IMG_0.JPG", 1)
+    assert existing == month / bucket_name("IMG_0.JPG", 4) / "IMG_0.JPG"
+    index.close()
+
+
+def test_rebalance_dry_run_changes_nothing(tmp_path):
+    month = tmp_path / "2023" / "06"
+    month.mkdir(parents=True)
+    for i in range(3):
+        (month / f"IMG_{i}.JPG").write_bytes(bytes([i]))
+
+    counts = rebalance_layout(str(tmp_path), split_threshold=2, split_mode='hash', dry_run=True, quiet=True)
+
+    assert counts['success'] == 3
+    assert sorted(p.name for p in month.iterdir()) == ["IMG_0.JPG", "IMG_1.JPG", "IMG_2.JPG"]
+
+
+def test_rebalance_runs_in_memory():
+    """再配置と分割の記録がメモリ上のファイルシステムだけで動作すること"""
+    import fs
+    from pathlib import Path
+
+    backend = fs.MemoryBackend()
+    for i in range(3):
+        backend.add_file(f"/dest/2023/06/IMG_{i}.JPG", size=10)
+    backend.add_file("/dest/2023/07/IMG_9.JPG", size=10)
+    fs.set_backend(backend)
+    try:
+        counts = rebalance_layout("/dest", split_threshold=2, split_mode='hash', split_buckets=4, quiet=True)
+        assert read_layout_marker(Path("/dest/2023/06")) == ('hash', 4)
+    finally:
+        fs.set_backend(None)
+
+    assert counts == {'success': 3, 'skip': 0, 'error': 0}
+    assert Path(f"/dest/2023/06/{LAYOUT_MARKER}") in backend.files()
+    for i in range(3):
+        assert Path(f"/dest/2023/06/{bucket_name(f'IMG_{i}.JPG', 4)}/IMG_{i}.JPG") in backend.files()
+    assert backend.calls['write'] == 1
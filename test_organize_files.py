@@ -254,3 +254,53 @@ def test_organize_quiet_mode(mock_subprocess_run):
     expected_path = DEST_DIR / "2023" / "06" / "IMG_1234.JPG"
     assert expected_path.exists()
     assert not original_path.exists()
+
+
+@patch('subprocess.run')
+def test_organize_multiple_sources(mock_subprocess_run, tmp_path):
+    """複数ソースを交互に処理し、ソースごとの件数を集計すること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+        stderr="",
+        returncode=0
+    )
+    big = tmp_path / "big"
+    small = tmp_path / "small"
+    big.mkdir()
+    small.mkdir()
+    for i in range(10):
+        (big / f"BIG_{i}.JPG").write_bytes(b"x")
+    (small / "SMALL_0.JPG").write_bytes(b"x")
+    (small / "IMG_1.JPG").write_bytes(b"x")
+    (big / "IMG_1.JPG").write_bytes(b"y")
+
+    from organize_files import organize_run
+    run = organize_run([str(big), (str(small), 1)], str(DEST_DIR), sort=True)
+    results = list(run)
+
+    # small のファイルは big の処理を待たずに先頭付近で処理される
+    order = [r.source_root for r in results]
+    assert order[:4] == [big, small, big, small]
+    assert run.summary.per_source == {
+        str(big): {'success': 11, 'skip': 0, 'error': 0},
+        str(small): {'success': 2, 'skip': 0, 'error': 0},
+    }
+    # ソース間で同じファイル名でも上書きしない
+    assert (DEST_DIR / "2023" / "06" / "IMG_1.JPG").exists()
+    assert (DEST_DIR / "2023" / "06" / "IMG_1_0001.JPG").exists()
+
+
+def test_load_manifest(tmp_path):
+    from organize_files import load_manifest
+    manifest = tmp_path / "sources.txt"
+    manifest.write_text("# 取り込み元\n/data/alice\t2\n\n/data/bob\n", encoding='utf-8')
+    assert load_manifest(manifest) == [("/data/alice", 2.0), ("/data/bob", 1.0)]
+
+    manifest.write_text("/data/alice\theavy\n", encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_manifest(manifest)
+
+
+def test_organize_rejects_missing_source(tmp_path):
+    from organize_files import organize_files
+    assert organize_files([str(SOURCE_DIR), str(tmp_path / "missing")], str(DEST_DIR), dry_run=True, quiet=True) is None
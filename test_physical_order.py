@@ -0,0 +1,64 @@
+import pytest
+
+import fs
+from fs import MemoryBackend
+from benchmark import run_benchmark
+from physical_order import imap_physical, physical_order, READ_ORDER_NAME, READ_ORDER_INODE, READ_ORDER_EXTENT
+
+
+@pytest.fixture
+def backend():
+    # ファイル名の順とは逆の順に作成し、ディスク上の位置が名前の逆順になるようにする
+    backend = MemoryBackend()
+    for i in reversed(range(10)):
+        backend.add_file(f'/lib/IMG_{i}.JPG', size=100)
+    backend.calls.clear()
+    fs.set_backend(backend)
+    yield backend
+    fs.set_backend(None)
+
+
+def test_imap_physical_reads_in_disk_order_and_returns_in_input_order(backend):
+    paths = [f'/lib/IMG_{i}.JPG' for i in range(10)]
+    read = []
+
+    def func(path):
+        read.append(path)
+        return path.upper()
+
+    results = list(imap_physical(func, paths, max_workers=1, read_order=READ_ORDER_INODE, window=4))
+    assert results == [path.upper() for path in paths]
+    # 4件ずつの区切りの中では位置の順 (名前の逆順) に読む
+    assert read == paths[3::-1] + paths[7:3:-1] + paths[:7:-1]
+    # すべてのファイルの先頭の先読みを依頼している
+    assert backend.calls['advise'] == 10
+
+
+def test_physical_order_by_extent_with_threads(backend):
+    paths = [f'/lib/IMG_{i}.JPG' for i in range(10)]
+    assert list(physical_order(paths, READ_ORDER_EXTENT, window=100)) == paths[::-1]
+    results = list(imap_physical(lambda path: path, paths + ['/lib/missing.JPG'], 4, READ_ORDER_EXTENT, window=3))
+    assert results == paths + ['/lib/missing.JPG']
+
+
+def test_name_order_does_not_touch_filesystem(backend):
+    paths = [f'/lib/IMG_{i}.JPG' for i in range(10)]
+    assert list(imap_physical(lambda path: path, paths, 2, READ_ORDER_NAME)) == paths
+    assert not backend.calls
+
+
+def test_posix_physical_position(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"a" * 8192)
+    backend = fs.PosixBackend()
+    device, inode = backend.physical_position(tmp_path / "a.jpg")
+    assert (device, inode) == (tmp_path.stat().st_dev, (tmp_path / "a.jpg").stat().st_ino)
+    # FIEMAP に対応しないファイルシステムでは inode 番号になる
+    assert backend.physical_position(tmp_path / "a.jpg", by_extent=True)[0] == device
+    backend.advise_willneed(tmp_path / "a.jpg", 4096)
+
+
+def test_benchmark_shows_seek_reduction():
+    by_name = run_benchmark('rename', files=400, dirs=4, seed=1)
+    by_inode = run_benchmark('rename', files=400, dirs=4, seed=1, read_order=READ_ORDER_INODE)
+    assert by_inode['counts'] == by_name['counts']
+    assert by_inode['seek_mb'] * 5 < by_name['seek_mb']
@@ -0,0 +1,134 @@
+import json
+import multiprocessing
+import os
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import api
+from plan import PLAN_FILENAME
+from rename_images import NameIndexCache
+
+DATES = {
+    "IMG_2.JPG": "2023:01:01 10:00:00",
+    "IMG_4.JPG": "2023:01:01 11:00:00",
+    "IMG_1.JPG": "2023:01:01 09:00:00",
+    "IMG_3.JPG": "2023:01:01 09:30:00",
+    "notes.txt": None,
+}
+
+
+def mock_exiftool(command, **kwargs):
+    date = DATES.get(command[-1].rsplit('/', 1)[-1])
+    metadata = {"DateTimeOriginal": date, "Model": "Cam"} if date else {}
+    return MagicMock(stdout=json.dumps([metadata]), stderr="", returncode=0)
+
+
+@pytest.fixture
+def library(tmp_path):
+    for name in ("IMG_2.JPG", "IMG_4.JPG", "notes.txt"):
+        (tmp_path / name).write_text(name)
+    return tmp_path
+
+
+def deltas(results) -> dict:
+    return {r.source.name: r.delta for r in results}
+
+
+@patch('subprocess.run', side_effect=mock_exiftool)
+def test_rename_reports_only_delta_and_reuses_metadata(mock_run, library):
+    plan_file = str(library / PLAN_FILENAME)
+    first = list(api.rename(str(library), dry_run=True, plan_file=plan_file))
+    assert set(deltas(first).values()) == {api.DELTA_NEW}
+    assert mock_run.call_count == 2
+
+    # 変わっていないファイルはEXIFを読み直さない
+    mock_run.reset_mock()
+    assert set(deltas(api.rename(str(library), dry_run=True, plan_file=plan_file)).values()) == {api.DELTA_UNCHANGED}
+    mock_run.assert_not_called()
+
+    # 新しいファイルが名前順で前に入ると、後ろのファイルの連番がずれる
+    mock_run.reset_mock()
+    (library / "IMG_1.JPG").write_text("IMG_1.JPG")
+    (library / "IMG_4.JPG").write_text("changed content")
+    second = list(api.rename(str(library), dry_run=True, plan_file=plan_file))
+    assert mock_run.call_count == 2
+    assert deltas(second) == {
+        "IMG_1.JPG": api.DELTA_NEW,
+        "IMG_2.JPG": api.DELTA_RETARGETED,
+        "IMG_4.JPG": api.DELTA_CHANGED,
+        "notes.txt": api.DELTA_UNCHANGED,
+    }
+    assert {r.source.name: r.target.name for r in second if r.target} == {
+        "IMG_1.JPG": "20230101_0001_Cam.jpg",
+        "IMG_2.JPG": "20230101_0002_Cam.jpg",
+        "IMG_4.JPG": "20230101_0003_Cam.jpg",
+    }
+
+
+@patch('subprocess.run', side_effect=mock_exiftool)
+def test_applied_renames_are_not_reported_as_new(mock_run, library):
+    plan_file = str(library.parent / "plan.sqlite")
+    run = api.rename(str(library), plan_file=plan_file)
+    assert run.run_to_completion().counts['success'] == 2
+
+    results = list(api.rename(str(library), dry_run=True, plan_file=plan_file))
+    assert {r.source.name for r in results} == {"20230101_0001_Cam.jpg", "20230101_0002_Cam.jpg", "notes.txt"}
+    assert set(deltas(results).values()) == {api.DELTA_UNCHANGED}
+
+
+@patch('subprocess.run', side_effect=mock_exiftool)
+def test_organize_reuses_plan_metadata(mock_run, tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    for name in ("IMG_1.JPG", "IMG_3.JPG"):
+        (source / name).write_text(name)
+    plan_file = str(tmp_path / PLAN_FILENAME)
+
+    first = api.organize(str(source), str(dest), dry_run=True, plan_file=plan_file)
+    assert first.run_to_completion().deltas == {api.DELTA_NEW: 2}
+    mock_run.reset_mock()
+    # 更新日時だけ変わったファイルは読み直す
+    os.utime(source / "IMG_3.JPG", ns=(0, 0))
+    second = list(api.organize(str(source), str(dest), dry_run=True, plan_file=plan_file))
+    assert mock_run.call_count == 1
+    assert deltas(second) == {"IMG_1.JPG": api.DELTA_UNCHANGED, "IMG_3.JPG": api.DELTA_CHANGED}
+    assert all(r.target.parent == dest / "2023" / "01" for r in second)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="モックを子プロセスへ引き継ぐには fork が必要")
+@patch('subprocess.run', side_effect=mock_exiftool)
+def test_plan_with_processes(mock_run, tmp_path):
+    """プロセス並列でも計画を保存し、変わっていないファイルはワーカーでもEXIFを読み直さないこと"""
+    for day in ("a", "b"):
+        (tmp_path / day).mkdir()
+        for name in ("IMG_2.JPG", "IMG_4.JPG"):
+            (tmp_path / day / name).write_text(day + name)
+    plan_file = str(tmp_path / PLAN_FILENAME)
+    options = dict(recursive=True, dry_run=True, processes=2, plan_file=plan_file)
+
+    first = list(api.rename(str(tmp_path), **options))
+    assert [r.delta for r in first] == [api.DELTA_NEW] * 4
+
+    (tmp_path / "b" / "IMG_4.JPG").write_text("changed content")
+    second = list(api.rename(str(tmp_path), **options))
+    assert [(r.source.parent.name, r.source.name, r.delta) for r in second] == [
+        ("a", "IMG_2.JPG", api.DELTA_UNCHANGED), ("a", "IMG_4.JPG", api.DELTA_UNCHANGED),
+        ("b", "IMG_2.JPG", api.DELTA_UNCHANGED), ("b", "IMG_4.JPG", api.DELTA_CHANGED),
+    ]
+    # 計画の保存したEXIFで名前を決められること (読み直さなかったファイルも同じ名前になる)
+    assert [r.target for r in second] == [r.target for r in first]
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="モックを子プロセスへ引き継ぐには fork が必要")
+@patch('subprocess.run', side_effect=mock_exiftool)
+def test_name_cache_with_processes(mock_run, tmp_path):
+    """プロセス並列でもワーカーで更新したファイル名一覧を親プロセスのキャッシュに取り込むこと"""
+    for day in ("a", "b"):
+        (tmp_path / day).mkdir()
+        (tmp_path / day / "IMG_2.JPG").write_text(day)
+    name_cache = NameIndexCache()
+    list(api.rename(str(tmp_path), recursive=True, processes=2, name_cache=name_cache))
+    assert name_cache.entries()[tmp_path / "a"][1] == {"20230101_0001_Cam.jpg"}
+    assert set(name_cache.entries()) == {tmp_path / "a", tmp_path / "b"}
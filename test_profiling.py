@@ -0,0 +1,85 @@
+import json
+import os
+import pstats
+import time
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from profiling import Profiler, PROFILER_SAMPLING, PROFILER_CPROFILE, PROFILE_ENV
+from organize_files import organize_files
+from rename_images import rename_image_files
+
+
+def exiftool_result(*args, **kwargs):
+    return MagicMock(stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00"}]), stderr="", returncode=0)
+
+
+def slow_exiftool(*args, **kwargs):
+    # サンプリングで確実に捉えられるよう、ExifToolの実行時間を再現する
+    time.sleep(0.02)
+    return exiftool_result()
+
+
+def read_collapsed(path: Path) -> dict:
+    stacks = {}
+    for line in path.read_text(encoding='utf-8').splitlines():
+        stack, count = line.rsplit(' ', 1)
+        stacks[stack] = int(count)
+    return stacks
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source"
+    path.mkdir()
+    for i in range(6):
+        (path / f"IMG_{i}.jpg").write_text("dummy")
+    (tmp_path / "dest").mkdir()
+    return path
+
+
+@pytest.mark.parametrize('mode', [PROFILER_SAMPLING, PROFILER_CPROFILE])
+def test_profile_writes_pstats_and_collapsed_stacks(tmp_path, source, mode):
+    prefix = tmp_path / "organize"
+    with patch('subprocess.run', side_effect=slow_exiftool):
+        with Profiler(prefix, mode):
+            organize_files(str(source), str(tmp_path / "dest"), dry_run=True, quiet=True, max_concurrency=2)
+
+    stats = pstats.Stats(str(prefix) + '.pstats')
+    functions = {name for _, _, name in stats.stats}
+    assert '_organize_one' in functions
+
+    stacks = read_collapsed(Path(str(prefix) + '.collapsed'))
+    assert stacks and all(count > 0 for count in stacks.values())
+    # ワーカースレッドのスタックはスレッド名で区別される
+    roots = {tuple(stack.split(';')[:2]) for stack in stacks}
+    assert ('MainProcess', 'MainThread') in roots
+    assert any(thread.startswith('lane-default') for _, thread in roots)
+    assert any('organize_files.py:_organize_one' in stack for stack in stacks)
+    assert PROFILE_ENV not in os.environ
+
+
+def test_profile_attributes_worker_processes(tmp_path):
+    directory = tmp_path / "photos"
+    for sub in ("a", "b"):
+        (directory / sub).mkdir(parents=True)
+        for i in range(3):
+            (directory / sub / f"IMG_{i}.jpg").write_text("dummy")
+    prefix = tmp_path / "rename"
+
+    with patch('subprocess.run', side_effect=slow_exiftool):
+        with Profiler(prefix, PROFILER_SAMPLING):
+            rename_image_files(str(directory), dry_run=True, recursive=True, quiet=True, processes=2)
+
+    worker_files = list(tmp_path.glob("rename.*.collapsed"))
+    assert worker_files
+    for path in worker_files:
+        stacks = read_collapsed(path)
+        assert all(not stack.startswith('MainProcess;') for stack in stacks)
+
+
+def test_profile_rejects_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Profiler(tmp_path / "x", 'perf')
@@ -1,6 +1,9 @@
 import json
+import logging
+import multiprocessing
 import os
 import shutil
+import tempfile
 from pathlib import Path
 from datetime import datetime
 from PIL import Image
@@ -242,3 +245,198 @@ def test_quiet_mode(mock_subprocess_run):
     expected_name = TEST_DIR / "20230101_0001_TestApp.jpg"
     assert expected_name.exists()
     assert not original_path.exists()
+
+
+def test_rename_worker_does_not_share_exiftool_pool(monkeypatch):
+    """ワーカープロセスは fork で引き継いだ親プロセスのExifToolプールを使わないこと"""
+    import utils
+    from rename_images import _init_rename_worker
+    monkeypatch.setattr(utils, '_exiftool_pool', MagicMock())
+    root = logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', [])
+    monkeypatch.setattr(root, 'level', root.level)
+    _init_rename_worker(1, 1, 10.0, None)
+    assert utils._exiftool_pool is None
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="モックを子プロセスへ引き継ぐには fork が必要")
+@patch('subprocess.run')
+def test_rename_recursive_with_processes(mock_subprocess_run, caplog):
+    """ディレクトリ単位のプロセス並列でも、ディレクトリごとに連番が振られログが順序通りにまとまること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+        stderr="",
+        returncode=0
+    )
+    for d in range(4):
+        sub = TEST_DIR / f"day{d}"
+        sub.mkdir()
+        for i in range(3):
+            (sub / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    from rename_images import rename_image_files
+    with caplog.at_level(logging.INFO):
+        rename_image_files(str(TEST_DIR), recursive=True, quiet=True, processes=2)
+
+    for d in range(4):
+        names = sorted(p.name for p in (TEST_DIR / f"day{d}").iterdir())
+        assert names == [f"20230101_{i:04d}_Cam.jpg" for i in range(1, 4)]
+
+    renamed = [r.getMessage() for r in caplog.records if r.getMessage().startswith("リネーム:")]
+    assert [m.split("'")[1] for m in renamed] == [f"IMG_{i}.JPG" for _ in range(4) for i in range(3)]
+    assert "結果サマリー: 成功 12件, スキップ 0件, エラー 0件" in caplog.text
+
+
+@patch('subprocess.run')
+def test_rename_dry_run_previews_distinct_sequence(mock_subprocess_run, caplog):
+    """dry-runでも、実際に実行した場合と同じ連番がプレビューされること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+        stderr="",
+        returncode=0
+    )
+    (TEST_DIR / "IMG_1.JPG").write_bytes(b"x")
+    (TEST_DIR / "IMG_2.JPG").write_bytes(b"x")
+
+    from rename_images import rename_image_files
+    with caplog.at_level(logging.INFO):
+        rename_image_files(str(TEST_DIR), dry_run=True, quiet=True)
+    messages = [r.getMessage() for r in caplog.records]
+    assert any("20230101_0001_Cam.jpg" in m for m in messages)
+    assert any("20230101_0002_Cam.jpg" in m for m in messages)
+    assert (TEST_DIR / "IMG_1.JPG").exists()
+
+
+CAPTURE_METADATA = {
+    "A.JPG": {"DateTimeOriginal": "2023:01:01 10:05:00", "Model": "Cam1"},
+    "B.JPG": {"DateTimeOriginal": "2023:01:01 10:01:00", "Model": "Cam1"},
+    "C.JPG": {"DateTimeOriginal": "2023:01:01 10:03:00", "Model": "Cam2"},
+    "D.JPG": {"DateTimeOriginal": "2023:01:01 10:02:00", "Model": "Cam1"},
+    "E.JPG": {"Model": "Cam1"},
+}
+
+
+def capture_exiftool(command, **kwargs):
+    name = Path(command[-1]).name
+    return MagicMock(stdout=json.dumps([CAPTURE_METADATA[name]]), stderr="", returncode=0)
+
+
+@pytest.mark.parametrize('sort_buffer', [100, 1])
+@patch('subprocess.run', side_effect=capture_exiftool)
+def test_rename_capture_order(mock_subprocess_run, sort_buffer):
+    """--order capture では、日付・デバイスごとに撮影日時順で連番を振ること (一時ファイルを使う場合も同じ)"""
+    for name in CAPTURE_METADATA:
+        (TEST_DIR / name).write_text(name)
+
+    from rename_images import rename_image_files, ORDER_CAPTURE
+    counts = rename_image_files(str(TEST_DIR), quiet=True, order=ORDER_CAPTURE, sort_buffer=sort_buffer,
+                                max_concurrency=2)
+
+    assert counts == {'success': 4, 'skip': 1, 'error': 0}
+    renamed = {p.name: p.read_text() for p in TEST_DIR.iterdir()}
+    assert renamed == {
+        "20230101_0001_Cam1.jpg": "B.JPG",
+        "20230101_0002_Cam1.jpg": "D.JPG",
+        "20230101_0003_Cam1.jpg": "A.JPG",
+        "20230101_0001_Cam2.jpg": "C.JPG",
+        "E.JPG": "E.JPG",
+    }
+    assert not list(Path(tempfile.gettempdir()).glob('image_renamer_sort_*'))
+
+
+RENUMBER_METADATA = {
+    # 撮影日時順では 0001 と 0002 が入れ替わる
+    "20230101_0001_Cam.jpg": {"DateTimeOriginal": "2023:01:01 10:02:00", "Model": "Cam"},
+    "20230101_0002_Cam.jpg": {"DateTimeOriginal": "2023:01:01 10:01:00", "Model": "Cam"},
+    # 既に最終的な名前
+    "20230101_0003_Cam.jpg": {"DateTimeOriginal": "2023:01:01 10:03:00", "Model": "Cam"},
+    # 前回の実行でずれた番号
+    "20230101_0007_Cam.jpg": {"DateTimeOriginal": "2023:01:01 10:05:00", "Model": "Cam"},
+    "IMG_9.JPG": {"DateTimeOriginal": "2023:01:01 10:04:00", "Model": "Cam"},
+    # 撮影日時が無いファイルは対象外で、名前もそのまま使い続ける
+    "20230101_0005_Cam.jpg": {"Model": "Cam"},
+}
+
+
+def renumber_exiftool(command, **kwargs):
+    return MagicMock(stdout=json.dumps([RENUMBER_METADATA[Path(command[-1]).name]]), stderr="", returncode=0)
+
+
+@patch('subprocess.run', side_effect=renumber_exiftool)
+def test_renumber_resolves_swaps_and_keeps_final_names(mock_subprocess_run):
+    """--renumber は最終的な名前を先に決め、入れ替えを一時的な名前で解消し、正しい名前のファイルは動かさないこと"""
+    for name in RENUMBER_METADATA:
+        (TEST_DIR / name).write_text(name)
+
+    import api
+    from rename_images import ORDER_CAPTURE
+    results = {r.source.name: r for r in api.rename(str(TEST_DIR), order=ORDER_CAPTURE, renumber=True)}
+
+    assert {p.name: p.read_text() for p in TEST_DIR.iterdir()} == {
+        "20230101_0001_Cam.jpg": "20230101_0002_Cam.jpg",
+        "20230101_0002_Cam.jpg": "20230101_0001_Cam.jpg",
+        "20230101_0003_Cam.jpg": "20230101_0003_Cam.jpg",
+        "20230101_0004_Cam.jpg": "IMG_9.JPG",
+        "20230101_0005_Cam.jpg": "20230101_0005_Cam.jpg",
+        "20230101_0006_Cam.jpg": "20230101_0007_Cam.jpg",
+    }
+    assert results["20230101_0003_Cam.jpg"].reason == api.REASON_ALREADY_NAMED
+    assert results["20230101_0005_Cam.jpg"].reason == api.REASON_NO_DATETIME
+    assert results["20230101_0007_Cam.jpg"].target == TEST_DIR / "20230101_0006_Cam.jpg"
+    assert [r.action for r in results.values()].count(api.ACTION_RENAME) == 4
+
+
+@patch('subprocess.run', side_effect=renumber_exiftool)
+def test_renumber_dry_run_does_not_touch_files(mock_subprocess_run):
+    for name in RENUMBER_METADATA:
+        (TEST_DIR / name).write_text(name)
+
+    import api
+    results = list(api.rename(str(TEST_DIR), dry_run=True, renumber=True))
+
+    assert sorted(p.name for p in TEST_DIR.iterdir()) == sorted(RENUMBER_METADATA)
+    # ファイル名順では 0001, 0002, 0003 はそのまま、0007 と IMG_9 が空いている番号に入る
+    targets = {r.source.name: r.target.name for r in results if r.action == api.ACTION_RENAME}
+    assert targets == {"20230101_0007_Cam.jpg": "20230101_0004_Cam.jpg", "IMG_9.JPG": "20230101_0006_Cam.jpg"}
+
+
+def test_renumber_failure_in_cycle_restores_names(tmp_path):
+    """入れ替えの循環の途中で失敗しても、一時的な名前のファイルを残さず元の名前に戻すこと"""
+    import fs
+    from rename_images import _renumber_directory
+    times = {"20230101_0001_Cam.jpg": "10:03", "20230101_0002_Cam.jpg": "10:01", "20230101_0003_Cam.jpg": "10:02"}
+    for name in times:
+        (tmp_path / name).write_text(name)
+    items = sorted(
+        ((tmp_path / name, {"DateTimeOriginal": f"2023:01:01 {t}:00", "Model": "Cam"}, 0.0) for name, t in times.items()),
+        key=lambda item: item[1]["DateTimeOriginal"],
+    )
+    real_rename = fs.rename_noreplace
+
+    def deny(src, dst):
+        if Path(src).name == "20230101_0003_Cam.jpg":
+            raise PermissionError(13, "denied")
+        return real_rename(src, dst)
+
+    with patch('fs.rename_noreplace', side_effect=deny):
+        results = list(_renumber_directory(tmp_path, items, False, set(times)))
+
+    assert [r.status for r in results] == ['error'] * 3
+    assert {p.name: p.read_text() for p in tmp_path.iterdir()} == {name: name for name in times}
+
+
+@patch('subprocess.run')
+def test_read_order_does_not_change_sequence(mock_subprocess_run):
+    """EXIFをディスク上の位置の順に読んでも、連番と結果の順序はファイル名順のままであること"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]), stderr="", returncode=0
+    )
+    # 名前の逆順に作成し、inode 番号の順が名前の順と一致しないようにする
+    for i in reversed(range(6)):
+        (TEST_DIR / f"IMG_{i}.JPG").write_text(str(i))
+
+    import api
+    results = list(api.rename(str(TEST_DIR), read_order=api.READ_ORDER_EXTENT, max_concurrency=3))
+
+    assert [r.source.name for r in results] == [f"IMG_{i}.JPG" for i in range(6)]
+    assert {p.name: p.read_text() for p in TEST_DIR.iterdir()} == {f"20230101_{i + 1:04d}_Cam.jpg": str(i) for i in range(6)}
@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+from sequence import SequenceReservations, rename_noreplace, LOCK_FILENAME
+
+
+def test_rename_noreplace(tmp_path):
+    src = tmp_path / "a.jpg"
+    dst = tmp_path / "b.jpg"
+    src.write_bytes(b"a")
+    dst.write_bytes(b"b")
+
+    # 移動先が存在する場合は上書きしない
+    assert rename_noreplace(src, dst) is False
+    assert src.read_bytes() == b"a"
+    assert dst.read_bytes() == b"b"
+
+    new_dst = tmp_path / "c.jpg"
+    assert rename_noreplace(src, new_dst) is True
+    assert not src.exists()
+    assert new_dst.read_bytes() == b"a"
+
+
+def test_reservations_do_not_overlap_between_owners(tmp_path):
+    """同じディレクトリ・同じキーでも、プロセスごとに異なる連番が払い出されること"""
+    first = SequenceReservations(batch_size=4, owner="first")
+    second = SequenceReservations(batch_size=4, owner="second")
+
+    counters_first = []
+    counters_second = []
+    for _ in range(6):
+        counters_first.append(first.next_counter(tmp_path, "20230101_Cam.jpg"))
+        counters_second.append(second.next_counter(tmp_path, "20230101_Cam.jpg"))
+
+    assert counters_first == [1, 2, 3, 4, 9, 10]
+    assert counters_second == [5, 6, 7, 8, 13, 14]
+    assert not set(counters_first) & set(counters_second)
+
+
+def test_release_all_frees_reservations(tmp_path):
+    first = SequenceReservations(batch_size=4, owner="first")
+    first.next_counter(tmp_path, "key")
+    first.release_all()
+
+    state = json.loads((tmp_path / LOCK_FILENAME).read_text())
+    assert state['reservations'] == []
+
+    # 解放後は別のプロセスが先頭から使える
+    second = SequenceReservations(batch_size=4, owner="second")
+    assert second.next_counter(tmp_path, "key") == 1
+
+
+def test_get_next_filename_with_reservations_skips_existing(tmp_path):
+    from rename_images import get_next_filename
+    (tmp_path / "20230101_0001_Cam.jpg").write_bytes(b"x")
+    reservations = SequenceReservations(batch_size=2, owner="me")
+
+    first = get_next_filename(tmp_path, "20230101", "Cam", ".jpg", reservations)
+    first.write_bytes(b"y")
+    second = get_next_filename(tmp_path, "20230101", "Cam", ".jpg", reservations)
+    assert first.name == "20230101_0002_Cam.jpg"
+    assert second.name == "20230101_0003_Cam.jpg"
+
+
+@patch('subprocess.run')
+def test_rename_with_lock(mock_subprocess_run, tmp_path):
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+        stderr="",
+        returncode=0
+    )
+    for i in range(3):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    from rename_images import rename_image_files
+    rename_image_files(str(tmp_path), quiet=True, lock=True, reserve_batch=2)
+
+    names = sorted(p.name for p in tmp_path.iterdir() if not p.name.startswith('.'))
+    assert names == ["20230101_0001_Cam.jpg", "20230101_0002_Cam.jpg", "20230101_0003_Cam.jpg"]
+    state = json.loads((tmp_path / LOCK_FILENAME).read_text())
+    assert state['reservations'] == []
+
+
+@patch('subprocess.run')
+def test_rename_does_not_overwrite_concurrently_created_file(mock_subprocess_run, tmp_path):
+    """名前を決めてからリネームするまでの間に他プロセスが同じ名前を作っても上書きしないこと"""
+    mock_subprocess_run.return_value = MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+        stderr="",
+        returncode=0
+    )
+    (tmp_path / "IMG_0.JPG").write_bytes(b"mine")
+
+    import rename_images
+    original = rename_images.get_next_filename
+    calls = []
+
+    def racing_get_next_filename(*args, **kwargs):
+        path = original(*args, **kwargs)
+        if not calls:
+            path.write_bytes(b"theirs")
+        calls.append(path)
+        return path
+
+    with patch.object(rename_images, 'get_next_filename', racing_get_next_filename):
+        rename_images.rename_image_files(str(tmp_path), quiet=True)
+
+    assert (tmp_path / "20230101_0001_Cam.jpg").read_bytes() == b"theirs"
+    assert (tmp_path / "20230101_0002_Cam.jpg").read_bytes() == b"mine"
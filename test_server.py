@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from server import JobManager, create_server
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+@pytest.fixture
+def running_server():
+    manager = JobManager(max_jobs=2)
+    server = create_server(manager, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield base_url, server
+    server.shutdown()
+    server.server_close()
+    manager.shutdown()
+
+
+def request(url, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, method='POST' if data is not None else 'GET')
+    try:
+        with urllib.request.urlopen(req) as res:
+            return res.status, json.loads(res.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def wait_for_job(base_url, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, job = request(f"{base_url}/jobs/{job_id}")
+        if job['status'] in ('succeeded', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("ジョブが時間内に完了しませんでした")
+
+
+def test_rename_job_over_http(mock_exiftool, running_server, tmp_path):
+    base_url, _ = running_server
+    (tmp_path / "IMG_1.JPG").write_bytes(b"x")
+    (tmp_path / "IMG_2.JPG").write_bytes(b"x")
+
+    status, job = request(f"{base_url}/jobs", {"command": "rename", "params": {"directory": str(tmp_path)}})
+    assert status == 202
+
+    finished = wait_for_job(base_url, job['id'])
+    assert finished['status'] == 'succeeded'
+    assert finished['progress'] == {'processed': 2, 'total': 2}
+
+    status, result = request(f"{base_url}/jobs/{job['id']}/result")
+    assert status == 200
+    assert result['result']['counts'] == {'success': 2, 'skip': 0, 'error': 0}
+    assert result['result']['cancelled'] is False
+    assert (tmp_path / "20230101_0002_Cam.jpg").exists()
+
+
+def test_organize_job_over_http(mock_exiftool, running_server, tmp_path):
+    base_url, _ = running_server
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    (source / "IMG_1.JPG").write_bytes(b"x")
+
+    status, job = request(f"{base_url}/jobs", {
+        "command": "organize",
+        "params": {"source_dir": str(source), "dest_dir": str(dest), "dry_run": False, "use_dest_index": True},
+    })
+    assert status == 202
+    assert wait_for_job(base_url, job['id'])['status'] == 'succeeded'
+    assert (dest / "2023" / "01" / "IMG_1.JPG").exists()
+
+
+def test_budgeted_job_over_http(mock_exiftool, running_server, tmp_path):
+    """予算 (max_files) を指定したジョブを受け付け、予算に達した時点で打ち切ること"""
+    base_url, _ = running_server
+    for i in range(3):
+        (tmp_path / f"IMG_{i}.JPG").write_bytes(b"x")
+
+    status, job = request(f"{base_url}/jobs", {
+        "command": "rename", "params": {"directory": str(tmp_path), "dry_run": True, "max_files": 1},
+    })
+    assert status == 202
+    finished = wait_for_job(base_url, job['id'])
+    assert finished['status'] == 'succeeded'
+    assert finished['progress']['processed'] == 1
+
+    (tmp_path / "dest").mkdir()
+    status, body = request(f"{base_url}/jobs", {
+        "command": "organize",
+        "params": {"source_dir": str(tmp_path), "dest_dir": str(tmp_path / "dest"), "dry_run": True, "max_seconds": 60},
+    })
+    assert status == 202
+    assert wait_for_job(base_url, body['id'])['status'] == 'succeeded'
+
+
+def test_invalid_jobs_are_rejected(running_server):
+    base_url, _ = running_server
+    status, body = request(f"{base_url}/jobs", {"command": "delete", "params": {}})
+    assert status == 400
+    status, body = request(f"{base_url}/jobs", {"command": "rename", "params": {"directory": "/tmp", "quiet": False}})
+    assert status == 400
+    status, body = request(f"{base_url}/jobs", {"command": "rename", "params": {}})
+    assert status == 400
+    status, body = request(f"{base_url}/jobs/unknown")
+    assert status == 404
+
+
+def test_shutdown_waits_for_running_jobs(mock_exiftool, tmp_path):
+    manager = JobManager(max_jobs=1)
+    (tmp_path / "IMG_1.JPG").write_bytes(b"x")
+    job = manager.submit('rename', {'directory': str(tmp_path)})
+    manager.shutdown()
+    assert job.status == 'succeeded'
+    with pytest.raises(RuntimeError):
+        manager.submit('rename', {'directory': str(tmp_path)})
+
+
+def test_cancel_job(mock_exiftool, running_server, tmp_path):
+    """POST /jobs/<id>/cancel で、実行待ちのジョブは実行されずに中断されること"""
+    base_url, _ = running_server
+    release = threading.Event()
+    mock_exiftool.side_effect = lambda *args, **kwargs: release.wait(5) and MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]), stderr="", returncode=0)
+    for i in range(3):
+        directory = tmp_path / f"dir{i}"
+        directory.mkdir()
+        (directory / "IMG_1.JPG").write_bytes(b"x")
+
+    # max_jobs=2 のため、3件目は実行待ちになる
+    jobs = [request(f"{base_url}/jobs", {"command": "rename", "params": {"directory": str(tmp_path / f"dir{i}")}})[1]
+            for i in range(3)]
+    status, body = request(f"{base_url}/jobs/{jobs[2]['id']}/cancel", {})
+    assert status == 202
+    release.set()
+
+    assert wait_for_job(base_url, jobs[0]['id'])['status'] == 'succeeded'
+    assert wait_for_job(base_url, jobs[2]['id'])['status'] == 'cancelled'
+    assert (tmp_path / "dir2" / "IMG_1.JPG").exists()
+    status, _ = request(f"{base_url}/jobs/unknown/cancel", {})
+    assert status == 404
+
+
+def test_exiftool_pool_caches_metadata(tmp_path):
+    """同じファイル（サイズ・更新日時が同じ）はセッションに問い合わせずキャッシュから返すこと"""
+    import exiftool_session
+    queries = []
+
+    class FakeSession:
+        alive = True
+        deadline = None
+        timed_out = False
+
+        def query(self, file_path, timeout=None):
+            queries.append(file_path)
+            return {"DateTimeOriginal": "2023:01:01 10:00:00"}
+
+        def close(self):
+            pass
+
+    target = tmp_path / "IMG_1.JPG"
+    target.write_bytes(b"x")
+    with patch.object(exiftool_session, 'ExifToolSession', FakeSession):
+        pool = exiftool_session.ExifToolPool(size=1)
+        assert pool.get(target)["DateTimeOriginal"] == "2023:01:01 10:00:00"
+        assert pool.get(target)["DateTimeOriginal"] == "2023:01:01 10:00:00"
+        target.write_bytes(b"changed")
+        pool.get(target)
+        pool.close()
+    assert len(queries) == 2
+    assert pool.hits == 1
@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+from PIL import Image
+
+import api
+from sniff import identify_format, sniff_format, read_metadata
+
+
+def create_jpeg(file_path: Path, datetime_str: str, model: str = "Cam"):
+    img = Image.new('RGB', (8, 8), color='red')
+    exif = img.getexif()
+    exif[0x0110] = model
+    exif.get_ifd(0x8769)[0x9003] = datetime_str
+    img.save(file_path, format='JPEG', exif=exif.tobytes())
+
+
+@pytest.mark.parametrize('head, expected', [
+    (b'\xff\xd8\xff\xe1' + b'\x00' * 60, 'jpeg'),
+    (b'\x00\x00\x00\x18ftypheic' + b'\x00' * 52, 'heif'),
+    (b'\x00\x00\x00\x14ftypqt  ' + b'\x00' * 52, 'mov'),
+    (b'\x00\x00\x00\x18ftypisom' + b'\x00' * 52, 'mp4'),
+    (b'II*\x00\x10\x00\x00\x00CR\x02\x00' + b'\x00' * 52, 'cr2'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'webp'),
+    (b'BM\x00\x00\x00\x00\x00\x00\x00\x00\x36\x00\x00\x00\x28\x00\x00\x00', 'bmp'),
+    (b'BM is not a bitmap header at all', None),
+    (b'%PDF-1.7\n', None),
+    (b'', None),
+])
+def test_identify_format(head, expected):
+    assert identify_format(head) == expected
+
+
+def test_jpeg_is_read_without_exiftool(tmp_path):
+    """JPEGはPillowでEXIFを読み、ExifToolを起動しないこと"""
+    path = tmp_path / "photo.bin"
+    create_jpeg(path, "2023:01:02 03:04:05")
+    with patch('subprocess.run') as mock_run:
+        data = read_metadata(path, sniff_format(path))
+    mock_run.assert_not_called()
+    assert data == {"DateTimeOriginal": "2023:01:02 03:04:05", "Model": "Cam"}
+
+
+def test_xmp_only_date_is_read_with_exiftool(tmp_path):
+    """Pillow で開けてもEXIFに撮影日時が無いPNG (XMP のみ) は、ExifToolで読み直すこと"""
+    from PIL.PngImagePlugin import PngInfo
+
+    xmp = (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description xmlns:exif="http://ns.adobe.com/exif/1.0/" exif:DateTimeOriginal="2023-01-02T03:04:05"/>'
+        '</rdf:RDF></x:xmpmeta>'
+    )
+    info = PngInfo()
+    info.add_itxt("XML:com.adobe.xmp", xmp)
+    path = tmp_path / "screenshot.png"
+    Image.new('RGB', (8, 8)).save(path, format='PNG', pnginfo=info)
+
+    with patch('subprocess.run') as mock_run:
+        mock_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:02 03:04:05"}]), stderr="", returncode=0
+        )
+        data = read_metadata(path, sniff_format(path))
+        assert read_metadata(path, 'gif')["DateTimeOriginal"] == "2023:01:02 03:04:05"
+    assert mock_run.call_count == 2
+    assert data == {"DateTimeOriginal": "2023:01:02 03:04:05"}
+
+
+def test_rename_sniff_uses_content_not_suffix(tmp_path):
+    """拡張子が誤っていても内容で判定し、画像でないファイルはExifToolに渡さないこと"""
+    create_jpeg(tmp_path / "IMG_1", "2023:01:02 03:04:05")
+    (tmp_path / "fake.jpg").write_bytes(b"not really an image")
+    heic = tmp_path / "IMG_2.jpg"
+    heic.write_bytes(b'\x00\x00\x00\x18ftypheic' + b'\x00' * 52)
+
+    with patch('subprocess.run') as mock_run:
+        mock_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:05:06 07:08:09", "Model": "Phone"}]), stderr="", returncode=0
+        )
+        results = {r.source.name: r for r in api.rename(str(tmp_path), sniff=True)}
+
+    # ExifToolはHEICの1件だけ
+    assert mock_run.call_count == 1
+    assert results["IMG_1"].target.name == "20230102_0001_Cam"
+    assert results["IMG_2.jpg"].target.name == "20230506_0001_Phone.jpg"
+    assert results["fake.jpg"].reason == api.REASON_UNSUPPORTED
+
+
+def test_organize_sniff_skips_non_media(tmp_path):
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    create_jpeg(source / "IMG_1.dat", "2023:01:02 03:04:05")
+    (source / "notes.jpg").write_bytes(b"hello")
+
+    with patch('subprocess.run') as mock_run:
+        results = {r.source.name: r for r in api.organize(str(source), str(dest), sniff=True)}
+
+    mock_run.assert_not_called()
+    assert results["IMG_1.dat"].target == dest / "2023" / "01" / "IMG_1.dat"
+    assert results["notes.jpg"].reason == api.REASON_UNSUPPORTED
+    assert (source / "notes.jpg").exists()
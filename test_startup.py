@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import cli
+from cli import HELP_IMPORT_BUDGET, COMMAND_IMPORT_BUDGET
+
+REPO_DIR = Path(__file__).resolve().parent
+# 何もしない実行では読み込まないモジュール (プログレスバー、画像の読み込み、プロセスプール、プロファイラー)
+HEAVY_MODULES = {'tqdm', 'PIL', 'concurrent.futures.process', 'cProfile', 'pstats'}
+
+
+def import_profile(*args):
+    """`python -X importtime cli.py args...` を実行し、import にかかった合計時間(秒)と読み込んだモジュールを返す"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', 'cli.py', *args],
+        cwd=REPO_DIR, capture_output=True, text=True,
+    )
+    assert completed.returncode == 0, completed.stderr
+    total, modules = 0, set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        modules.add(name.strip())
+        # 入れ子の import は親の累計に含まれるため、最上位のものだけを足す
+        if not name[1:].startswith(' '):
+            total += int(cumulative_us)
+    return total / 1_000_000, modules
+
+
+def test_help_stays_within_import_budget():
+    elapsed, modules = import_profile('--help')
+    assert elapsed <= HELP_IMPORT_BUDGET, f"--help の import に {elapsed:.3f}秒かかりました (予算 {HELP_IMPORT_BUDGET}秒)"
+    assert not modules & (HEAVY_MODULES | {'rename_images', 'organize_files', 'sqlite3'})
+
+
+@pytest.mark.parametrize('command', ['rename', 'organize'])
+def test_noop_run_stays_within_import_budget(tmp_path, command):
+    if command == 'rename':
+        args = [command, str(tmp_path), '--dry-run', '-q']
+    else:
+        (tmp_path / "dest").mkdir()
+        args = [command, '--source', str(tmp_path), '--destination', str(tmp_path / "dest"), '--dry-run', '-q']
+    elapsed, modules = import_profile(*args)
+    assert elapsed <= COMMAND_IMPORT_BUDGET, f"{command} の import に {elapsed:.3f}秒かかりました (予算 {COMMAND_IMPORT_BUDGET}秒)"
+    assert not modules & HEAVY_MODULES
+
+
+def test_subcommand_receives_remaining_arguments(capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(['rebalance', '--help'])
+    assert excinfo.value.code == 0
+    assert capsys.readouterr().out.startswith('usage: image-renamer rebalance')
+
+
+def test_unknown_command_is_rejected():
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(['bogus'])
+    assert excinfo.value.code == 2
@@ -0,0 +1,120 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import api
+import exiftool_session
+from quarantine import Quarantine
+from results import RunSummary, FileResult, ACTION_RENAME
+
+# "hang" を含むパスでは応答しない、ExifToolの -stay_open モードを模したスクリプト
+FAKE_EXIFTOOL = r'''
+import json, sys, time
+args = []
+for line in sys.stdin:
+    line = line.rstrip("\n")
+    if line == "-execute":
+        if "hang" in args[-1]:
+            time.sleep(60)
+        print(json.dumps([{"SourceFile": args[-1], "DateTimeOriginal": "2023:01:01 10:00:00"}]))
+        print("{ready}", flush=True)
+        args = []
+    elif line == "False":
+        break
+    else:
+        args.append(line)
+'''
+
+
+def exiftool_result(*args, **kwargs):
+    if 'hang' in args[0][-1]:
+        raise subprocess.TimeoutExpired(args[0], kwargs.get('timeout'))
+    return MagicMock(
+        stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+        stderr="",
+        returncode=0
+    )
+
+
+@patch('subprocess.run', side_effect=exiftool_result)
+def test_rename_timeout_is_quarantined(mock_subprocess_run, tmp_path):
+    """制限時間を超えたファイルはエラーになり、隔離リストに追加され、次回はExifToolに渡されないこと"""
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    (photos / "IMG_1.JPG").write_bytes(b"x")
+    (photos / "hang.JPG").write_bytes(b"x")
+    quarantine_file = tmp_path / "quarantine.jsonl"
+
+    results = {r.source.name: r for r in api.rename(str(photos), metadata_timeout=1, quarantine_file=str(quarantine_file))}
+    assert results["hang.JPG"].reason == api.REASON_TIMEOUT
+    assert results["IMG_1.JPG"].action == api.ACTION_RENAME
+    assert mock_subprocess_run.call_args.kwargs['timeout'] == 1
+    assert photos / "hang.JPG" in Quarantine(quarantine_file)
+
+    mock_subprocess_run.reset_mock()
+    results = {r.source.name: r.reason for r in api.rename(str(photos), quarantine_file=str(quarantine_file))}
+    assert results == {"20230101_0001_Cam.jpg": api.REASON_ALREADY_RENAMED, "hang.JPG": api.REASON_QUARANTINED}
+    mock_subprocess_run.assert_not_called()
+
+
+@patch('subprocess.run', side_effect=exiftool_result)
+def test_organize_timeout_is_not_moved(mock_subprocess_run, tmp_path):
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    (source / "hang.MOV").write_bytes(b"x")
+    quarantine_file = tmp_path / "quarantine.jsonl"
+
+    from organize_files import organize_files
+    counts = organize_files(str(source), str(dest), dry_run=False, quiet=True, quarantine_file=str(quarantine_file))
+    assert counts == {'success': 0, 'skip': 0, 'error': 1}
+    assert (source / "hang.MOV").exists()
+    assert Quarantine(quarantine_file).get(source / "hang.MOV")['reason'] == api.REASON_TIMEOUT
+
+
+def test_quarantine_ignores_broken_lines(tmp_path):
+    quarantine_file = tmp_path / "quarantine.jsonl"
+    quarantine_file.write_text('not json\n{"path": "/a/b.jpg", "reason": "timeout"}\n', encoding='utf-8')
+    quarantine = Quarantine(quarantine_file)
+    assert len(quarantine) == 1
+    assert "/a/b.jpg" in quarantine
+
+
+def test_watchdog_kills_and_replaces_hung_session(tmp_path):
+    """応答しないセッションは期限後に強制終了され、後続のファイルは新しいセッションで処理されること"""
+    real_popen = subprocess.Popen
+
+    def fake_popen(command, **kwargs):
+        return real_popen([sys.executable, '-c', FAKE_EXIFTOOL], **kwargs)
+
+    hang = tmp_path / "hang.jpg"
+    ok = tmp_path / "ok.jpg"
+    hang.write_bytes(b"x")
+    ok.write_bytes(b"x")
+    with patch.object(exiftool_session.subprocess, 'Popen', fake_popen), \
+            patch.object(exiftool_session, 'WATCHDOG_INTERVAL_SECONDS', 0.05):
+        pool = exiftool_session.ExifToolPool(size=1)
+        try:
+            with pytest.raises(api.MetadataTimeoutError):
+                pool.get(hang, timeout=0.2)
+            assert pool.get(ok, timeout=5)["DateTimeOriginal"] == "2023:01:01 10:00:00"
+            assert pool.timeouts == 1
+        finally:
+            pool.close()
+
+
+def test_latency_report_per_file_type():
+    summary = RunSummary('rename')
+    for i in range(1, 101):
+        summary.add(FileResult(Path(f"IMG_{i}.JPG"), ACTION_RENAME, timings={'metadata': i / 100}))
+    summary.add(FileResult(Path("clip.mov"), ACTION_RENAME, timings={'metadata': 3.0}))
+
+    report = summary.latency_report()
+    assert report['.jpg'] == {'count': 100, 'p50': 0.5, 'p99': 0.99, 'max': 1.0}
+    assert report['.mov'] == {'count': 1, 'p50': 3.0, 'p99': 3.0, 'max': 3.0}
+    assert summary.to_dict()['metadata_latency'] == report
@@ -0,0 +1,78 @@
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import api
+import fs
+from dest_index import DestinationIndex
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:06:15 10:00:00"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """移動元と移動先が別のデバイスにあるものとして扱う"""
+    monkeypatch.setattr(fs.PosixBackend, 'same_device', staticmethod(lambda path, directory: False))
+
+
+@pytest.fixture
+def library(tmp_path):
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    (source / "IMG_1.JPG").write_bytes(b"jpeg" * 100000)
+    return source, dest
+
+
+def test_verified_copy_records_checksum(mock_exiftool, cross_device, library):
+    source, dest = library
+    run = api.organize(str(source), str(dest), verify=True, use_dest_index=True)
+    result = next(iter(run))
+
+    target = dest / "2023" / "06" / "IMG_1.JPG"
+    assert result.target == target
+    assert target.read_bytes() == b"jpeg" * 100000
+    assert not (source / "IMG_1.JPG").exists()
+    assert result.checksum.startswith("blake2b:")
+    assert run.summary.to_dict()['verified'] == 1
+    assert list((dest / "2023" / "06").iterdir()) == [target]
+
+    index = DestinationIndex(dest)
+    assert index.checksum(target) == result.checksum
+    index.close()
+
+
+def test_mismatch_keeps_source(mock_exiftool, cross_device, library, monkeypatch):
+    """読み戻した内容が一致しなければ、コピー先を消して移動元を残すこと"""
+    source, dest = library
+    hash_into = fs._hash_into
+
+    def corrupt_readback(f, buffer, digest, out=None):
+        hash_into(f, buffer, digest, out)
+        if out is None:
+            digest.update(b"bitrot")
+
+    monkeypatch.setattr(fs, '_hash_into', corrupt_readback)
+    results = list(api.organize(str(source), str(dest), verify=True))
+
+    assert results[0].reason == api.REASON_VERIFY_FAILED
+    assert (source / "IMG_1.JPG").exists()
+    assert list((dest / "2023" / "06").iterdir()) == []
+
+
+def test_same_device_move_is_a_rename(mock_exiftool, library):
+    source, dest = library
+    result = next(iter(api.organize(str(source), str(dest), verify=True)))
+    assert result.status == 'success'
+    assert result.checksum is None
@@ -0,0 +1,82 @@
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+import walker
+from walker import parallel_walk, walk_directories, walk_files
+
+
+def create_tree(root: Path, depth: int = 3, width: int = 3, files_per_dir: int = 4):
+    """テスト用のディレクトリツリーを作成する"""
+    for i in range(files_per_dir):
+        (root / f"IMG_{i}.JPG").write_bytes(b"x" * (i + 1))
+    if depth == 0:
+        return
+    for i in range(width):
+        sub = root / f"dir{i}"
+        sub.mkdir()
+        create_tree(sub, depth - 1, width, files_per_dir)
+
+
+def test_parallel_walk_matches_sequential(tmp_path):
+    create_tree(tmp_path)
+    sequential = set(walk_files(tmp_path))
+    parallel = set(parallel_walk(tmp_path, workers=4))
+    assert parallel == sequential
+    assert len(parallel) == 4 * (1 + 3 + 9 + 27)
+
+
+def test_parallel_walk_reports_sizes(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"12345")
+    assert list(parallel_walk(tmp_path, workers=2)) == [(tmp_path / "a.jpg", 5)]
+
+
+def test_parallel_walk_sorted_is_deterministic(tmp_path):
+    create_tree(tmp_path)
+    first = list(parallel_walk(tmp_path, workers=4, sort=True))
+    second = list(parallel_walk(tmp_path, workers=4, sort=True))
+    assert first == second
+    assert [path for path, _ in first] == sorted(path for path, _ in first)
+
+
+def test_parallel_walk_early_close_stops_workers(tmp_path):
+    """途中で走査をやめてもワーカースレッドが残らないこと"""
+    create_tree(tmp_path)
+    walk = parallel_walk(tmp_path, workers=4)
+    next(walk)
+    walk.close()
+    assert not [t for t in threading.enumerate() if t.name.startswith("walker-")]
+
+
+def test_parallel_walk_reraises_unexpected_errors(tmp_path):
+    """ワーカーで OSError 以外の例外が起きても他のワーカーが待ち続けず、利用側に例外が送出されること"""
+    create_tree(tmp_path)
+    scan = walker._scan_directory
+
+    def failing_scan(directory):
+        if directory.name == "dir1":
+            raise ValueError("broken entry")
+        return scan(directory)
+
+    with patch('walker._scan_directory', side_effect=failing_scan):
+        with pytest.raises(ValueError, match="broken entry"):
+            list(parallel_walk(tmp_path, workers=4))
+    assert not [t for t in threading.enumerate() if t.name.startswith("walker-")]
+
+
+def test_parallel_walk_skips_symlinked_dirs(tmp_path):
+    real = tmp_path / "real"
+    real.mkdir()
+    (real / "a.jpg").write_bytes(b"a")
+    (tmp_path / "link").symlink_to(real, target_is_directory=True)
+    assert [path for path, _ in parallel_walk(tmp_path, workers=2)] == [real / "a.jpg"]
+
+
+def test_walk_directories(tmp_path):
+    (tmp_path / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "x.jpg").write_bytes(b"x")
+    (tmp_path / "link").symlink_to(tmp_path / "b", target_is_directory=True)
+    assert list(walk_directories(tmp_path)) == [tmp_path, tmp_path / "a", tmp_path / "b", tmp_path / "b" / "c"]
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from workqueue import WorkQueue, LeaseKeeper, run_worker, STATE_DONE, STATE_FAILED, STATE_PENDING
+
+
+@pytest.fixture
+def mock_exiftool():
+    with patch('subprocess.run') as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(
+            stdout=json.dumps([{"DateTimeOriginal": "2023:01:01 10:00:00", "Model": "Cam"}]),
+            stderr="",
+            returncode=0
+        )
+        yield mock_subprocess_run
+
+
+def test_enqueue_claim_complete(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite")
+    assert queue.enqueue(["/a", "/b", "/a"]) == 2
+    assert queue.enqueue(["/a"]) == 0
+
+    first = queue.claim()
+    second = queue.claim()
+    assert (first.path, second.path) == ("/a", "/b")
+    assert queue.claim() is None
+    assert queue.complete(first, {'counts': {}})
+    assert not queue.complete(first)
+    assert queue.stats() == {'pending': 0, 'leased': 1, 'done': 1, 'failed': 0}
+    queue.close()
+
+
+def test_expired_lease_is_reclaimed_and_fenced(tmp_path):
+    """期限切れのリースは他のノードが取得し、元の持ち主の延長・完了は受け付けないこと"""
+    node_a = WorkQueue(tmp_path / "queue.sqlite", lease_seconds=0.05, owner="a")
+    node_b = WorkQueue(tmp_path / "queue.sqlite", lease_seconds=10, owner="b")
+    node_a.enqueue(["/photos/2023"])
+
+    stale = node_a.claim()
+    assert node_b.claim() is None
+    time.sleep(0.1)
+    fresh = node_b.claim()
+    assert fresh.path == "/photos/2023" and fresh.attempts == 2
+
+    assert not node_a.heartbeat(stale)
+    assert not node_a.complete(stale)
+    assert node_b.complete(fresh)
+    assert node_b.stats()[STATE_DONE] == 1
+    node_a.close()
+    node_b.close()
+
+
+def test_repeatedly_expired_task_fails(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", lease_seconds=0.01, max_attempts=2)
+    queue.enqueue(["/hang"])
+    for _ in range(2):
+        assert queue.claim() is not None
+        time.sleep(0.02)
+    assert queue.claim() is None
+    assert queue.stats()[STATE_FAILED] == 1
+
+
+def test_fail_and_release(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", max_attempts=2)
+    queue.enqueue(["/a"])
+    lease = queue.claim()
+    assert queue.release(lease)
+    lease = queue.claim()
+    assert lease.attempts == 1
+    queue.fail(lease, "error")
+    assert queue.stats()[STATE_PENDING] == 1
+    queue.fail(queue.claim(), "error")
+    assert queue.stats()[STATE_FAILED] == 1
+
+
+def test_lease_keeper_reports_lost_lease(tmp_path):
+    node_a = WorkQueue(tmp_path / "queue.sqlite", lease_seconds=0.05)
+    node_b = WorkQueue(tmp_path / "queue.sqlite")
+    node_a.enqueue(["/a"])
+    lease = node_a.claim()
+    lost = threading.Event()
+    with LeaseKeeper(node_a, lease, on_lost=lost.set, interval=0.2) as keeper:
+        time.sleep(0.1)
+        node_b.claim()
+        assert lost.wait(2)
+    assert keeper.lost
+
+
+def test_workers_process_each_directory_once(mock_exiftool, tmp_path):
+    """複数ワーカーが同じキューを分担し、各ディレクトリがちょうど1回処理されること"""
+    library = tmp_path / "library"
+    directories = [library / f"day{i}" for i in range(8)]
+    for directory in directories:
+        directory.mkdir(parents=True)
+        (directory / "IMG_1.JPG").write_bytes(b"x")
+        (directory / "IMG_2.JPG").write_bytes(b"x")
+
+    from walker import walk_directories
+    WorkQueue(tmp_path / "queue.sqlite").enqueue(walk_directories(library))
+
+    totals = []
+
+    def worker():
+        queue = WorkQueue(tmp_path / "queue.sqlite")
+        totals.append(run_worker(queue, poll_seconds=0.01))
+        queue.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(t['directories'] for t in totals) == 9
+    assert sum(t['success'] for t in totals) == 16
+    for directory in directories:
+        assert sorted(p.name for p in directory.iterdir()) == ["20230101_0001_Cam.jpg", "20230101_0002_Cam.jpg"]
+    assert WorkQueue(tmp_path / "queue.sqlite").stats()[STATE_DONE] == 9
@@ -1,6 +1,7 @@
 import logging
 import subprocess
 import json
+from contextlib import contextmanager
 
 # EXIF情報のタグ名 (ExifToolのタグ名に合わせる)
 EXIFTOOL_DATETIME_ORIGINAL_TAG = 'DateTimeOriginal'
@@ -17,6 +18,15 @@ SUPPORTED_VIDEO_EXTENSIONS = {
 }
 SUPPORTED_EXTENSIONS = SUPPORTED_IMAGE_EXTENSIONS | SUPPORTED_VIDEO_EXTENSIONS
 
+# 1ファイルのメタデータ読み取りの制限時間（秒）
+DEFAULT_METADATA_TIMEOUT = 30
+
+class MetadataTimeoutError(TimeoutError):
+    """メタデータの読み取りが制限時間内に終わらなかった"""
+
+class ExifToolError(Exception):
+    """ExifToolの実行・出力の読み取りに失敗した (raise_errors を指定した場合のみ送出する。ログは出力済み)"""
+
 def setup_logging(log_file=None):
     """ロギングを設定する。コンソールと、指定されていればファイルにも出力する。"""
     logging.basicConfig(
@@ -31,26 +41,94 @@ def setup_logging(log_file=None):
         file_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
         logging.getLogger().addHandler(file_handler)
 
-def get_exif_data_with_exiftool(file_path):
-    """ExifToolを使ってEXIFデータをJSON形式で取得する"""
+class _BufferingHandler(logging.Handler):
+    """ログを (レベル, メッセージ) のリストに溜めるハンドラー"""
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+@contextmanager
+def capture_logs(level=logging.INFO):
+    """ブロック内のログを出力せずに溜め、(レベル, メッセージ) のリストとして返す"""
+    records = []
+    handler = _BufferingHandler(records)
+    handler.setLevel(level)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        yield records
+    finally:
+        root.removeHandler(handler)
+
+# 常駐中のExifToolセッションのプール（serve モードで設定される）
+_exiftool_pool = None
+
+def set_exiftool_pool(pool):
+    """get_exif_data_with_exiftool が使うExifToolセッションのプールを設定する。None で解除する。"""
+    global _exiftool_pool
+    _exiftool_pool = pool
+
+def get_exif_data_with_exiftool(file_path, timeout: float = DEFAULT_METADATA_TIMEOUT, raise_errors: bool = False):
+    """
+    ExifToolを使ってEXIFデータをJSON形式で取得する。
+    timeout 秒以内に終わらなければExifToolを強制終了し、MetadataTimeoutError を送出する。
+    ExifToolの失敗はログに出力して空の辞書を返す。raise_errors が True の場合は ExifToolError を送出する
+    (同時実行数のコントローラーに失敗として記録させるため)。
+    """
+    if _exiftool_pool is not None:
+        try:
+            return _exiftool_pool.get(file_path, timeout)
+        except MetadataTimeoutError:
+            raise
+        except (OSError, RuntimeError, ValueError) as e:
+            return _exiftool_failed(f"ExifToolのセッションでの読み取りに失敗しました ({file_path}): {e}", raise_errors)
+
+    return _run_exiftool(str(file_path), file_path, timeout, raise_errors=raise_errors)
+
+
+def get_exif_data_from_bytes(data: bytes, label, timeout: float = DEFAULT_METADATA_TIMEOUT, raise_errors: bool = False):
+    """
+    ファイルの先頭部分などのバイト列を標準入力からExifToolに渡し、EXIFデータを取得する。
+    label はログに出すファイルの名前。セッションプールは使わない。raise_errors は get_exif_data_with_exiftool と同じ。
+    """
+    return _run_exiftool('-', label, timeout, data, raise_errors)
+
+
+def _exiftool_failed(message: str, raise_errors: bool) -> dict:
+    logging.error(message)
+    if raise_errors:
+        raise ExifToolError(message)
+    return {}
+
+
+def _run_exiftool(target: str, label, timeout: float, input_bytes: bytes = None, raise_errors: bool = False):
     try:
-        command = ['exiftool', '-json', '-s', '-d', '%Y:%m:%d %H:%M:%S', str(file_path)]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        exif_json = result.stdout
+        command = ['exiftool', '-json', '-s', '-d', '%Y:%m:%d %H:%M:%S', target]
+        if input_bytes is None:
+            result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=timeout)
+            exif_json = result.stdout
+        else:
+            result = subprocess.run(command, capture_output=True, input=input_bytes, check=True, timeout=timeout)
+            exif_json = result.stdout.decode('utf-8', errors='replace')
         data = json.loads(exif_json)
         if data:
             return data[0]
         return {}
     except FileNotFoundError:
-        logging.error(
+        return _exiftool_failed(
             "ExifToolが見つかりません。インストールされているか確認してください。\n"
             "  - macOS: brew install exiftool\n"
-            "  - Debian/Ubuntu: sudo apt-get install -y libimage-exiftool-perl"
+            "  - Debian/Ubuntu: sudo apt-get install -y libimage-exiftool-perl",
+            raise_errors,
         )
-        return {}
+    except subprocess.TimeoutExpired:
+        raise MetadataTimeoutError(f"ExifToolが {timeout}秒以内に終了しませんでした ({label})")
     except subprocess.CalledProcessError as e:
-        logging.error(f"ExifToolの実行に失敗しました ({file_path}): {e.stderr if e.stderr else str(e)}")
-        return {}
+        stderr = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
+        return _exiftool_failed(f"ExifToolの実行に失敗しました ({label}): {stderr if stderr else str(e)}", raise_errors)
     except json.JSONDecodeError as e:
-        logging.error(f"ExifToolの出力をJSON形式でパースできませんでした ({file_path}): {e}")
-        return {}
+        return _exiftool_failed(f"ExifToolの出力をJSON形式でパースできませんでした ({label}): {e}", raise_errors)
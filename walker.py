@@ -0,0 +1,171 @@
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+import fs
+
+# 定数定義
+OUTPUT_QUEUE_SIZE = 10000  # 走査結果を処理側へ渡すキューの上限
+IDLE_WAIT_SECONDS = 0.05  # 仕事が無いワーカーの待機間隔
+_DONE = object()
+
+
+class _WalkerError:
+    """ワーカーで発生した例外を、出力キューを通して利用側へ渡すための入れ物"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _scan_directory(directory: Path):
+    """1ディレクトリを読み取り、(サブディレクトリ一覧, (ファイルパス, サイズ)一覧) を返す"""
+    subdirs = []
+    files = []
+    try:
+        entries = sorted(fs.scandir(directory), key=lambda e: e.name)
+    except OSError as e:
+        logging.error(f"エラー: ディレクトリ '{directory}' を読み取れません: {e}")
+        return subdirs, files
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(Path(entry.path))
+            elif entry.is_file():
+                files.append((Path(entry.path), entry.stat().st_size))
+        except OSError as e:
+            logging.error(f"エラー: '{entry.path}' の情報を取得できません: {e}")
+    return subdirs, files
+
+
+def walk_files(root: Path):
+    """ディレクトリを再帰的に走査し、(ファイルパス, サイズ) を返す。サイズは走査時に取得する。"""
+    stack = [Path(root)]
+    while stack:
+        subdirs, files = _scan_directory(stack.pop())
+        yield from files
+        stack.extend(reversed(subdirs))
+
+
+def walk_directories(root: Path):
+    """root とその配下のディレクトリを深さ優先・名前順に返す。シンボリックリンクは辿らない。"""
+    stack = [Path(root)]
+    while stack:
+        directory = stack.pop()
+        yield directory
+        try:
+            subdirs = sorted(Path(entry.path) for entry in fs.scandir(directory) if entry.is_dir(follow_symlinks=False))
+        except OSError as e:
+            logging.error(f"エラー: ディレクトリ '{directory}' を読み取れません: {e}")
+            continue
+        stack.extend(reversed(subdirs))
+
+
+class _WorkStealingWalker:
+    """
+    ワーカーごとにディレクトリの両端キューを持ち、自分のキューは末尾から (深さ優先)、
+    仕事が無くなったら他のワーカーのキューの先頭から (浅い＝大きな部分木を) 奪って走査する。
+    """
+
+    def __init__(self, root: Path, workers: int):
+        self.workers = workers
+        self.deques = [deque() for _ in range(workers)]
+        self.deques[0].append(Path(root))
+        self.outstanding = 1  # 未走査のディレクトリ数
+        self.lock = threading.Lock()
+        self.work_available = threading.Condition(self.lock)
+        self.output = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.finished = 0
+        self.threads = [
+            threading.Thread(target=self._run, args=(i,), name=f"walker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def _take(self, index: int):
+        try:
+            return self.deques[index].pop()
+        except IndexError:
+            pass
+        for offset in range(1, self.workers):
+            victim = self.deques[(index + offset) % self.workers]
+            try:
+                return victim.popleft()
+            except IndexError:
+                continue
+        return None
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.output.put(item, timeout=IDLE_WAIT_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self, index: int):
+        try:
+            while not self.stop.is_set():
+                directory = self._take(index)
+                if directory is None:
+                    with self.work_available:
+                        if self.outstanding == 0:
+                            break
+                        self.work_available.wait(IDLE_WAIT_SECONDS)
+                    continue
+
+                subdirs, files = [], []
+                try:
+                    subdirs, files = _scan_directory(directory)
+                finally:
+                    # 他のワーカーに奪われる前に未走査数へ加算しておく。
+                    # 走査が例外で失敗しても未走査数を減らし、他のワーカーが待ち続けないようにする
+                    with self.work_available:
+                        self.outstanding += len(subdirs) - 1
+                        self.deques[index].extend(reversed(subdirs))
+                        if subdirs or self.outstanding == 0:
+                            self.work_available.notify_all()
+                for item in files:
+                    self._put(item)
+        except Exception as e:
+            # OSError 以外の例外は握りつぶさず、利用側で送出させる
+            self._put(_WalkerError(e))
+        finally:
+            with self.lock:
+                self.finished += 1
+                last = self.finished == self.workers
+            if last:
+                self._put(_DONE)
+
+    def __iter__(self):
+        for thread in self.threads:
+            thread.start()
+        try:
+            while True:
+                item = self.output.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _WalkerError):
+                    raise item.error
+                yield item
+        finally:
+            self.stop.set()
+            for thread in self.threads:
+                thread.join()
+
+
+def parallel_walk(root, workers: int = 1, sort: bool = False):
+    """
+    ディレクトリを並列に走査し、見つかったファイルを (ファイルパス, サイズ) として順次返す。
+    NFS/SMBのように readdir ごとの往復遅延が大きい環境で、複数ディレクトリを同時に読み取る。
+    sort が True の場合は全件を走査してからパス順に返す (出力順が決定的になる)。
+    """
+    if sort:
+        yield from sorted(parallel_walk(root, workers, sort=False))
+        return
+    if workers <= 1:
+        yield from walk_files(root)
+        return
+    yield from _WorkStealingWalker(Path(root), workers)
@@ -0,0 +1,332 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils import setup_logging, DEFAULT_METADATA_TIMEOUT
+from walker import walk_directories
+from rename_images import rename_run
+
+# 定数定義
+DEFAULT_LEASE_SECONDS = 300  # リースの有効期間。この間にハートビートが無ければ他のノードが再処理する
+DEFAULT_MAX_ATTEMPTS = 3  # 1ディレクトリを処理する最大試行回数
+DEFAULT_POLL_SECONDS = 5  # 取得できるタスクが無いときの待機間隔
+ENQUEUE_BATCH_SIZE = 1000  # 1トランザクションで登録するディレクトリ数
+
+STATE_PENDING = 'pending'
+STATE_LEASED = 'leased'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+STATES = (STATE_PENDING, STATE_LEASED, STATE_DONE, STATE_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+"""
+
+# 取得したリース。token は取得のたびに変わり、期限切れ後に他のノードが取得したリースと区別する
+Lease = namedtuple('Lease', ['task_id', 'path', 'token', 'attempts'])
+
+
+class WorkQueue:
+    """
+    複数ノードで1つのライブラリを分担処理するための、SQLiteファイル上の作業キュー。
+    ディレクトリ単位のタスクをリース (期限付きの貸し出し) で配り、ハートビートで延長する。
+    ノードが停止して期限が切れたリースは、次に取得したノードが再処理する。
+    完了・失敗の記録はリースの token が一致する場合にのみ受け付けるため、
+    期限切れ後に再取得されたタスクの結果を古いリースの持ち主が上書きすることはない。
+    """
+
+    def __init__(self, queue_file, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, owner: str = None):
+        self.path = Path(queue_file)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, isolation_level=None, check_same_thread=False)
+        # ネットワークファイルシステム上でも使えるよう、WALではなくロールバックジャーナルを使う
+        self._conn.execute('PRAGMA journal_mode=DELETE')
+        self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def enqueue(self, paths) -> int:
+        """ディレクトリをタスクとして登録し、新たに登録した件数を返す。登録済みのものは無視する"""
+        added = 0
+        batch = []
+
+        def flush():
+            nonlocal added
+            now = time.time()
+            with self._transaction() as conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (path, updated_at) VALUES (?, ?)",
+                    ((p, now) for p in batch)
+                )
+                added += conn.total_changes - before
+            batch.clear()
+
+        for path in paths:
+            batch.append(str(path))
+            if len(batch) >= ENQUEUE_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        return added
+
+    def claim(self):
+        """未処理、またはリースの期限が切れたタスクを1件取得する。無ければ None を返す"""
+        now = time.time()
+        with self._transaction() as conn:
+            # 期限切れを繰り返したタスクは、処理を止める原因になっている可能性があるため失敗扱いにする
+            conn.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, token = NULL, error = ?, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (STATE_FAILED, 'リースの期限切れが上限回数に達しました', now, STATE_LEASED, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id, path, attempts FROM tasks "
+                "WHERE state = ? OR (state = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (STATE_PENDING, STATE_LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            task_id, path, attempts = row
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE tasks SET state = ?, owner = ?, token = ?, lease_expires = ?, attempts = ?, updated_at = ? "
+                "WHERE id = ?",
+                (STATE_LEASED, self.owner, token, now + self.lease_seconds, attempts + 1, now, task_id)
+            )
+        return Lease(task_id, path, token, attempts + 1)
+
+    def _update_lease(self, lease: Lease, assignments: str, params) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE tasks SET {assignments}, updated_at = ? WHERE id = ? AND token = ? AND state = ?",
+                (*params, time.time(), lease.task_id, lease.token, STATE_LEASED)
+            )
+            return cursor.rowcount == 1
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """リースを延長する。既に他のノードに取得されていれば False を返す"""
+        return self._update_lease(lease, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, lease: Lease, result: dict = None) -> bool:
+        """タスクを完了にする。リースを失っていれば何もせず False を返す"""
+        return self._update_lease(
+            lease, "state = ?, token = NULL, lease_expires = NULL, result = ?, error = NULL",
+            (STATE_DONE, json.dumps(result, ensure_ascii=False) if result is not None else None)
+        )
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        """タスクの失敗を記録する。試行回数が上限未満なら再処理の対象に戻す"""
+        state = STATE_FAILED if lease.attempts >= self.max_attempts else STATE_PENDING
+        return self._update_lease(lease, "state = ?, token = NULL, lease_expires = NULL, error = ?", (state, error))
+
+    def release(self, lease: Lease) -> bool:
+        """処理を中断したタスクを、試行回数を数えずに未処理へ戻す"""
+        return self._update_lease(
+            lease, "state = ?, token = NULL, lease_expires = NULL, attempts = attempts - 1", (STATE_PENDING,)
+        )
+
+    def requeue_expired(self) -> int:
+        """リースの期限が切れたタスクを未処理に戻し、その件数を返す"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, token = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts < ?",
+                (STATE_PENDING, now, STATE_LEASED, now, self.max_attempts)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """状態ごとのタスク数を返す"""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def has_unfinished(self) -> bool:
+        """未処理または処理中のタスクが残っているか"""
+        counts = self.stats()
+        return counts[STATE_PENDING] + counts[STATE_LEASED] > 0
+
+    def close(self):
+        self._conn.close()
+
+
+class LeaseKeeper:
+    """処理中のリースを定期的に延長するスレッド。延長できなかった場合は on_lost を呼び出す"""
+
+    def __init__(self, queue: WorkQueue, lease: Lease, on_lost=None, interval: float = None):
+        self.queue = queue
+        self.lease = lease
+        self.on_lost = on_lost
+        self.interval = interval if interval is not None else queue.lease_seconds / 3
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                alive = self.queue.heartbeat(self.lease)
+            except sqlite3.Error as e:
+                logging.warning(f"リースを延長できませんでした ({self.lease.path}): {e}")
+                continue
+            if not alive:
+                self.lost = True
+                if self.on_lost:
+                    self.on_lost()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(queue: WorkQueue, wait: bool = False, poll_seconds: float = DEFAULT_POLL_SECONDS,
+               max_tasks: int = None, **rename_options) -> dict:
+    """
+    キューからディレクトリのリースを取得し、1件ずつリネームする (サブディレクトリは別タスク)。
+    他のノードのリースが残っている間は、期限切れに備えて待機しながら取得を繰り返す。
+    wait が True の場合はキューが空になっても終了せず、新しいタスクを待ち続ける。
+    rename_options は iter_rename_results の引数。処理したディレクトリ数と件数の合計を返す。
+    """
+    totals = {'directories': 0, 'success': 0, 'skip': 0, 'error': 0}
+    while max_tasks is None or totals['directories'] < max_tasks:
+        lease = queue.claim()
+        if lease is None:
+            if wait or queue.has_unfinished():
+                time.sleep(poll_seconds)
+                continue
+            break
+
+        logging.info(f"リースを取得しました: '{lease.path}' (試行 {lease.attempts}回目)")
+        run = rename_run(lease.path, **rename_options)
+        try:
+            with LeaseKeeper(queue, lease, on_lost=run.cancel) as keeper:
+                for result in run:
+                    logging.log(result.level, result.message)
+        except (KeyboardInterrupt, SystemExit):
+            queue.release(lease)
+            raise
+        except Exception as e:
+            logging.error(f"エラー: '{lease.path}' の処理に失敗しました: {e}")
+            queue.fail(lease, str(e))
+            continue
+
+        if keeper.lost:
+            logging.warning(f"リースを失ったため '{lease.path}' の処理を中断しました（他のノードが再処理します）。")
+            continue
+        if not queue.complete(lease, run.summary.to_dict()):
+            logging.warning(f"リースの期限が切れていたため '{lease.path}' の完了を記録できませんでした。")
+            continue
+        totals['directories'] += 1
+        for status, count in run.summary.counts.items():
+            totals[status] += count
+    return totals
+
+
+def main(argv=None, prog: str = None):
+    """コマンドラインから実行する。argv を省略した場合は sys.argv の引数を使う"""
+    default_queue = os.getenv('QUEUE_FILE')
+    default_lease_seconds = float(os.getenv('QUEUE_LEASE_SECONDS', str(DEFAULT_LEASE_SECONDS)))
+    default_log_file = os.getenv('QUEUE_LOG_FILE')
+
+    parser = argparse.ArgumentParser(prog=prog, description='複数ノードで1つのライブラリを分担してリネームするための作業キューを操作します。')
+    parser.add_argument('--queue', default=default_queue, required=default_queue is None, help=f'作業キューのSQLiteファイル。全ノードから同じファイルを参照します。デフォルト: {default_queue}')
+    parser.add_argument('--lease-seconds', type=float, default=default_lease_seconds, help=f'リースの有効期間(秒)。デフォルト: {default_lease_seconds}')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help=f'1ディレクトリの最大試行回数。デフォルト: {DEFAULT_MAX_ATTEMPTS}')
+    parser.add_argument('--log-file', default=default_log_file, help=f'ログをファイルに出力します。デフォルト: {default_log_file}')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='ディレクトリを走査してタスクを登録します（コーディネーター）。')
+    enqueue_parser.add_argument('directories', nargs='+', help='登録するルートディレクトリ。配下のディレクトリもすべて登録します。')
+
+    work_parser = subparsers.add_parser('work', help='タスクを取得してリネームします（ワーカー）。')
+    work_parser.add_argument('--dry-run', action='store_true', help='プレビューのみ表示します。')
+    work_parser.add_argument('--force', action='store_true', help='リネーム済みのファイルも再処理します。')
+    work_parser.add_argument('--lock', action='store_true', help='ディレクトリごとのロックファイルで連番を予約します。')
+    work_parser.add_argument('--max-concurrency', type=int, default=1, help='EXIF読み取りの最大同時実行数。デフォルト: 1')
+    work_parser.add_argument('--metadata-timeout', type=float, default=DEFAULT_METADATA_TIMEOUT, help=f'1ファイルのEXIF読み取りの制限時間(秒)。デフォルト: {DEFAULT_METADATA_TIMEOUT}')
+    work_parser.add_argument('--quarantine-file', help='制限時間を超えたファイルを記録する隔離リストのパス')
+    work_parser.add_argument('--sniff', action='store_true', help='拡張子ではなくファイルの先頭バイトで形式を判定します。')
+    work_parser.add_argument('--wait', action='store_true', help='キューが空になっても終了せず、新しいタスクを待ちます。')
+    work_parser.add_argument('--poll-seconds', type=float, default=DEFAULT_POLL_SECONDS, help=f'タスクが無いときの待機間隔(秒)。デフォルト: {DEFAULT_POLL_SECONDS}')
+
+    subparsers.add_parser('status', help='状態ごとのタスク数を表示し、期限切れのリースを未処理に戻します。')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file)
+    queue = WorkQueue(args.queue, args.lease_seconds, args.max_attempts)
+    try:
+        if args.action == 'enqueue':
+            for directory in args.directories:
+                if not Path(directory).is_dir():
+                    parser.error(f"指定されたパス '{directory}' はディレクトリではありません。")
+                added = queue.enqueue(walk_directories(Path(directory).resolve()))
+                logging.info(f"'{directory}' から {added}件のディレクトリを登録しました。")
+        elif args.action == 'work':
+            totals = run_worker(
+                queue, wait=args.wait, poll_seconds=args.poll_seconds,
+                dry_run=args.dry_run, force=args.force, lock=args.lock,
+                max_concurrency=args.max_concurrency,
+                metadata_timeout=args.metadata_timeout, quarantine_file=args.quarantine_file,
+                sniff=args.sniff,
+            )
+            logging.info(
+                f"ワーカーを終了します。{totals['directories']}ディレクトリ: "
+                f"成功 {totals['success']}件, スキップ {totals['skip']}件, エラー {totals['error']}件"
+            )
+        requeued = queue.requeue_expired()
+        if requeued:
+            logging.info(f"期限切れのリース {requeued}件を未処理に戻しました。")
+        counts = queue.stats()
+        logging.info(
+            f"キューの状態: 未処理 {counts[STATE_PENDING]}件, 処理中 {counts[STATE_LEASED]}件, "
+            f"完了 {counts[STATE_DONE]}件, 失敗 {counts[STATE_FAILED]}件"
+        )
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()